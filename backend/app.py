@@ -1,37 +1,43 @@
-# Increase CSV field size limit for large encrypted files - MUST be set before importing csv
-import csv
-import sys
-# Set to maximum possible value to handle large encrypted messages
-csv.field_size_limit(sys.maxsize)
-
-
-from flask import Flask, request, jsonify, session, render_template, redirect, url_for, send_file, flash
+from flask import (Blueprint, Flask, Response, request, jsonify, session, render_template, redirect, url_for, flash,
+                   stream_with_context)
+from flask.helpers import get_debug_flag
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 from werkzeug.utils import secure_filename
 import os
 import io
+import base64
+import mimetypes
 import threading
+import time
 import logging
 from datetime import datetime
 
-from cryptography.fernet import Fernet
-from web3 import Web3
 import json
 import hashlib
-from PIL import Image
 import tempfile
 from dotenv import load_dotenv
 from blockchain import AdvancedBlockchain
-from google_drive import GoogleDriveStorage
-from utils import encrypt_data, decrypt_data, ENCRYPTION_KEY
+from google_drive import get_google_drive
+from message_store import create_message_store
+from blob_store import BlobStore
+from blob_cache import BlobCache
+from storage_backends import DriveBackend, IPFSBackend, LocalBackend, TieredStorage
+from user_store import UserDirectory
+from block_producer import BlockProducer
+from unlock_scheduler import UnlockScheduler, unlock_timestamp
+from events import EventBroker, format_sse
+from utils import (encrypt_stream, decrypt_stream, decrypt_range, iter_chunks, FileTooLarge, BatchCryptoService,
+                   get_ipfs_client, KEY_RING)
+from key_rotation import ReencryptionJob
+from mining import merkle_root
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
-app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')
+# Every view; create_app() registers the blueprint on the app it builds
+views = Blueprint('views', __name__)
+
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -41,41 +47,187 @@ logger = logging.getLogger(__name__)
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'zip'}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+# Most blocks returned by one /chain/blocks or /chain/headers page
+CHAIN_PAGE_LIMIT = int(os.getenv('CHAIN_PAGE_LIMIT', 1000))
+# Seconds between keep-alive comments on idle event streams
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', 15))
+
+# Shared services, created once per process by init_services()
+blob_store = None
+reencryption_job = None
+user_directory = None
+message_store = None
+blockchain = None
+google_drive = None
+blob_cache = None
+crypto_service = None
+block_producer = None
+event_broker = None
+unlock_scheduler = None
+tiered_storage = None
+_services_lock = threading.Lock()
+
+
+def record_sealed_block(block):
+    """Store the block hash on every message confirmed in ``block``"""
+    for transaction in block.transactions:
+        if transaction.get('id'):
+            message_store.update(transaction['id'], tx_hash=block.hash)
+
+
+def record_missed_seals():
+    """Fill in the block hash of messages whose block was sealed just before a restart"""
+    for row in message_store.list_unsealed_rows():
+        location = blockchain.find_transaction(row['tx_id'])
+        if location is not None:
+            message_store.update(row['id'], tx_hash=location[0].hash)
+
+
+def publish_unlocks(rows):
+    """Notify the sender and receiver of each message the scheduler just unlocked"""
+    for row in rows:
+        event_broker.publish([row['user_id'], row['receiver_wallet']], 'unlocked', {
+            'id': row['id'],
+            'status': row['status'],
+            'unlock_time': row['unlock_time']
+        })
 
-# Create upload folder
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Encryption key - use fixed key for consistency
+def message_content_hash(row):
+    """SHA-256 of a message's plaintext, from its blob reference or its chain transaction"""
+    if row.get('blob_ref'):
+        return row['blob_ref']
+    transaction = blockchain.get_message_by_id(int(row['id']))
+    return transaction.get('message_hash') if transaction else None
+
+
+def init_services():
+    """Create the shared services and start their background workers, once per process"""
+    global blob_store, reencryption_job, user_directory, message_store, blockchain, google_drive, blob_cache
+    global crypto_service, block_producer, event_broker, unlock_scheduler, tiered_storage
+
+    if blob_store is not None:
+        return
+    with _services_lock:
+        if blob_store is not None:
+            return
+
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        store = BlobStore()
+        user_directory = UserDirectory()
+        message_store = create_message_store(blob_store=store)
+        blockchain = AdvancedBlockchain()
+        # Connects to Drive on first use
+        google_drive = get_google_drive()
+        # Local copies of Google Drive payloads, so repeat reads skip the network
+        blob_cache = BlobCache()
+        # Decrypts batches of payloads in parallel, off the request thread
+        crypto_service = BatchCryptoService()
+
+        # Transactions journaled before a crash are pending again; blocks sealed
+        # without reaching record_sealed_block get their hashes recorded here
+        record_missed_seals()
+        block_producer = BlockProducer(blockchain, on_sealed=record_sealed_block)
+        block_producer.start()
+
+        event_broker = EventBroker()
+        # Reveals messages as their unlock time passes; views only read the status
+        unlock_scheduler = UnlockScheduler(message_store, on_unlocked=publish_unlocks)
+        unlock_scheduler.start()
+
+        # Local blobs, plus Drive and IPFS tiers read through the local cache. With
+        # STORAGE_OFFLOAD set, cold payloads move to that tier in the background.
+        tiered_storage = TieredStorage(
+            [LocalBackend(store), DriveBackend(google_drive, blob_cache), IPFSBackend(get_ipfs_client(), blob_cache)],
+            message_store,
+            offload=os.getenv('STORAGE_OFFLOAD') or None,
+            content_hash_for=message_content_hash
+        )
+        if tiered_storage.offload_backend is not None:
+            tiered_storage.start()
+
+        # While older keys are still configured, move stored, remote and cached payloads onto the newest one
+        reencryption_job = ReencryptionJob(store, tiered_storage=tiered_storage, blob_cache=blob_cache)
+        if KEY_RING.rotating:
+            reencryption_job.start()
+
+        # Assigned last: it marks the services as ready
+        blob_store = store
+
+
+# Web3 integration (optional), imported and connected on first use
+INFURA_URL = os.getenv('INFURA_URL')
+_w3 = None
+_w3_checked = False
+_w3_lock = threading.Lock()
+
+
+def get_web3():
+    """Return a connected Web3 client for INFURA_URL, or None; the connection is attempted once"""
+    global _w3, _w3_checked
+    if not INFURA_URL:
+        return None
+    with _w3_lock:
+        if not _w3_checked:
+            _w3_checked = True
+            try:
+                from web3 import Web3
+                w3 = Web3(Web3.HTTPProvider(INFURA_URL))
+                if w3.is_connected():
+                    logger.info("Connected to Ethereum network")
+                    _w3 = w3
+                else:
+                    logger.warning("Failed to connect to Ethereum network")
+            except Exception as e:
+                logger.error(f"Ethereum connection error: {e}")
+        return _w3
 
-# File paths
-USERS_CSV = os.path.join(os.path.dirname(__file__), '..', 'storage', 'users.csv')
-MESSAGES_CSV = os.path.join(os.path.dirname(__file__), '..', 'storage', 'messages.csv')
 
-# Thread locks for CSV operations
-csv_locks = {
-    'users': threading.Lock(),
-    'messages': threading.Lock()
-}
+def open_encrypted_content(row):
+    """Open the encrypted payload referenced by a message row as a binary file object"""
+    if row.get('ipfs_hash') or row.get('blob_ref'):
+        return tiered_storage.open(row)
+    # Fallback to legacy inline encrypted content
+    return io.BytesIO(row['encrypted_message'].encode())
 
-# Initialize services
-blockchain = AdvancedBlockchain()
-google_drive = GoogleDriveStorage()
 
-# Web3 integration (optional)
-INFURA_URL = os.getenv('INFURA_URL')
-if INFURA_URL:
-    try:
-        w3 = Web3(Web3.HTTPProvider(INFURA_URL))
-        if w3.is_connected():
-            logger.info("Connected to Ethereum network")
-        else:
-            logger.warning("Failed to connect to Ethereum network")
-            w3 = None
-    except Exception as e:
-        logger.error(f"Ethereum connection error: {e}")
-        w3 = None
-else:
-    w3 = None
+def iter_message_content(row):
+    """Yield the decrypted content of a message chunk by chunk"""
+    with open_encrypted_content(row) as source:
+        yield from decrypt_stream(source)
+
+
+def iter_message_range(row, start, stop):
+    """Yield decrypted bytes ``start`` to ``stop - 1`` of a message"""
+    with open_encrypted_content(row) as source:
+        yield from decrypt_range(source, start, stop)
+
+
+def read_message_content(row):
+    """Decrypt a whole message into memory; for text and inline previews"""
+    return b''.join(iter_message_content(row))
+
+
+def store_encrypted(chunks):
+    """Encrypt plaintext chunks straight into the blob store.
+
+    The blob is keyed by the SHA-256 of the plaintext, computed on the way
+    through; returns ``(content_hash, size)``. The blob stays pinned against
+    deletion until the caller has inserted the message referencing it and
+    calls ``blob_store.unpin(content_hash)``.
+    """
+    digest = hashlib.sha256()
+    size = 0
+
+    def hashed():
+        nonlocal size
+        for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+            yield chunk
+
+    content_hash = blob_store.put_stream(encrypt_stream(hashed()), digest.hexdigest, pin=True)
+    return content_hash, size
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -89,68 +241,23 @@ def get_file_type(filename):
     else:
         return 'file'
 
-@app.route('/')
+@views.route('/')
 def index():
     if 'user_id' in session:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('.dashboard'))
     return render_template('index.html')
 
 
-@app.route('/dashboard')
+@views.route('/dashboard')
 def dashboard():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
 
     try:
-        # Get all messages for the user
-        all_messages = []
-        with csv_locks['messages']:
-            if os.path.exists(MESSAGES_CSV):
-                with open(MESSAGES_CSV, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    all_messages = list(reader)
-
-        # Filter messages for current user - be more flexible to match both numeric ID and wallet address
+        # Get messages sent by the user or addressed to their wallet
         current_user_id = session.get('user_id')
         user_wallet = session.get('wallet_address') or session.get('user_id')
-        
-        # Also try to match by numeric ID if user_id is a wallet address, or vice versa
-        messages = []
-        for row in all_messages:
-            # Check by user_id (exact match)
-            if row.get('user_id') == current_user_id:
-                messages.append(row)
-            # Check by receiver_wallet
-            elif row.get('receiver_wallet') == user_wallet:
-                messages.append(row)
-            # Check if current_user_id is numeric and matches numeric user_id in CSV
-            elif current_user_id and current_user_id.isdigit() and row.get('user_id') == current_user_id:
-                messages.append(row)
-            # Check if user_id in CSV is numeric and matches current session user_id
-            elif row.get('user_id') and row.get('user_id').isdigit() and str(row.get('user_id')) == str(current_user_id):
-                messages.append(row)
-
-        # Auto-reveal messages that are ready
-        updated = False
-        for row in messages:
-            try:
-                reveal_time = datetime.fromisoformat(row['unlock_time'])
-                can_reveal = datetime.now() >= reveal_time
-                if can_reveal and row['status'] == 'locked':
-                    row['status'] = 'revealed'
-                    updated = True
-                    logger.info(f"Auto-revealed message {row['id']} for user {session['user_id']}")
-            except ValueError as e:
-                logger.error(f"Error parsing unlock_time for message {row['id']}: {e}")
-                continue
-
-        # Save updated messages back to CSV if any were updated
-        if updated:
-            with csv_locks['messages']:
-                with open(MESSAGES_CSV, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.DictWriter(f, fieldnames=['id', 'user_id', 'receiver_wallet', 'ipfs_hash', 'message_type', 'unlock_time', 'created_time', 'status', 'encrypted_message', 'tx_hash'])
-                    writer.writeheader()
-                    writer.writerows(all_messages)
+        messages = message_store.list_for_user(current_user_id, user_wallet)
 
         total_messages = len(messages)
         locked_count = sum(1 for message in messages if message.get('status') == 'locked')
@@ -165,7 +272,7 @@ def dashboard():
 
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@views.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form.get('email', '').strip()
@@ -173,30 +280,20 @@ def login():
 
         logger.info(f"Login attempt for email: {email}")
 
-        with csv_locks['users']:
-            if not os.path.exists(USERS_CSV):
-                logger.error(f"Users CSV not found at: {USERS_CSV}")
-                return render_template('login.html', error='User database not found')
-
-            with open(USERS_CSV, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    logger.info(f"Checking row: email={row.get('email')}, password_hash present={bool(row.get('password_hash'))}")
-                    if row['email'].strip() == email and check_password_hash(row['password_hash'], password):
-                        session['user_id'] = row['id']
-                        session['user_name'] = row['name']
-                        session['wallet_address'] = row.get('wallet_address', '')
-                        logger.info(f"Login successful for user: {row['name']}")
-                        return redirect(url_for('dashboard'))
-
-
+        user = user_directory.authenticate(email, password)
+        if user:
+            session['user_id'] = user['id']
+            session['user_name'] = user['name']
+            session['wallet_address'] = user.get('wallet_address', '')
+            logger.info(f"Login successful for user: {user['name']}")
+            return redirect(url_for('.dashboard'))
 
         logger.info("Login failed: Invalid credentials")
         return render_template('login.html', error='Invalid credentials')
 
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@views.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         name = request.form['name']
@@ -204,36 +301,21 @@ def register():
         password = request.form['password']
         wallet_address = request.form.get('wallet_address', '')
 
-        with csv_locks['users']:
-            # Check if user already exists
-            if os.path.exists(USERS_CSV):
-                with open(USERS_CSV, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        if row['email'] == email:
-                            return render_template('register.html', error='Email already exists')
-
-            # Get next user ID
-            user_id = 1
-            if os.path.exists(USERS_CSV):
-                with open(USERS_CSV, 'r', encoding='utf-8') as f:
-                    reader = csv.reader(f)
-                    rows = list(reader)
-                    if len(rows) > 1:
-                        user_id = int(rows[-1][0]) + 1
-
-            # Hash password
-            password_hash = generate_password_hash(password)
-
-            # Save to CSV
-            with open(USERS_CSV, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([user_id, name, email, password_hash, wallet_address])
+        if user_directory.get_by_email(email):
+            return render_template('register.html', error='Email already exists')
+
+        # Hash password
+        password_hash = generate_password_hash(password)
+
+        user = user_directory.add(name, email, password_hash, wallet_address)
+        if user is None:
+            return render_template('register.html', error='Email already exists')
+        user_id = user['id']
 
         session['user_id'] = wallet_address or str(user_id)
         session['user_name'] = name
         session['wallet_address'] = wallet_address
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('.dashboard'))
 
 
 
@@ -241,10 +323,10 @@ def register():
 
 
 
-@app.route('/create_message', methods=['GET', 'POST'])
+@views.route('/create_message', methods=['GET', 'POST'])
 def create_message():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
 
     if request.method == 'POST':
         try:
@@ -261,17 +343,9 @@ def create_message():
             # Convert to ISO format for storage
             reveal_time_str = reveal_time.isoformat()
 
-            # Get next message ID
-            message_id = 1
-            with csv_locks['messages']:
-                if os.path.exists(MESSAGES_CSV):
-                    with open(MESSAGES_CSV, 'r', encoding='utf-8') as f:
-                        reader = csv.reader(f)
-                        rows = list(reader)
-                        if len(rows) > 1:
-                            message_id = int(rows[-1][0]) + 1
-
-            encrypted_content = ""
+            # Allocate the message ID
+            message_id = message_store.next_id()
+
             content_hash = ""
             ipfs_hash = ""
 
@@ -281,8 +355,7 @@ def create_message():
                 if not message:
                     return render_template('create_message.html', error='Message content is required')
 
-                encrypted_content = encrypt_data(message.encode())
-                content_hash = hashlib.sha256(message.encode()).hexdigest()
+                content_hash, content_size = store_encrypted([message.encode()])
             else:
                 # Handle file upload
                 if 'file' not in request.files:
@@ -298,15 +371,12 @@ def create_message():
                 if file.content_length > MAX_FILE_SIZE:
                     return render_template('create_message.html', error='File too large (max 10MB)')
 
-                # Read file content
-                file_content = file.read()
-
-                # Encrypt file content
-                encrypted_content = encrypt_data(file_content)
-
-                # Store locally (Google Drive upload disabled for now)
-                ipfs_hash = ''  # No Google Drive upload
-                content_hash = hashlib.sha256(file_content).hexdigest()
+                # Encrypt the upload chunk by chunk into local storage
+                # (Google Drive upload disabled for now)
+                try:
+                    content_hash, content_size = store_encrypted(iter_chunks(file.stream, max_size=MAX_FILE_SIZE))
+                except FileTooLarge:
+                    return render_template('create_message.html', error='File too large (max 10MB)')
 
             # Create transaction for blockchain
             transaction = {
@@ -319,25 +389,34 @@ def create_message():
                 'ipfs_hash': ipfs_hash
             }
 
-            # Add transaction to blockchain
-            blockchain.add_transaction(transaction)
-
-            # Mine the block
-            blockchain.mine_pending_transactions()
+            # The ciphertext is stored once per distinct content
+            blob_ref = content_hash
 
-            # Get block hash as tx_hash
-            latest_block = blockchain.get_latest_block()
-            tx_hash = latest_block.hash
-
-            # Save to CSV
-            with csv_locks['messages']:
-                with open(MESSAGES_CSV, 'a', newline='', encoding='utf-8') as f:
-                    writer = csv.writer(f)
-                    writer.writerow([message_id, session['user_id'], session['wallet_address'] or session['user_id'], ipfs_hash, message_type, reveal_time_str, datetime.now().isoformat(), 'locked', encrypted_content.decode(), tx_hash])
+            # Save to the message store
+            try:
+                message_store.insert({
+                    'id': message_id,
+                    'user_id': session['user_id'],
+                    'receiver_wallet': session['wallet_address'] or session['user_id'],
+                    'ipfs_hash': ipfs_hash,
+                    'message_type': message_type,
+                    'unlock_time': reveal_time_str,
+                    'created_time': datetime.now().isoformat(),
+                    'status': 'locked',
+                    'blob_ref': blob_ref,
+                    'content_size': content_size
+                })
+            finally:
+                blob_store.unpin(blob_ref)
+            unlock_scheduler.schedule(message_id, reveal_time_str)
+
+            # Queue the transaction; the block hash is filled in once it is sealed
+            tx_id = block_producer.submit(transaction)
+            message_store.update(message_id, tx_id=tx_id)
 
             logger.info(f"Message {message_id} created successfully, redirecting to dashboard")
             flash(f'Message #{message_id} created successfully! It will be unlockable at {reveal_time_str}', 'success')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('.dashboard'))
 
 
 
@@ -349,75 +428,50 @@ def create_message():
 
     return render_template('create_message.html')
 
-@app.route('/reveal_message/<int:message_id>')
+@views.route('/reveal_message/<int:message_id>')
 def reveal_message(message_id):
     if 'user_id' not in session:
-        return redirect(url_for('login'))
-
-    with csv_locks['messages']:
-        if not os.path.exists(MESSAGES_CSV):
-            return render_template('reveal_message.html', error='Message database not found')
-
-        with open(MESSAGES_CSV, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row['id'] == str(message_id) and row['user_id'] == session['user_id']:
-                    try:
-                        reveal_time = datetime.fromisoformat(row['unlock_time'])
-                        if datetime.now() >= reveal_time:
-                            message_type = row.get('message_type', 'text')
-                            ipfs_hash = row.get('ipfs_hash', '')
-
-                            if message_type == 'text':
-                                # Decrypt text message and display on page
-                                decrypted_message = decrypt_data(row['encrypted_message'].encode()).decode()
-                                return render_template('reveal_message.html', message=decrypted_message, message_type='text')
-                            else:
-                                # For files, decrypt and display/download
-                                try:
-                                    if ipfs_hash:
-                                        encrypted_data = google_drive.download_file(ipfs_hash)
-                                        decrypted_content = decrypt_data(encrypted_data)
-                                    else:
-                                        # Fallback to stored encrypted content
-                                        encrypted_data = row['encrypted_message'].encode()
-                                        decrypted_content = decrypt_data(encrypted_data)
-
-                                    # Determine file type and handle accordingly
-                                    if message_type == 'image':
-                                        # For images, display inline with base64 encoding
-                                        import base64
-                                        image_base64 = base64.b64encode(decrypted_content).decode('utf-8')
-                                        return render_template('reveal_message.html',
-                                                             message_type='image',
-                                                             image_data=image_base64,
-                                                             message_id=message_id)
-                                    else:
-                                        # For documents, provide download link
-                                        return render_template('reveal_message.html',
-                                                             message_type='document',
-                                                             file_data=decrypted_content,
-                                                             message_id=message_id,
-                                                             original_filename=f"revealed_message_{message_id}")
-                                except Exception as e:
-                                    logger.error(f"Content retrieval failed: {e}")
-                                    return render_template('reveal_message.html', error='Failed to retrieve message content')
-                        else:
-                            return render_template('reveal_message.html', error='Message is still locked')
-                    except ValueError as e:
-                        logger.error(f"Error parsing reveal_time for message {message_id}: {e}")
-                        return render_template('reveal_message.html', error='Invalid message data')
+        return redirect(url_for('.login'))
+
+    row = message_store.get(message_id)
+    if row and row['user_id'] == session['user_id']:
+        try:
+            reveal_time = datetime.fromisoformat(row['unlock_time'])
+            if datetime.now() >= reveal_time:
+                message_type = row.get('message_type', 'text')
+
+                if message_type == 'text':
+                    # Decrypt text message and display on page
+                    decrypted_message = read_message_content(row).decode()
+                    return render_template('reveal_message.html', message=decrypted_message, message_type='text')
+                elif message_type == 'image':
+                    # Images are streamed from the download endpoint rather than inlined
+                    return render_template('reveal_message.html',
+                                         message_type='image',
+                                         image_url=url_for('.download_file', message_id=message_id, inline=1),
+                                         message_id=message_id)
+                else:
+                    # For documents, provide download link
+                    return render_template('reveal_message.html',
+                                         message_type='document',
+                                         message_id=message_id,
+                                         original_filename=f"revealed_message_{message_id}")
+            else:
+                return render_template('reveal_message.html', error='Message is still locked')
+        except ValueError as e:
+            logger.error(f"Error parsing reveal_time for message {message_id}: {e}")
+            return render_template('reveal_message.html', error='Invalid message data')
 
     return render_template('reveal_message.html', error='Message not found')
 
-@app.route('/logout')
+@views.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
 # API Endpoints
 
-@app.route('/api/messages', methods=['POST'])
+@views.route('/api/messages', methods=['POST'])
 def create_message_api():
     """Create a new time-locked message"""
     try:
@@ -432,14 +486,32 @@ def create_message_api():
         if not receiver_wallet or not unlock_time:
             return jsonify({'error': 'Receiver wallet and unlock time required'}), 400
 
-        # Encrypt content
-        encrypted_content = encrypt_data(content.encode())
-
-        # Store locally (Google Drive upload disabled for now)
+        # Encrypt content into local storage (Google Drive upload disabled for now)
+        content_hash, content_size = store_encrypted([content.encode()])
         ipfs_hash = ''
+        blob_ref = content_hash
+
+        try:
+            message_id = message_store.next_id()
+            message_store.insert({
+                'id': message_id,
+                'user_id': wallet_address,
+                'receiver_wallet': receiver_wallet,
+                'ipfs_hash': ipfs_hash,
+                'message_type': message_type,
+                'unlock_time': unlock_time,
+                'created_time': datetime.now().isoformat(),
+                'status': 'locked',
+                'blob_ref': blob_ref,
+                'content_size': content_size
+            })
+        finally:
+            blob_store.unpin(blob_ref)
+        unlock_scheduler.schedule(message_id, unlock_time)
 
         # Create blockchain transaction
         transaction = {
+            'id': message_id,
             'wallet_address': wallet_address,
             'receiver_wallet': receiver_wallet,
             'ipfs_hash': ipfs_hash,
@@ -448,42 +520,15 @@ def create_message_api():
             'timestamp': datetime.now().isoformat()
         }
 
-        # Add to blockchain
-        blockchain.add_transaction(transaction)
-        blockchain.mine_pending_transactions()
-
-        # Get transaction hash
-        latest_block = blockchain.get_latest_block()
-        tx_hash = latest_block.hash
-
-        # Save to local storage
-        with csv_locks['messages']:
-            # Get next message ID
-            message_id = 1
-            if os.path.exists(MESSAGES_CSV):
-                with open(MESSAGES_CSV, 'r') as f:
-                    reader = csv.reader(f)
-                    rows = list(reader)
-                    if len(rows) > 1:
-                        message_id = int(rows[-1][0]) + 1
-
-            with open(MESSAGES_CSV, 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    message_id,
-                    wallet_address,
-                    receiver_wallet,
-                    ipfs_hash,
-                    message_type,
-                    unlock_time,
-                    datetime.now().isoformat(),
-                    'locked'
-                ])
+        # Queue for the next block; poll /api/transactions/<tx_id> for the hash
+        tx_id = block_producer.submit(transaction)
+        message_store.update(message_id, tx_id=tx_id)
 
         return jsonify({
             'success': True,
             'message_id': message_id,
-            'tx_hash': tx_hash,
+            'tx_id': tx_id,
+            'tx_status': 'pending',
             'ipfs_hash': ipfs_hash
         })
 
@@ -491,35 +536,30 @@ def create_message_api():
         logger.error(f"API create message error: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/messages', methods=['GET'])
+@views.route('/api/messages', methods=['GET'])
 def get_messages_api():
     """Get messages for the authenticated user"""
     try:
-        wallet_address = request.args.get('wallet_address') or session.get('wallet_address')
+        wallet_address = request.args.get('wallet_address') or session.get('wallet_address') or session.get('user_id')
         if not wallet_address:
             return jsonify({'error': 'Wallet address required'}), 400
 
         messages = []
 
-        # Get from local storage
-        if os.path.exists(MESSAGES_CSV):
-            with open(MESSAGES_CSV, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    # Show messages where user is either sender or receiver
-                    if row.get('user_id') == str(wallet_address) or row.get('receiver_wallet') == wallet_address:
-                        unlock_timestamp = int(datetime.fromisoformat(row['unlock_time'].replace('Z', '+00:00')).timestamp())
-                        messages.append({
-                            'id': int(row['id']),
-                            'sender': row.get('user_id', ''),  # Use user_id as sender
-                            'receiver': row['receiver_wallet'],
-                            'ipfs_hash': row['ipfs_hash'],
-                            'message_type': row['message_type'],
-                            'unlock_time': unlock_timestamp,
-                            'created_time': int(datetime.fromisoformat(row['created_time']).timestamp()),
-                            'is_revealed': row['status'] == 'revealed',
-                            'can_reveal': datetime.now().timestamp() >= unlock_timestamp and row['status'] != 'revealed'
-                        })
+        # Show messages where user is either sender or receiver
+        for row in message_store.list_for_user(wallet_address, wallet_address):
+            unlock_timestamp = int(datetime.fromisoformat(row['unlock_time'].replace('Z', '+00:00')).timestamp())
+            messages.append({
+                'id': row['id'],
+                'sender': row.get('user_id', ''),  # Use user_id as sender
+                'receiver': row['receiver_wallet'],
+                'ipfs_hash': row['ipfs_hash'],
+                'message_type': row['message_type'],
+                'unlock_time': unlock_timestamp,
+                'created_time': int(datetime.fromisoformat(row['created_time']).timestamp()),
+                'is_revealed': row['status'] == 'revealed',
+                'can_reveal': datetime.now().timestamp() >= unlock_timestamp and row['status'] != 'revealed'
+            })
 
         return jsonify({'messages': messages})
 
@@ -527,7 +567,7 @@ def get_messages_api():
         logger.error(f"API get messages error: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/messages/<int:message_id>/reveal', methods=['POST'])
+@views.route('/api/messages/<int:message_id>/reveal', methods=['POST'])
 def reveal_message_api(message_id):
     """Reveal a message"""
     try:
@@ -548,81 +588,58 @@ def reveal_message_api(message_id):
         logger.info(f"Reveal request for message {message_id} by wallet {wallet_address}")
 
         # Get encrypted content and update status
-        messages = []
-        message_found = False
+        row = message_store.get(message_id)
+
+        # Check if user can access this message (receiver or sender for web app)
+        if not row or not (row.get('receiver_wallet') == wallet_address or
+                           (session.get('user_id') and row.get('user_id') == session.get('user_id'))):
+            logger.error(f"Message {message_id} not found or access denied for wallet {wallet_address}")
+            return jsonify({'error': 'Message not found'}), 404
+
+        logger.info(f"Message {message_id} belongs to wallet {wallet_address}")
+        message_type = row.get('message_type', 'text')
+
+        # If already revealed, just return the content without error
+        already_revealed = (row['status'] == 'revealed')
+
+        # Check reveal time
+        try:
+            reveal_time = datetime.fromisoformat(row['unlock_time'])
+            if datetime.now() < reveal_time:
+                return jsonify({'error': 'Message is still locked'}), 403
+        except ValueError:
+            return jsonify({'error': 'Invalid unlock time format'}), 500
+
+        # Files can be fetched from content_url instead of inlined as base64
+        include_content = message_type == 'text' or data.get('include_content', True)
+
+        # Decrypt content for both text and files
         decrypted_data = None
-        message_type = None
-
-        with csv_locks['messages']:
-            if not os.path.exists(MESSAGES_CSV):
-                return jsonify({'error': 'Message database not found'}), 404
-
-            with open(MESSAGES_CSV, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    logger.info(f"Checking message {row['id']} with user_id {row.get('user_id')} and receiver_wallet {row.get('receiver_wallet')}")
-                    if int(row['id']) == message_id:
-                        # Check if user can access this message (receiver or sender for web app)
-                        if (row.get('receiver_wallet') == wallet_address or
-                            (session.get('user_id') and row.get('user_id') == session.get('user_id'))):
-                            logger.info(f"Message {message_id} belongs to wallet {wallet_address}")
-                            message_found = True
-                            message_type = row.get('message_type', 'text')
-
-                            # If already revealed, just return the content without error
-                            already_revealed = (row['status'] == 'revealed')
-
-
-                            # Check reveal time
-                            try:
-                                reveal_time = datetime.fromisoformat(row['unlock_time'])
-                                if datetime.now() < reveal_time:
-                                    return jsonify({'error': 'Message is still locked'}), 403
-                            except ValueError:
-                                return jsonify({'error': 'Invalid unlock time format'}), 500
-
-                            # Decrypt content for both text and files
-                            try:
-                                if row.get('ipfs_hash'):
-                                    # Download from Google Drive
-                                    encrypted_data = google_drive.download_file(row['ipfs_hash'])
-                                    decrypted_data = decrypt_data(encrypted_data)
-                                else:
-                                    # Fallback to stored encrypted content
-                                    encrypted_data = row['encrypted_message'].encode()
-                                    decrypted_data = decrypt_data(encrypted_data)
-                            except Exception as e:
-                                logger.error(f"Content retrieval failed: {e}")
-                                return jsonify({'error': 'Failed to retrieve message content'}), 500
-
-                            # Update status
-                            row['status'] = 'revealed'
-
-                    messages.append(row)
-
-            if not message_found:
-                logger.error(f"Message {message_id} not found or access denied for wallet {wallet_address}")
-                return jsonify({'error': 'Message not found'}), 404
-
-            # Write back updated messages
-            with open(MESSAGES_CSV, 'w', newline='') as f:
-                if messages:
-                    writer = csv.DictWriter(f, fieldnames=['id', 'user_id', 'receiver_wallet', 'ipfs_hash', 'message_type', 'unlock_time', 'created_time', 'status', 'encrypted_message', 'tx_hash'])
-                    writer.writeheader()
-                    writer.writerows(messages)
+        if include_content:
+            try:
+                decrypted_data = read_message_content(row)
+            except Exception as e:
+                logger.error(f"Content retrieval failed: {e}")
+                return jsonify({'error': 'Failed to retrieve message content'}), 500
+
+        # Update status
+        if not already_revealed:
+            message_store.update(message_id, status='revealed')
 
         # Handle different content types properly
-        if message_type == 'text':
+        if decrypted_data is None:
+            content = None
+        elif message_type == 'text':
             # Text content can be decoded as UTF-8
             content = decrypted_data.decode() if isinstance(decrypted_data, bytes) else str(decrypted_data)
         else:
             # Binary content (files, images) should be base64 encoded for JSON transport
-            import base64
             content = base64.b64encode(decrypted_data).decode('utf-8') if isinstance(decrypted_data, bytes) else decrypted_data
 
         return jsonify({
             'success': True,
             'content': content,
+            'content_url': None if message_type == 'text' else url_for('.download_file', message_id=message_id, inline=1),
             'message_type': message_type,
             'is_binary': message_type != 'text',
             'already_revealed': already_revealed
@@ -635,7 +652,86 @@ def reveal_message_api(message_id):
         return jsonify({'error': 'Failed to reveal message'}), 500
 
 
-@app.route('/api/messages/<int:message_id>/delete', methods=['DELETE'])
+@views.route('/api/messages/reveal', methods=['POST'])
+def reveal_messages_bulk_api():
+    """Reveal every unlockable message of a wallet in one call.
+
+    Payloads are decrypted in parallel on the crypto service and the status
+    change is applied as one batch. Files are returned as ``content_url``
+    links unless ``include_content`` is set.
+    """
+    try:
+        data = {}
+        if request.is_json:
+            try:
+                data = request.get_json() or {}
+            except Exception:
+                pass
+
+        wallet_address = data.get('wallet_address') or session.get('wallet_address') or session.get('user_id')
+        if not wallet_address:
+            return jsonify({'error': 'Authentication required'}), 400
+
+        now = time.time()
+        rows = []
+        for row in message_store.list_for_user(session.get('user_id'), wallet_address):
+            try:
+                if unlock_timestamp(row['unlock_time']) <= now:
+                    rows.append(row)
+            except ValueError:
+                logger.warning(f"Skipping message {row['id']} with invalid unlock time")
+
+        include_content = bool(data.get('include_content', False))
+
+        def reveal_content(row):
+            if row['message_type'] != 'text' and not include_content:
+                return None
+            if not (row.get('blob_ref') or row.get('ipfs_hash')):
+                # Legacy inline payloads are not part of the listing metadata
+                row = message_store.get(row['id'])
+            return read_message_content(row)
+
+        messages = []
+        failed = []
+        for row, decrypted_data in zip(rows, crypto_service.map(reveal_content, rows, return_exceptions=True)):
+            if isinstance(decrypted_data, Exception):
+                logger.error(f"Bulk reveal of message {row['id']} failed: {decrypted_data}")
+                failed.append(row['id'])
+                continue
+
+            message_type = row.get('message_type', 'text')
+            if decrypted_data is None:
+                content = None
+            elif message_type == 'text':
+                content = decrypted_data.decode()
+            else:
+                content = base64.b64encode(decrypted_data).decode('utf-8')
+            messages.append({
+                'id': row['id'],
+                'content': content,
+                'content_url': None if message_type == 'text' else url_for('.download_file', message_id=row['id'], inline=1),
+                'message_type': message_type,
+                'is_binary': message_type != 'text',
+                'already_revealed': row['status'] == 'revealed'
+            })
+
+        # One batched status change per current status (locked, or unlocked via the status API)
+        pending = {}
+        status_by_id = {row['id']: row['status'] for row in rows}
+        for message in messages:
+            if not message['already_revealed']:
+                pending.setdefault(status_by_id[message['id']], []).append(message['id'])
+        for from_status, message_ids in pending.items():
+            publish_unlocks(message_store.transition_status(message_ids, from_status, 'revealed'))
+
+        return jsonify({'success': True, 'messages': messages, 'failed': failed})
+
+    except Exception as e:
+        logger.error(f"Bulk reveal API error: {e}")
+        return jsonify({'error': 'Failed to reveal messages'}), 500
+
+
+@views.route('/api/messages/<int:message_id>/delete', methods=['DELETE'])
 def delete_message_api(message_id):
     """Delete a message"""
     try:
@@ -656,54 +752,29 @@ def delete_message_api(message_id):
         logger.info(f"Delete request for message {message_id} by wallet {wallet_address}")
         logger.info(f"Session user_id: {session.get('user_id')}, wallet_address: {session.get('wallet_address')}")
 
-        messages = []
-        message_found = False
-        message_to_delete = None
-
-        with csv_locks['messages']:
-            if not os.path.exists(MESSAGES_CSV):
-                logger.error(f"Delete failed: Messages CSV not found at {MESSAGES_CSV}")
-                return jsonify({'error': 'Message database not found'}), 404
-
-            with open(MESSAGES_CSV, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    logger.info(f"Checking message {row['id']} with user_id {row.get('user_id')}, receiver_wallet {row.get('receiver_wallet')}")
-                    if int(row['id']) == message_id:
-                        # Check if user owns this message (can delete if sender or receiver)
-                        user_id_match = str(row.get('user_id')) == str(wallet_address)
-                        receiver_match = row.get('receiver_wallet') == wallet_address
-                        session_match = session.get('user_id') and str(row.get('user_id')) == str(session.get('user_id'))
-                        
-                        logger.info(f"Message {message_id} checks: user_id_match={user_id_match}, receiver_match={receiver_match}, session_match={session_match}")
-                        
-                        if (user_id_match or receiver_match or session_match):
-                            logger.info(f"Message {message_id} belongs to wallet {wallet_address} - DELETING")
-                            message_found = True
-                            message_to_delete = row
-                            continue  # Skip adding this row to messages list
-                        else:
-                            logger.warning(f"Message {message_id} does not belong to wallet {wallet_address} (owner: {row.get('user_id')}, receiver: {row.get('receiver_wallet')})")
-                    messages.append(row)
-
-            if not message_found:
-                logger.error(f"Message {message_id} not found or access denied for wallet {wallet_address}")
-                return jsonify({'error': 'Message not found or access denied'}), 404
-
-
-            # If message has a file in Google Drive, we could optionally delete it here
-            # For now, we'll just remove the database entry
-
-            # Write back updated messages (without the deleted one)
-            with open(MESSAGES_CSV, 'w', newline='', encoding='utf-8') as f:
-                if messages:
-                    writer = csv.DictWriter(f, fieldnames=messages[0].keys())
-                    writer.writeheader()
-                    writer.writerows(messages)
-                else:
-                    # If no messages left, write header only
-                    writer = csv.writer(f)
-                    writer.writerow(['id', 'user_id', 'receiver_wallet', 'ipfs_hash', 'message_type', 'unlock_time', 'created_time', 'status', 'encrypted_message', 'tx_hash'])
+        row = message_store.get(message_id)
+        if not row:
+            logger.error(f"Message {message_id} not found or access denied for wallet {wallet_address}")
+            return jsonify({'error': 'Message not found or access denied'}), 404
+
+        # Check if user owns this message (can delete if sender or receiver)
+        user_id_match = str(row.get('user_id')) == str(wallet_address)
+        receiver_match = row.get('receiver_wallet') == wallet_address
+        session_match = session.get('user_id') and str(row.get('user_id')) == str(session.get('user_id'))
+
+        logger.info(f"Message {message_id} checks: user_id_match={user_id_match}, receiver_match={receiver_match}, session_match={session_match}")
+
+        if not (user_id_match or receiver_match or session_match):
+            logger.warning(f"Message {message_id} does not belong to wallet {wallet_address} (owner: {row.get('user_id')}, receiver: {row.get('receiver_wallet')})")
+            return jsonify({'error': 'Message not found or access denied'}), 404
+
+        # If message has a file in Google Drive, we could optionally delete it here
+        # For now, we'll just remove the database entry and any unshared local blob
+        logger.info(f"Message {message_id} belongs to wallet {wallet_address} - DELETING")
+        message_store.delete(message_id)
+        if row.get('blob_ref'):
+            # Checked under the store's lock, so a concurrent create of the same content keeps the blob
+            blob_store.delete_unreferenced(row['blob_ref'], message_store.count_blob_refs)
 
         return jsonify({'success': True, 'message': 'Message deleted successfully'})
 
@@ -712,7 +783,7 @@ def delete_message_api(message_id):
         logger.error(f"Delete API error: {e}")
         return jsonify({'error': 'Failed to delete message'}), 500
 
-@app.route('/api/upload', methods=['POST'])
+@views.route('/api/upload', methods=['POST'])
 def upload_file():
     """Upload file for message creation"""
     if 'file' not in request.files:
@@ -728,14 +799,17 @@ def upload_file():
     if file.content_length > MAX_FILE_SIZE:
         return jsonify({'error': 'File too large'}), 400
 
-    # Read file data
-    file_data = file.read()
-
-    # Encrypt file
-    encrypted_data = encrypt_data(file_data)
-
-    # Upload to Google Drive
-    upload_result = google_drive.upload_file(encrypted_data, secure_filename(file.filename))
+    # Encrypt into a spooled temporary file, which moves to disk past 1MB
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as encrypted:
+        try:
+            for frame in encrypt_stream(iter_chunks(file.stream, max_size=MAX_FILE_SIZE)):
+                encrypted.write(frame)
+        except FileTooLarge:
+            return jsonify({'error': 'File too large'}), 400
+        encrypted.seek(0)
+
+        # Upload to Google Drive
+        upload_result = google_drive.upload_file(encrypted, secure_filename(file.filename))
     file_id = upload_result['file_id']
 
     return jsonify({
@@ -744,7 +818,7 @@ def upload_file():
         'message_type': get_file_type(file.filename)
     })
 
-@app.route('/api/messages/<int:message_id>/status', methods=['PUT'])
+@views.route('/api/messages/<int:message_id>/status', methods=['PUT'])
 def update_message_status_api(message_id):
     """Update message status (e.g., from locked to unlocked/revealed)"""
     try:
@@ -762,34 +836,15 @@ def update_message_status_api(message_id):
         
         new_status = data.get('status', 'unlocked')
         
-        messages = []
-        message_found = False
-        
-        with csv_locks['messages']:
-            if not os.path.exists(MESSAGES_CSV):
-                return jsonify({'error': 'Message database not found'}), 404
-
-            with open(MESSAGES_CSV, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if int(row['id']) == message_id:
-                        # Check if user owns this message
-                        if (row.get('user_id') == wallet_address or 
-                            row.get('receiver_wallet') == wallet_address or
-                            (session.get('user_id') and row.get('user_id') == session.get('user_id'))):
-                            row['status'] = new_status
-                            message_found = True
-                    messages.append(row)
-
-            if not message_found:
-                return jsonify({'error': 'Message not found or access denied'}), 404
-
-            # Write back updated messages
-            with open(MESSAGES_CSV, 'w', newline='', encoding='utf-8') as f:
-                if messages:
-                    writer = csv.DictWriter(f, fieldnames=['id', 'user_id', 'receiver_wallet', 'ipfs_hash', 'message_type', 'unlock_time', 'created_time', 'status', 'encrypted_message', 'tx_hash'])
-                    writer.writeheader()
-                    writer.writerows(messages)
+        row = message_store.get(message_id)
+
+        # Check if user owns this message
+        if not row or not (row.get('user_id') == wallet_address or
+                           row.get('receiver_wallet') == wallet_address or
+                           (session.get('user_id') and row.get('user_id') == session.get('user_id'))):
+            return jsonify({'error': 'Message not found or access denied'}), 404
+
+        message_store.update(message_id, status=new_status)
 
         return jsonify({'success': True, 'message': f'Status updated to {new_status}'})
 
@@ -798,11 +853,121 @@ def update_message_status_api(message_id):
         return jsonify({'error': 'Failed to update message status'}), 500
 
 
-@app.route('/api/blockchain/timestamp', methods=['GET'])
+@views.route('/api/events', methods=['GET'])
+def message_events():
+    """Server-Sent Events stream of unlock notifications for the signed-in user"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    user_id = session['user_id']
+    wallet = session.get('wallet_address') or user_id
+
+    def stream():
+        # Subscribed inside the generator, so a client gone before the first
+        # chunk never leaves a subscription behind
+        subscription = event_broker.subscribe([user_id, wallet])
+        try:
+            # Snapshot after subscribing so no unlock falls in between
+            unlocked = [row['id'] for row in message_store.list_for_user(user_id, wallet) if row['status'] != 'locked']
+            yield 'retry: 5000\n\n'
+            yield format_sse('snapshot', {'unlocked': unlocked})
+            while True:
+                event = subscription.get(timeout=SSE_HEARTBEAT)
+                yield format_sse(*event) if event else ': keepalive\n\n'
+        finally:
+            event_broker.unsubscribe(subscription)
+
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@views.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Hit, miss and size counters of the remote payload cache"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+    return jsonify(blob_cache.stats())
+
+
+@views.route('/api/transactions/<tx_id>', methods=['GET'])
+def get_transaction_status(tx_id):
+    """Resolve a submitted transaction id to its block once sealed"""
+    status = block_producer.status(tx_id)
+    if status is None:
+        return jsonify({'error': 'Transaction not found'}), 404
+    return jsonify(status)
+
+# Fields of a block served by /chain/headers; transactions are replaced by a count,
+# plus their Merkle root on version 2 blocks so clients can re-hash the header
+HEADER_FIELDS = ('index', 'timestamp', 'previous_hash', 'nonce', 'version', 'hash')
+
+
+def stream_chain_records(start, stop, headers_only=False):
+    """Yield NDJSON lines for blocks ``start`` to ``stop - 1`` straight from the block log"""
+    for raw in blockchain.chain_log.iter_raw(start, stop):
+        if headers_only:
+            block_data = json.loads(raw)
+            header = {field: block_data.get(field) for field in HEADER_FIELDS}
+            header['transaction_count'] = len(block_data['transactions'])
+            if (block_data.get('version') or 1) >= 2:
+                header['merkle_root'] = merkle_root(block_data['transactions'])
+            yield json.dumps(header, separators=(',', ':')) + '\n'
+        else:
+            yield raw
+
+
+def chain_range():
+    """Parse ``from``/``limit`` query arguments into a block range of the current chain"""
+    height = blockchain.chain_log.height
+    start = max(request.args.get('from', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', CHAIN_PAGE_LIMIT, type=int), 0), CHAIN_PAGE_LIMIT)
+    return start, min(start + limit, height), height
+
+
+def ndjson_response(records, height):
+    response = Response(stream_with_context(records), mimetype='application/x-ndjson')
+    response.headers['X-Chain-Height'] = str(height)
+    return response
+
+
+@views.route('/chain', methods=['GET'])
+def get_chain():
+    """Stream the whole chain as NDJSON, one block per line"""
+    height = blockchain.chain_log.height
+    return ndjson_response(stream_chain_records(0, height), height)
+
+
+@views.route('/chain/blocks', methods=['GET'])
+def get_chain_blocks():
+    """Stream a page of full blocks: ``?from=<index>&limit=<count>``"""
+    start, stop, height = chain_range()
+    return ndjson_response(stream_chain_records(start, stop), height)
+
+
+@views.route('/chain/headers', methods=['GET'])
+def get_chain_headers():
+    """Stream a page of block headers without their transactions"""
+    start, stop, height = chain_range()
+    return ndjson_response(stream_chain_records(start, stop, headers_only=True), height)
+
+
+@views.route('/chain/tip', methods=['GET'])
+def get_chain_tip():
+    """Height and tip hash, polled by peers before syncing"""
+    with blockchain.chain_log.lock:
+        height = blockchain.chain_log.height
+        tip = blockchain.chain_log.read_block(height - 1)
+    return jsonify({'height': height, 'hash': tip['hash'], 'timestamp': tip['timestamp']})
+
+
+@views.route('/api/blockchain/timestamp', methods=['GET'])
 def get_blockchain_timestamp():
 
     """Get current blockchain timestamp"""
     try:
+        w3 = get_web3()
         if w3 and w3.is_connected():
             timestamp = w3.eth.get_block('latest')['timestamp']
         else:
@@ -813,60 +978,117 @@ def get_blockchain_timestamp():
         logger.error(f"Blockchain timestamp error: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/download/<message_id>', methods=['GET'])
+@views.route('/api/download/<message_id>', methods=['GET'])
 def download_file(message_id):
-    """Download and decrypt file by message ID"""
+    """Stream a decrypted file by message ID, honouring single byte-range requests.
+
+    Pass ``?inline=1`` to display the file in the page instead of saving it.
+    """
     try:
         # Find the message by ID
-        with csv_locks['messages']:
-            if not os.path.exists(MESSAGES_CSV):
-                return jsonify({'error': 'Message database not found'}), 404
-
-            with open(MESSAGES_CSV, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if row['id'] == str(message_id):
-                        # Check if user can access this message
-                        if row['user_id'] == session.get('user_id'):
-                            message_type = row.get('message_type', 'text')
-                            ipfs_hash = row.get('ipfs_hash', '')
-
-                            # Decrypt content
-                            try:
-                                if ipfs_hash:
-                                    encrypted_data = google_drive.download_file(ipfs_hash)
-                                    decrypted_data = decrypt_data(encrypted_data)
-                                else:
-                                    # Fallback to stored encrypted content
-                                    encrypted_data = row['encrypted_message'].encode()
-                                    decrypted_data = decrypt_data(encrypted_data)
-
-                                # Determine filename based on message type
-                                if message_type == 'image':
-                                    filename = f"revealed_image_{message_id}.png"
-                                elif message_type == 'document':
-                                    filename = f"revealed_document_{message_id}.pdf"
-                                else:
-                                    filename = f"revealed_file_{message_id}"
-
-                                # Return file
-                                return send_file(
-                                    io.BytesIO(decrypted_data),
-                                    as_attachment=True,
-                                    download_name=filename
-                                )
-                            except Exception as e:
-                                logger.error(f"Content retrieval failed: {e}")
-                                return jsonify({'error': 'Failed to retrieve message content'}), 500
-                        else:
-                            return jsonify({'error': 'Access denied'}), 403
-
-        return jsonify({'error': 'Message not found'}), 404
+        row = message_store.get(message_id) if str(message_id).isdigit() else None
+        if not row:
+            return jsonify({'error': 'Message not found'}), 404
+
+        # Senders and receivers can download, matching what the dashboard lists
+        user_id = session.get('user_id')
+        wallet = session.get('wallet_address') or user_id
+        if not user_id or (row['user_id'] != user_id and row['receiver_wallet'] != wallet):
+            return jsonify({'error': 'Access denied'}), 403
+
+        # Files stay sealed until their unlock time whatever the stored status, like the reveal endpoints
+        try:
+            if time.time() < unlock_timestamp(row['unlock_time']):
+                return jsonify({'error': 'Message is still locked'}), 403
+        except ValueError:
+            return jsonify({'error': 'Invalid unlock time format'}), 500
+
+        message_type = row.get('message_type', 'text')
+
+        # Determine filename based on message type
+        if message_type == 'image':
+            filename = f"revealed_image_{message_id}.png"
+        elif message_type == 'document':
+            filename = f"revealed_document_{message_id}.pdf"
+        else:
+            filename = f"revealed_file_{message_id}"
+
+        # Ranges need the plaintext size, which older rows don't record
+        total = int(row['content_size']) if row.get('content_size') else None
+        byte_range = None
+        if request.range and total is not None:
+            byte_range = request.range.range_for_length(total)
+            if byte_range is None and len(request.range.ranges) == 1:
+                response = jsonify({'error': 'Requested range not satisfiable'})
+                response.status_code = 416
+                response.headers['Content-Range'] = f'bytes */{total}'
+                return response
+
+        try:
+            if byte_range:
+                start, stop = byte_range
+                chunks = iter_message_range(row, start, stop)
+            else:
+                start, stop = 0, total
+                chunks = iter_message_content(row)
+            # Decrypt the first chunk up front so a bad key or payload still gets a 500
+            first_chunk = next(chunks, b'')
+        except Exception as e:
+            logger.error(f"Content retrieval failed: {e}")
+            return jsonify({'error': 'Failed to retrieve message content'}), 500
+
+        def stream():
+            yield first_chunk
+            yield from chunks
+
+        # Stream the file, decrypting one chunk at a time
+        response = Response(
+            stream_with_context(stream()),
+            status=206 if byte_range else 200,
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        )
+        disposition = 'inline' if request.args.get('inline') else 'attachment'
+        response.headers['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+        response.headers['Accept-Ranges'] = 'bytes'
+        if total is not None:
+            response.headers['Content-Length'] = str(stop - start)
+        if byte_range:
+            response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{total}'
+        return response
 
     except Exception as e:
         logger.error(f"Download error: {e}")
         return jsonify({'error': str(e)}), 500
 
-if __name__ == '__main__':
-    app.run(debug=True)
+def _in_reloader_watcher():
+    """True in the file-watching parent of ``flask run --debug``, which never serves requests"""
+    return (os.environ.get('FLASK_RUN_FROM_CLI') == 'true' and get_debug_flag()
+            and os.environ.get('WERKZEUG_RUN_MAIN') != 'true')
+
+
+def create_app(start_services=None):
+    """Application factory: start the shared services and return a Flask app serving every view.
+
+    Importing this module only defines the views; services are created by
+    the first call, and later apps reuse them. They own the block log and its
+    background writers, so only one process may run them: by default they
+    are not started in the reloader's file watcher, and ``start_services=False``
+    defers them the same way. Deferred services start on the first request.
+    """
+    if start_services is None:
+        start_services = not _in_reloader_watcher()
+    if start_services:
+        init_services()
+    app = Flask(__name__)
+    CORS(app)
+    app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')
+    app.register_blueprint(views)
+    app.before_request(init_services)
+    return app
 
+
+if __name__ == '__main__':
+    # The reloader runs this script twice: a watcher process and the child it
+    # restarts on changes (WERKZEUG_RUN_MAIN=true). Only the child serves
+    # requests, so only it starts the services.
+    create_app(start_services=os.environ.get('WERKZEUG_RUN_MAIN') == 'true').run(debug=True)
@@ -0,0 +1,752 @@
+"""Micro-benchmarks for the backend.
+
+Run from the backend directory, for example::
+
+    python benchmarks.py mining --difficulty 5 --blocks 3
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from mining import ParallelMiner, block_hash, header_prefix, merkle_root, mine_serial
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_mining(args):
+    """Compare the serial miner with ParallelMiner on the same blocks"""
+    miner = ParallelMiner(args.workers, min_parallel_difficulty=0)
+    transactions = [{'id': i, 'message_hash': os.urandom(32).hex()} for i in range(args.transactions)]
+
+    serial_total = parallel_total = 0.0
+    serial_attempts = parallel_attempts = 0
+    print(f"difficulty={args.difficulty} workers={miner.workers} transactions={args.transactions}")
+    for i in range(args.blocks):
+        prefix = header_prefix(i + 1, time.time(), merkle_root(transactions), os.urandom(32).hex())
+        (serial_nonce, _), serial_time = _timed(mine_serial, prefix, args.difficulty)
+        (parallel_nonce, _), parallel_time = _timed(miner.mine, prefix, args.difficulty)
+        serial_total += serial_time
+        parallel_total += parallel_time
+        serial_attempts += serial_nonce + 1
+        parallel_attempts += parallel_nonce + 1
+        print(f"  block {i + 1}: serial {serial_time:.3f}s (nonce {serial_nonce}), "
+              f"parallel {parallel_time:.3f}s (nonce {parallel_nonce})")
+
+    print(f"serial:   {serial_total:.3f}s total, {serial_attempts / serial_total:,.0f} hashes/s")
+    print(f"parallel: {parallel_total:.3f}s total, ~{parallel_attempts / parallel_total:,.0f} hashes/s")
+    print(f"speedup:  {serial_total / parallel_total:.2f}x")
+
+
+def bench_hashing(args):
+    """Per-nonce cost of full-block JSON hashing vs the header-prefix fast path"""
+    print(f"{'transactions':>12} {'full JSON (us/nonce)':>22} {'prefix (us/nonce)':>19}")
+    for count in args.transactions:
+        transactions = [{'id': i, 'user_id': str(i), 'message_hash': os.urandom(32).hex(),
+                         'unlock_time': '2030-01-01T00:00:00'} for i in range(count)]
+        block_data = {'index': 1, 'timestamp': time.time(), 'transactions': transactions,
+                      'previous_hash': os.urandom(32).hex()}
+
+        start = time.perf_counter()
+        for nonce in range(args.nonces):
+            block_hash(block_data, nonce)
+        full_time = time.perf_counter() - start
+
+        # Includes the one-off Merkle root and prefix serialization
+        start = time.perf_counter()
+        prefix = header_prefix(1, block_data['timestamp'], merkle_root(transactions), block_data['previous_hash'])
+        mine_serial(prefix, 64, step=1, stop_event=_StopAfter(args.nonces))
+        prefix_time = time.perf_counter() - start
+
+        print(f"{count:>12} {full_time / args.nonces * 1e6:>22.2f} {prefix_time / args.nonces * 1e6:>19.2f}")
+
+
+class _StopAfter:
+    """Stop flag for mine_serial that trips after a fixed number of checks"""
+
+    def __init__(self, nonces):
+        self.remaining = max(1, nonces // 2000)
+
+    def is_set(self):
+        self.remaining -= 1
+        return self.remaining < 0
+
+
+def _write_synthetic_chain(directory, blocks, transactions_per_block, segment_size=None):
+    """Fill a block log with unmined blocks; hashes are random, not valid PoW"""
+    from chain_log import ChainLog
+
+    chain_log = ChainLog(directory, segment_size=segment_size)
+    previous_hash = '0'
+    for index in range(blocks):
+        block_hash_hex = os.urandom(32).hex()
+        chain_log.append({
+            'index': index,
+            'timestamp': time.time(),
+            'transactions': [{'id': index * transactions_per_block + i,
+                              'user_id': str((index * transactions_per_block + i) % 1000),
+                              'receiver_wallet': f'0x{(index + i) % 1000:040x}',
+                              'message_hash': os.urandom(32).hex(),
+                              'unlock_time': '2030-01-01T00:00:00'}
+                             for i in range(transactions_per_block)],
+            'previous_hash': previous_hash,
+            'nonce': 0,
+            'version': 2,
+            'hash': block_hash_hex
+        })
+        previous_hash = block_hash_hex
+    chain_log.write_checkpoint({'pending_transactions': [], 'difficulty': 4,
+                                'smart_contracts': {}, 'nodes': []})
+    chain_log.close()
+
+
+def bench_chain_load(args):
+    """Startup time and Python heap use of eager vs lazy chain loading"""
+    from blockchain import AdvancedBlockchain
+    from chain_log import ChainLog
+
+    print(f"{'blocks':>8} {'mode':>7} {'load (ms)':>10} {'heap (KiB)':>11} {'tip read (us)':>14}")
+    for blocks in args.blocks:
+        directory = tempfile.mkdtemp(prefix='chain-bench-')
+        try:
+            _write_synthetic_chain(directory, blocks, args.transactions)
+            for lazy in (False, True):
+                tracemalloc.start()
+                start = time.perf_counter()
+                chain = AdvancedBlockchain(chain_log=ChainLog(directory), lazy=lazy, mining_workers=1)
+                load_time = time.perf_counter() - start
+                heap = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+
+                start = time.perf_counter()
+                chain.get_latest_block()
+                tip_time = time.perf_counter() - start
+                chain.chain_log.close()
+                del chain
+                gc.collect()
+                mode = 'lazy' if lazy else 'eager'
+                print(f"{blocks:>8} {mode:>7} {load_time * 1e3:>10.1f} {heap / 1024:>11.0f} {tip_time * 1e6:>14.1f}")
+        finally:
+            shutil.rmtree(directory)
+
+
+def bench_reorg(args):
+    """ChainLog.rewrite at different fork points, segment boundaries included, checked by reloading"""
+    from chain_log import ChainLog
+
+    directory = tempfile.mkdtemp(prefix='reorg-bench-')
+    try:
+        _write_synthetic_chain(directory, args.blocks, args.transactions, args.segment_size)
+        log = ChainLog(directory, segment_size=args.segment_size)
+        original = list(log.iter_blocks())
+        boundaries = [segment.first_index for segment in log._segments[1:]]
+        log.close()
+        forks = sorted({args.blocks // 2, args.blocks - 1, *boundaries[-2:], *(b + 1 for b in boundaries[-1:])})
+        print(f"{args.blocks} blocks in {len(boundaries) + 1} segments")
+        print(f"{'fork':>8} {'boundary':>9} {'rewrite (ms)':>13} {'reload ok':>10}")
+        for fork in forks:
+            replacement = original[:fork] + [dict(block, nonce=1) for block in original[fork:]]
+            log = ChainLog(directory, segment_size=args.segment_size)
+            _, elapsed = _timed(log.rewrite, replacement)
+            log.close()
+            reloaded = ChainLog(directory, segment_size=args.segment_size)
+            ok = list(reloaded.iter_blocks()) == replacement
+            reloaded.close()
+            print(f"{fork:>8} {str(fork in boundaries):>9} {elapsed * 1e3:>13.1f} {str(ok):>10}")
+            original = replacement
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_tx_index(args):
+    """Chain scans vs TransactionIndex lookups on a synthetic chain"""
+    from blockchain import AdvancedBlockchain
+    from chain_log import ChainLog
+
+    blocks = args.transactions // args.per_block
+    directory = tempfile.mkdtemp(prefix='index-bench-')
+    try:
+        _write_synthetic_chain(directory, blocks, args.per_block)
+        chain = AdvancedBlockchain(chain_log=ChainLog(directory), lazy=False, mining_workers=1)
+        message_ids = random.sample(range(blocks * args.per_block), args.lookups)
+        print(f"{blocks} blocks, {blocks * args.per_block} transactions, {args.lookups} lookups")
+
+        def scan_by_id(message_id):
+            for block in chain.chain:
+                for transaction in block.transactions:
+                    if transaction.get('id') == message_id:
+                        return transaction
+
+        def scan_by_user(user_id):
+            return [transaction for block in chain.chain for transaction in block.transactions
+                    if transaction.get('user_id') == user_id]
+
+        start = time.perf_counter()
+        for message_id in message_ids:
+            scan_by_id(message_id)
+        scan_id_time = (time.perf_counter() - start) / len(message_ids)
+
+        start = time.perf_counter()
+        scan_by_user('7')
+        scan_user_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        chain._indexed()
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for message_id in message_ids:
+            chain.get_message_by_id(message_id)
+        index_id_time = (time.perf_counter() - start) / len(message_ids)
+
+        start = time.perf_counter()
+        found = chain.get_all_messages_for_user('7')
+        index_user_time = time.perf_counter() - start
+
+        print(f"index build:          {build_time * 1e3:10.1f} ms (once, on first lookup)")
+        print(f"get_message_by_id:    scan {scan_id_time * 1e6:10.1f} us   index {index_id_time * 1e6:8.2f} us")
+        print(f"messages for user:    scan {scan_user_time * 1e6:10.1f} us   index {index_user_time * 1e6:8.2f} us "
+              f"({len(found)} results)")
+        chain.chain_log.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_validation(args):
+    """Full vs incremental own-chain validation, and serial vs parallel candidate checks"""
+    from blockchain import AdvancedBlockchain, Block
+    from chain_log import ChainLog
+
+    directory = tempfile.mkdtemp(prefix='validate-bench-')
+    try:
+        chain = AdvancedBlockchain(difficulty=1, chain_log=ChainLog(directory), lazy=False, mining_workers=1)
+        for index in range(1, args.blocks):
+            block = Block(index, time.time(), [{'id': index, 'message_hash': os.urandom(32).hex()}],
+                          chain.chain[-1].hash)
+            block.mine_block(chain.difficulty)
+            chain.chain.append(block)
+        print(f"{args.blocks} blocks, difficulty {chain.difficulty}")
+
+        _, full_time = _timed(chain.is_chain_valid, full=True)
+        tip = chain.chain[-1]
+        block = Block(tip.index + 1, time.time(), [], tip.hash)
+        block.mine_block(chain.difficulty)
+        chain.chain.append(block)
+        _, incremental_time = _timed(chain.is_chain_valid)
+        print(f"own chain:  full {full_time * 1e3:10.1f} ms   after one append {incremental_time * 1e3:8.3f} ms")
+
+        candidate = [block.to_dict() for block in chain.chain]
+        valid, serial_time = _timed(chain.is_valid_chain, candidate, workers=1)
+        assert valid
+        valid, parallel_time = _timed(chain.is_valid_chain, candidate, workers=args.workers, min_parallel_blocks=0)
+        assert valid
+        workers = args.workers or os.cpu_count()
+        print(f"candidate:  serial {serial_time * 1e3:8.1f} ms   {workers} workers {parallel_time * 1e3:8.1f} ms")
+        chain.chain_log.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+class _StandInPeer:
+    """Minimal HTTP peer serving /chain/tip and /chain/blocks from a block log"""
+
+    def __init__(self, chain_log, latency=0.0):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs, urlparse
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                time.sleep(latency)
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path == '/chain/tip':
+                    tip = chain_log.read_block(chain_log.height - 1)
+                    body = json.dumps({'height': chain_log.height, 'hash': tip['hash']}).encode()
+                elif url.path == '/chain/blocks':
+                    start = int(query.get('from', ['0'])[0])
+                    stop = start + int(query.get('limit', [str(chain_log.height)])[0])
+                    body = b''.join(raw for raw in chain_log.iter_raw(start, stop))
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_peer_sync(args):
+    """Sequential full-chain downloads vs concurrent tip polling plus suffix sync"""
+    import requests
+    from blockchain import AdvancedBlockchain, Block
+    from chain_log import ChainLog
+    from peer_sync import PeerSync
+
+    root = tempfile.mkdtemp(prefix='sync-bench-')
+    peers = []
+    try:
+        source = AdvancedBlockchain(difficulty=1, chain_log=ChainLog(os.path.join(root, 'source')),
+                                    lazy=False, mining_workers=1)
+        for index in range(1, args.blocks + args.behind):
+            block = Block(index, time.time(), [{'id': index, 'message_hash': os.urandom(32).hex()}],
+                          source.chain[-1].hash)
+            block.mine_block(source.difficulty)
+            source.chain.append(block)
+        source.save_blockchain()
+
+        # Every peer holds the full chain; the local node lags ``behind`` blocks
+        for _ in range(args.peers):
+            peers.append(_StandInPeer(source.chain_log, latency=args.latency))
+        local_log = ChainLog(os.path.join(root, 'local'))
+        local_log.rewrite(block.to_dict() for block in source.chain[:args.blocks])
+        local = AdvancedBlockchain(difficulty=1, chain_log=local_log, lazy=False, mining_workers=1)
+        print(f"{args.peers} peers, {args.blocks + args.behind} blocks, local node {args.behind} behind, "
+              f"{args.latency * 1e3:.0f} ms latency")
+
+        def naive():
+            longest = None
+            for peer in peers:
+                response = requests.get(f'{peer.url}/chain/blocks', params={'from': 0})
+                chain = [json.loads(line) for line in response.iter_lines() if line]
+                if (len(chain) > len(local.chain) and (longest is None or len(chain) > len(longest))
+                        and local.is_valid_chain(chain, workers=1)):
+                    longest = chain
+            return longest
+
+        longest, naive_time = _timed(naive)
+        assert len(longest) == args.blocks + args.behind
+
+        syncer = PeerSync(local)
+        changed, sync_time = _timed(syncer.sync, [peer.url for peer in peers])
+        assert changed and len(local.chain) == args.blocks + args.behind
+        print(f"sequential full download: {naive_time * 1e3:8.1f} ms")
+        print(f"tip poll + suffix sync:   {sync_time * 1e3:8.1f} ms")
+        syncer.close()
+        local.chain_log.close()
+        source.chain_log.close()
+    finally:
+        for peer in peers:
+            peer.close()
+        shutil.rmtree(root)
+
+
+class _FakeDrive:
+    """In-memory stand-in for the Drive v3 resumable upload and media download endpoints.
+
+    Every ``fail_every``-th request is answered with a 503 to exercise the
+    client's retries.
+    """
+
+    def __init__(self, latency=0.0, fail_every=0):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs, urlparse
+
+        files = {}
+        sessions = {}
+        lock = threading.Lock()
+        counter = [0]
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def read_body(self):
+                return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+            def flaky(self):
+                time.sleep(latency)
+                with lock:
+                    counter[0] += 1
+                    failing = fail_every and counter[0] % fail_every == 0
+                if failing:
+                    self.read_body()
+                    self.reply(503)
+                return failing
+
+            def do_POST(self):
+                if self.flaky():
+                    return
+                self.read_body()
+                upload_id = os.urandom(8).hex()
+                with lock:
+                    sessions[upload_id] = bytearray()
+                host = self.headers['Host']
+                self.reply(200, b'{}', {
+                    'Location': f'http://{host}/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}'
+                })
+
+            def do_PUT(self):
+                if self.flaky():
+                    return
+                upload_id = parse_qs(urlparse(self.path).query)['upload_id'][0]
+                data = self.read_body()
+                content_range = self.headers.get('Content-Range', 'bytes */0')
+                with lock:
+                    received = sessions[upload_id]
+                    span, total = content_range[len('bytes '):].split('/')
+                    if span != '*' and int(span.split('-')[0]) == len(received):
+                        received += data
+                    if total != '*' and len(received) == int(total):
+                        file_id = os.urandom(8).hex()
+                        files[file_id] = bytes(sessions.pop(upload_id))
+                        self.reply(200, json.dumps({'id': file_id}).encode(), {'Content-Type': 'application/json'})
+                        return
+                self.reply(308, headers={'Range': f'bytes=0-{len(received) - 1}'} if received else None)
+
+            def do_GET(self):
+                if self.flaky():
+                    return
+                data = files.get(urlparse(self.path).path.rsplit('/', 1)[-1])
+                if data is None:
+                    self.reply(404)
+                    return
+                first, last = 0, len(data) - 1
+                if self.headers.get('Range'):
+                    first, last = self.headers['Range'][len('bytes='):].split('-')
+                    first, last = int(first), min(int(last), len(data) - 1)
+                self.reply(206, data[first:last + 1], {'Content-Range': f'bytes {first}-{last}/{len(data)}'})
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def service(self):
+        """A Drive API client whose requests go to this server"""
+        from googleapiclient.discovery import build_from_document
+        from googleapiclient.discovery_cache import get_static_doc
+        from googleapiclient.http import build_http
+
+        document = json.loads(get_static_doc('drive', 'v3'))
+        document['rootUrl'] = self.url
+        document['baseUrl'] = self.url + document['servicePath']
+        return build_from_document(document, http=build_http())
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_drive(args):
+    """Serial whole-payload Drive transfers vs chunked, concurrent ones against a fake Drive"""
+    from google_drive import GoogleDriveStorage
+
+    drive = _FakeDrive(latency=args.latency, fail_every=args.fail_every)
+    payloads = [os.urandom(args.size) for _ in range(args.files)]
+    # The client library's default of 100 MB chunks sends each file in one request
+    serial = GoogleDriveStorage(service=drive.service(), chunk_size=100 * 1024 * 1024, max_workers=1)
+    pooled = GoogleDriveStorage(service=drive.service(), chunk_size=args.chunk_size, max_workers=args.workers)
+    print(f"{args.files} files of {args.size} bytes, {args.latency * 1e3:.0f} ms latency, "
+          f"{pooled.chunk_size} byte chunks, {pooled.max_workers} workers")
+    try:
+        uploads, serial_upload = _timed(lambda: [serial.upload_file(data, 'bench.bin') for data in payloads])
+        file_ids = [upload['file_id'] for upload in uploads]
+        contents, serial_download = _timed(lambda: [serial.download_file(file_id) for file_id in file_ids])
+        assert contents == payloads
+
+        uploads, pooled_upload = _timed(pooled.upload_many, [(data, 'bench.bin') for data in payloads])
+        file_ids = [upload['file_id'] for upload in uploads]
+        contents, pooled_download = _timed(pooled.download_many, file_ids)
+        assert contents == payloads
+        print(f"upload:    serial {serial_upload * 1e3:8.1f} ms   pooled {pooled_upload * 1e3:8.1f} ms")
+        print(f"download:  serial {serial_download * 1e3:8.1f} ms   pooled {pooled_download * 1e3:8.1f} ms")
+
+        del contents
+        gc.collect()
+        tracemalloc.start()
+        serial.download_file(file_ids[0])
+        _, bytes_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        with pooled.open_file(file_ids[0], spool_size=pooled.chunk_size):
+            _, spooled_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"peak memory for one download: whole {bytes_peak / 1e6:6.1f} MB   "
+              f"spooled {spooled_peak / 1e6:6.1f} MB")
+    finally:
+        serial.close()
+        pooled.close()
+        drive.close()
+
+
+class _StandInIPFS:
+    """Minimal IPFS HTTP RPC API: /api/v0/version, /api/v0/add and /api/v0/cat, held in memory"""
+
+    def __init__(self, latency=0.0):
+        import hashlib
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs, urlparse
+
+        objects = {}
+
+        class Handler(BaseHTTPRequestHandler):
+            # Like a real node (Go sets TCP_NODELAY); otherwise keep-alive replies stall on delayed ACKs
+            disable_nagle_algorithm = True
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def read_body(self):
+                if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+                    return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                body = bytearray()
+                while True:
+                    size = int(self.rfile.readline().split(b';')[0], 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        return bytes(body)
+                    body += self.rfile.read(size)
+                    self.rfile.readline()
+
+            def reply(self, body, content_type='application/json'):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                time.sleep(latency)
+                url = urlparse(self.path)
+                body = self.read_body()
+                if url.path == '/api/v0/version':
+                    self.reply(b'{"Version": "stand-in"}')
+                elif url.path == '/api/v0/add':
+                    boundary = self.headers['Content-Type'].split('boundary=')[1].encode()
+                    part = body.split(b'--' + boundary)[1]
+                    content = part.split(b'\r\n\r\n', 1)[1][:-2]
+                    cid = 'Qm' + hashlib.sha256(content).hexdigest()[:44]
+                    objects[cid] = content
+                    self.reply(json.dumps({'Name': 'file', 'Hash': cid, 'Size': str(len(content))}).encode())
+                elif url.path == '/api/v0/cat':
+                    content = objects.get(parse_qs(url.query).get('arg', [''])[0])
+                    if content is None:
+                        self.send_error(500)
+                        return
+                    self.reply(content, 'application/octet-stream')
+                else:
+                    self.send_error(404)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_ipfs(args):
+    """A fresh connection per call vs the pooled IPFSClient, against a stand-in IPFS API"""
+    import requests
+    from utils import IPFSClient
+
+    node = _StandInIPFS(latency=args.latency)
+    client = IPFSClient(node.url)
+    payloads = [os.urandom(args.size) for _ in range(args.objects)]
+    print(f"{args.objects} objects of {args.size} bytes, {args.latency * 1e3:.0f} ms latency")
+    try:
+        def fresh_add(data):
+            # Connect, buffer the whole multipart body and disconnect, once per call
+            with requests.Session() as session:
+                response = session.post(f'{node.url}/api/v0/add', files={'file': ('file', data)})
+                return response.json()['Hash']
+
+        def fresh_cat(cid):
+            with requests.Session() as session:
+                return session.post(f'{node.url}/api/v0/cat', params={'arg': cid}).content
+
+        cids, fresh_add_time = _timed(lambda: [fresh_add(data) for data in payloads])
+        _, fresh_cat_time = _timed(lambda: [fresh_cat(cid) for cid in cids])
+        pooled_cids, pooled_add_time = _timed(lambda: [client.add(data) for data in payloads])
+        assert pooled_cids == cids
+        contents, pooled_cat_time = _timed(lambda: [client.cat(cid) for cid in cids])
+        assert contents == payloads
+        print(f"add:  fresh connection {fresh_add_time * 1e3:8.1f} ms   pooled {pooled_add_time * 1e3:8.1f} ms")
+        print(f"cat:  fresh connection {fresh_cat_time * 1e3:8.1f} ms   pooled {pooled_cat_time * 1e3:8.1f} ms")
+
+        del contents
+        gc.collect()
+        tracemalloc.start()
+        fresh_cat(cids[0])
+        _, whole_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        client.cat(cids[0], sink=lambda chunk: None)
+        _, streamed_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"peak memory for one cat: whole {whole_peak / 1e6:6.2f} MB   to a sink {streamed_peak / 1e6:6.2f} MB")
+    finally:
+        client.close()
+        node.close()
+
+
+def bench_crypto(args):
+    """Serial decrypt_data/encrypt_data vs BatchCryptoService on many payloads"""
+    from utils import BatchCryptoService, decrypt_data, encrypt_data
+
+    service = BatchCryptoService(args.workers)
+    payloads = [os.urandom(args.size) for _ in range(args.messages)]
+    print(f"{args.messages} payloads of {args.size} bytes, {service.max_workers} workers")
+    try:
+        tokens, serial_encrypt = _timed(lambda: [encrypt_data(data) for data in payloads])
+        _, batch_encrypt = _timed(lambda: list(service.encrypt_many(payloads)))
+        _, serial_decrypt = _timed(lambda: [decrypt_data(token) for token in tokens])
+        plaintexts, batch_decrypt = _timed(lambda: list(service.decrypt_many(tokens)))
+        assert plaintexts == payloads
+    finally:
+        service.shutdown()
+    print(f"encrypt:  serial {serial_encrypt * 1e3:8.1f} ms   batch {batch_encrypt * 1e3:8.1f} ms")
+    print(f"decrypt:  serial {serial_decrypt * 1e3:8.1f} ms   batch {batch_decrypt * 1e3:8.1f} ms")
+
+
+_STARTUP_PROBE = """
+import sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+ready = time.perf_counter()
+deferred = [name for name in ('web3', 'googleapiclient', 'PIL', 'pandas') if name in sys.modules]
+print((imported - start) * 1e3, (ready - imported) * 1e3, ','.join(deferred) or '-')
+"""
+
+
+def bench_startup(args):
+    """Import and create_app() time of the backend in fresh interpreters, plus what the deferred imports cost"""
+    import subprocess
+    import sys
+
+    backend = os.path.dirname(os.path.abspath(__file__))
+    directory = tempfile.mkdtemp(prefix='startup-bench-')
+    try:
+        # A copy of the backend next to an empty storage directory, so the runs do not touch real data
+        shutil.copytree(backend, os.path.join(directory, 'backend'),
+                        ignore=shutil.ignore_patterns('__pycache__', 'uploads', 'benchmarks.py'))
+        cwd = os.path.join(directory, 'backend')
+        env = dict(os.environ, INFURA_URL='', STORAGE_OFFLOAD='')
+
+        print(f"{'run':>4} {'import (ms)':>12} {'init (ms)':>10}  loaded optional modules")
+        for run in range(1, args.runs + 1):
+            output = subprocess.run([sys.executable, '-c', _STARTUP_PROBE], cwd=cwd, env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            import_ms, init_ms, loaded = output.split()[-3:]
+            # The first run creates the storage and mines the genesis block
+            print(f"{run:>4} {float(import_ms):>12.1f} {float(init_ms):>10.1f}  {loaded}")
+
+        for module in args.modules:
+            probe = f"import time; start = time.perf_counter(); import {module}; print((time.perf_counter() - start) * 1e3)"
+            result = subprocess.run([sys.executable, '-c', probe], cwd=cwd, env=env, capture_output=True, text=True)
+            cost = f"{float(result.stdout.split()[-1]):.1f} ms" if result.returncode == 0 else 'not installed'
+            print(f"deferred: import {module:<26} {cost}")
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    mining = subparsers.add_parser('mining', help='serial vs parallel proof-of-work')
+    mining.add_argument('--difficulty', type=int, default=4)
+    mining.add_argument('--blocks', type=int, default=5)
+    mining.add_argument('--transactions', type=int, default=10)
+    mining.add_argument('--workers', type=int, default=None)
+    mining.set_defaults(func=bench_mining)
+
+    hashing = subparsers.add_parser('hashing', help='per-nonce hashing cost vs block payload size')
+    hashing.add_argument('--transactions', type=int, nargs='+', default=[1, 10, 100, 1000])
+    hashing.add_argument('--nonces', type=int, default=20000)
+    hashing.set_defaults(func=bench_hashing)
+
+    chain_load = subparsers.add_parser('chain-load', help='eager vs lazy chain loading at startup')
+    chain_load.add_argument('--blocks', type=int, nargs='+', default=[1000, 10000, 50000])
+    chain_load.add_argument('--transactions', type=int, default=2)
+    chain_load.set_defaults(func=bench_chain_load)
+
+    reorg = subparsers.add_parser('reorg', help='block log rewrite from a fork point, across segment boundaries')
+    reorg.add_argument('--blocks', type=int, default=5000)
+    reorg.add_argument('--transactions', type=int, default=2)
+    reorg.add_argument('--segment-size', type=int, default=256 * 1024)
+    reorg.set_defaults(func=bench_reorg)
+
+    tx_index = subparsers.add_parser('tx-index', help='chain scans vs transaction index lookups')
+    tx_index.add_argument('--transactions', type=int, default=100000)
+    tx_index.add_argument('--per-block', type=int, default=10)
+    tx_index.add_argument('--lookups', type=int, default=50)
+    tx_index.set_defaults(func=bench_tx_index)
+
+    validate = subparsers.add_parser('validate', help='full vs incremental and parallel chain validation')
+    validate.add_argument('--blocks', type=int, default=20000)
+    validate.add_argument('--workers', type=int, default=None)
+    validate.set_defaults(func=bench_validation)
+
+    peer_sync = subparsers.add_parser('peer-sync', help='naive vs suffix peer sync against stand-in peers')
+    peer_sync.add_argument('--peers', type=int, default=4)
+    peer_sync.add_argument('--blocks', type=int, default=5000)
+    peer_sync.add_argument('--behind', type=int, default=10)
+    peer_sync.add_argument('--latency', type=float, default=0.05)
+    peer_sync.set_defaults(func=bench_peer_sync)
+
+    crypto = subparsers.add_parser('crypto', help='serial vs batched encryption and decryption')
+    crypto.add_argument('--messages', type=int, default=500)
+    crypto.add_argument('--size', type=int, default=256 * 1024)
+    crypto.add_argument('--workers', type=int, default=None)
+    crypto.set_defaults(func=bench_crypto)
+
+    drive = subparsers.add_parser('drive', help='serial vs chunked concurrent transfers against a fake Drive')
+    drive.add_argument('--files', type=int, default=8)
+    drive.add_argument('--size', type=int, default=4 * 1024 * 1024)
+    drive.add_argument('--chunk-size', type=int, default=1024 * 1024)
+    drive.add_argument('--workers', type=int, default=4)
+    drive.add_argument('--latency', type=float, default=0.02)
+    drive.add_argument('--fail-every', type=int, default=0)
+    drive.set_defaults(func=bench_drive)
+
+    ipfs = subparsers.add_parser('ipfs', help='per-call connections vs the pooled IPFS client')
+    ipfs.add_argument('--objects', type=int, default=50)
+    ipfs.add_argument('--size', type=int, default=1024 * 1024)
+    ipfs.add_argument('--latency', type=float, default=0.0)
+    ipfs.set_defaults(func=bench_ipfs)
+
+    startup = subparsers.add_parser('startup', help='cold-start import and app factory time')
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--modules', nargs='+',
+                         default=['web3', 'googleapiclient.discovery', 'PIL.Image', 'pandas'])
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from blob_store import BlobStore
+from utils import decrypt_stream, iter_chunks
+
+# Directory holding local copies of remote (Google Drive / IPFS) payloads
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'storage', 'cache')
+
+
+class BlobIntegrityError(Exception):
+    """A downloaded payload does not decrypt to content with the expected hash"""
+
+
+class BlobCache:
+    """On-disk read-through cache of remote encrypted payloads with LRU eviction.
+
+    Entries are keyed by the remote id together with the content hash
+    recorded for the message and kept in a BlobStore under ``root``. Once
+    the total size passes ``max_bytes`` the least recently read entries are
+    dropped. A payload is only admitted if it decrypts to content matching
+    the expected hash; later reads are still authenticated frame by frame
+    when they are decrypted. Recency is kept in memory and mirrored in file
+    modification times, so it survives restarts.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=None):
+        self.store = BlobStore(root)
+        self.max_bytes = int(max_bytes or os.getenv('BLOB_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+        # key -> size in bytes, least recently used first
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # Per-key locks so concurrent misses on one payload download it once
+        self._filling = {}
+        self._load()
+
+    def _load(self):
+        entries = []
+        for key in self.store.keys():
+            stat = os.stat(self.store._path(key))
+            entries.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size += size
+        self._evict()
+
+    @staticmethod
+    def cache_key(remote_id, content_hash=None):
+        return hashlib.sha256(f"{remote_id}\0{content_hash or ''}".encode()).hexdigest()
+
+    def _open_hit(self, key):
+        """Open a cached entry and mark it most recently used; None if absent. Call with the lock held."""
+        if key not in self._entries:
+            return None
+        try:
+            source = self.store.open(key)
+        except FileNotFoundError:
+            self._size -= self._entries.pop(key)
+            return None
+        self._entries.move_to_end(key)
+        os.utime(self.store._path(key))
+        self.hits += 1
+        return source
+
+    def open(self, remote_id, fetch, content_hash=None):
+        """Open the encrypted payload of ``remote_id`` as a binary file object.
+
+        On a miss ``fetch(destination)`` is called to download the payload
+        into a writable binary file object. With ``content_hash`` the
+        download must decrypt to content with that SHA-256 digest, or
+        BlobIntegrityError is raised and nothing is cached.
+        """
+        key = self.cache_key(remote_id, content_hash)
+        with self._lock:
+            source = self._open_hit(key)
+            if source is not None:
+                return source
+            fill_lock = self._filling.setdefault(key, threading.Lock())
+
+        with fill_lock:
+            with self._lock:
+                # Another request may have filled the entry while this one waited
+                source = self._open_hit(key)
+                if source is not None:
+                    return source
+                self.misses += 1
+            try:
+                return self._fill(key, fetch, content_hash)
+            finally:
+                with self._lock:
+                    self._filling.pop(key, None)
+
+    def _fill(self, key, fetch, content_hash):
+        with tempfile.TemporaryFile(dir=self.store.root) as download:
+            fetch(download)
+            if content_hash:
+                download.seek(0)
+                digest = hashlib.sha256()
+                for chunk in decrypt_stream(download):
+                    digest.update(chunk)
+                if digest.hexdigest() != content_hash:
+                    with self._lock:
+                        self.rejected += 1
+                    raise BlobIntegrityError(f"Payload {key} does not match content hash {content_hash}")
+            download.seek(0)
+            self.store.put_stream(iter_chunks(download), lambda: key)
+            size = download.tell()
+
+        with self._lock:
+            self._size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict(keep=key)
+            return self.store.open(key)
+
+    def _evict(self, keep=None):
+        """Drop least recently used entries until the cache fits. Call with the lock held."""
+        for key in list(self._entries):
+            if self._size <= self.max_bytes:
+                return
+            if key == keep:
+                continue
+            self._size -= self._entries.pop(key)
+            # Readers holding the file open keep their copy until they close it
+            self.store.delete(key)
+            self.evictions += 1
+
+    def discard(self, remote_id, content_hash=None):
+        """Remove a cached payload, e.g. once its remote copy is deleted"""
+        return self.remove(self.cache_key(remote_id, content_hash))
+
+    def keys(self):
+        """Cache keys of every entry, least recently used first"""
+        with self._lock:
+            return list(self._entries)
+
+    def remove(self, key):
+        """Remove the entry stored under a cache key"""
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)
+            return self.store.delete(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'rejected': self.rejected,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,136 @@
+import os
+import re
+import threading
+import uuid
+from collections import Counter
+
+# Directory holding encrypted message payloads
+BLOBS_DIR = os.path.join(os.path.dirname(__file__), '..', 'storage', 'blobs')
+
+_KEY_PATTERN = re.compile(r'^[0-9a-f]{16,128}$')
+
+
+class BlobStore:
+    """Content-addressed store for encrypted payloads on local disk.
+
+    Blobs are keyed by a hex digest (the message ``content_hash``) and fanned
+    out into two-character subdirectories. Writing a key that already exists
+    is a no-op, so identical uploads share a single blob.
+
+    Because blobs are shared, one is only deleted once nothing references
+    it. A blob written with ``pin=True`` counts as referenced until
+    ``unpin``, covering the gap before the caller records its reference.
+    """
+
+    def __init__(self, root=BLOBS_DIR):
+        self.root = root
+        # Guards the pins and the commit/delete steps that must see them
+        self._lock = threading.Lock()
+        self._pins = Counter()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        if not isinstance(key, str) or not _KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return os.path.join(self.root, key[:2], key)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, data):
+        """Store ``data`` under ``key`` unless it is already present"""
+        path = self._path(key)
+        if os.path.exists(path):
+            return key
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data if isinstance(data, bytes) else data.encode())
+        os.replace(tmp_path, path)
+        return key
+
+    def put_stream(self, chunks, key_func, pin=False):
+        """Stream byte ``chunks`` into a blob named by ``key_func()`` once they are written.
+
+        This lets the key be a digest computed while streaming. If that key
+        already exists the new copy is discarded. With ``pin`` the blob is
+        pinned against ``delete_unreferenced`` until ``unpin``.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, f"incoming-{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            key = key_func()
+            path = self._path(key)
+            with self._lock:
+                if os.path.exists(path):
+                    os.remove(tmp_path)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(tmp_path, path)
+                if pin:
+                    self._pins[key] += 1
+            return key
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def replace_stream(self, key, chunks):
+        """Atomically overwrite an existing blob, e.g. after re-encrypting it"""
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def keys(self):
+        """Yield the key of every stored blob"""
+        for prefix in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, prefix)
+            if len(prefix) != 2 or not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                if _KEY_PATTERN.match(name):
+                    yield name
+
+    def open(self, key):
+        """Open a blob for streaming reads"""
+        return open(self._path(key), 'rb')
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def size(self, key):
+        return os.path.getsize(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def unpin(self, key):
+        """Release a pin taken by ``put_stream``"""
+        with self._lock:
+            self._pins[key] -= 1
+            if self._pins[key] <= 0:
+                del self._pins[key]
+
+    def delete_unreferenced(self, key, count_refs):
+        """Delete a blob if it is unpinned and ``count_refs(key)`` is zero; return True if deleted"""
+        with self._lock:
+            if self._pins[key] or count_refs(key):
+                return False
+            return self.delete(key)
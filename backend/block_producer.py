@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+import uuid
+
+
+class BlockProducer:
+    """Background block producer fed by a mempool of submitted transactions.
+
+    ``submit`` queues a transaction in the blockchain's pending list and
+    returns a transaction id immediately. A worker thread seals a block once
+    ``max_batch`` transactions are waiting, or ``block_interval`` seconds
+    after the oldest one arrived, whichever comes first.
+    """
+
+    def __init__(self, blockchain, block_interval=None, max_batch=None, on_sealed=None):
+        self.blockchain = blockchain
+        self.block_interval = float(block_interval if block_interval is not None
+                                    else os.getenv('BLOCK_INTERVAL', 5))
+        self.max_batch = int(max_batch if max_batch is not None
+                             else os.getenv('BLOCK_MAX_TRANSACTIONS', 50))
+        # Called as on_sealed(block) after each block is appended
+        self.on_sealed = on_sealed
+        self._condition = threading.Condition()
+        self._oldest_pending = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            if self.blockchain.pending_transactions:
+                self._oldest_pending = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='block-producer', daemon=True)
+        self._thread.start()
+
+    def stop(self, flush=True):
+        """Stop the worker thread, sealing whatever is still pending if ``flush``"""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self.seal()
+
+    def submit(self, transaction):
+        """Queue a transaction for the next block and return its tx id"""
+        tx_id = uuid.uuid4().hex
+        self.blockchain.add_transaction(dict(transaction, tx_id=tx_id))
+        with self._condition:
+            if self._oldest_pending is None:
+                # Wake the worker so it starts timing the interval
+                self._oldest_pending = time.monotonic()
+                self._condition.notify_all()
+            elif len(self.blockchain.pending_transactions) >= self.max_batch:
+                self._condition.notify_all()
+        return tx_id
+
+    def status(self, tx_id):
+        """Return the confirmation status of a submitted transaction, or None"""
+        if any(tx.get('tx_id') == tx_id for tx in list(self.blockchain.pending_transactions)):
+            return {'tx_id': tx_id, 'status': 'pending'}
+
+        location = self.blockchain.find_transaction(tx_id)
+        if location is None:
+            return None
+        block, _ = location
+        return {
+            'tx_id': tx_id,
+            'status': 'confirmed',
+            'block_index': block.index,
+            'block_hash': block.hash
+        }
+
+    def seal(self):
+        """Mine one block from the pending transactions; return it, or None"""
+        with self._condition:
+            self._oldest_pending = None
+        try:
+            block = self.blockchain.mine_pending_transactions(self.max_batch)
+            if not block:
+                return None
+        finally:
+            # Leftovers (or a failed batch) start a fresh interval
+            with self._condition:
+                if self.blockchain.pending_transactions and self._oldest_pending is None:
+                    self._oldest_pending = time.monotonic()
+
+        if self.on_sealed:
+            try:
+                self.on_sealed(block)
+            except Exception as e:
+                print(f"Block producer callback failed: {e}")
+        return block
+
+    def _seal_due(self):
+        if not self.blockchain.pending_transactions:
+            return False
+        if len(self.blockchain.pending_transactions) >= self.max_batch:
+            return True
+        return (self._oldest_pending is not None and
+                time.monotonic() - self._oldest_pending >= self.block_interval)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._seal_due():
+                    if self._oldest_pending is None:
+                        self._condition.wait()
+                    else:
+                        remaining = self.block_interval - (time.monotonic() - self._oldest_pending)
+                        self._condition.wait(max(remaining, 0.01))
+                if not self._running:
+                    return
+            try:
+                self.seal()
+            except Exception as e:
+                print(f"Block producer failed to seal a block: {e}")
+                time.sleep(1)
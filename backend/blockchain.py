@@ -1,38 +1,177 @@
 import hashlib
-import requests
 import json
 from time import time
 from datetime import datetime
-from web3 import Web3
 import os
-
-# Blockchain persistence file
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from chain_log import ChainLog
+from peer_sync import PeerSync
+from tx_index import TransactionIndex
+from mining import (BLOCK_VERSION, ParallelMiner, block_hash, header_prefix, merkle_root, mine_serial,
+                    prefix_hash, process_context)
+
+# Legacy single-file persistence, imported into the block log on first load
 BLOCKCHAIN_FILE = os.path.join(os.path.dirname(__file__), '..', 'storage', 'blockchain.json')
 
 class Block:
 
-    def __init__(self, index, timestamp, transactions, previous_hash, nonce=0):
+    def __init__(self, index, timestamp, transactions, previous_hash, nonce=0, version=BLOCK_VERSION):
         self.index = index
         self.timestamp = timestamp
         self.transactions = transactions  # List of time-locked messages
         self.previous_hash = previous_hash
         self.nonce = nonce
+        self.version = version
         self.hash = self.calculate_hash()
 
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'timestamp': self.timestamp,
+            'transactions': self.transactions,
+            'previous_hash': self.previous_hash,
+            'nonce': self.nonce,
+            'version': self.version,
+            'hash': self.hash
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a persisted block, keeping its stored hash"""
+        block = cls.__new__(cls)
+        block.index = data['index']
+        block.timestamp = data['timestamp']
+        block.transactions = data['transactions']
+        block.previous_hash = data['previous_hash']
+        block.nonce = data['nonce']
+        block.version = data.get('version', 1)
+        block.hash = data['hash']
+        return block
+
+    def header_prefix(self):
+        """Serialized header without the nonce (version 2 blocks only)"""
+        return header_prefix(self.index, self.timestamp, merkle_root(self.transactions),
+                             self.previous_hash, self.version)
+
     def calculate_hash(self):
-        block_string = json.dumps({
-            "index": self.index,
-            "timestamp": self.timestamp,
-            "transactions": self.transactions,
-            "previous_hash": self.previous_hash,
-            "nonce": self.nonce
-        }, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
-
-    def mine_block(self, difficulty):
-        while self.hash[:difficulty] != '0' * difficulty:
-            self.nonce += 1
-            self.hash = self.calculate_hash()
+        if self.version < 2:
+            # Legacy blocks hash the full JSON, transactions included
+            return block_hash({
+                "index": self.index,
+                "timestamp": self.timestamp,
+                "transactions": self.transactions,
+                "previous_hash": self.previous_hash
+            }, self.nonce)
+        return prefix_hash(self.header_prefix(), self.nonce)
+
+    def mine_block(self, difficulty, miner=None):
+        """Find a nonce meeting ``difficulty``, optionally with a ParallelMiner"""
+        if self.version < 2:
+            # Kept for legacy blocks; new blocks always take the prefix path
+            while self.hash[:difficulty] != '0' * difficulty:
+                self.nonce += 1
+                self.hash = self.calculate_hash()
+            return
+
+        prefix = self.header_prefix()
+        if miner is None:
+            self.nonce, self.hash = mine_serial(prefix, difficulty, self.nonce)
+        else:
+            self.nonce, self.hash = miner.mine(prefix, difficulty, self.nonce)
+
+
+def validate_block_sequence(blocks, difficulty=None):
+    """Check hashes and links of consecutive blocks.
+
+    The first block only anchors the check of the second; every later block
+    must hash correctly, point at its predecessor and, if ``difficulty`` is
+    given, carry a hash with that many leading zeros.
+    """
+    previous = None
+    for block in blocks:
+        if previous is not None:
+            if block.index != previous.index + 1:
+                return False
+            if block.hash != block.calculate_hash():
+                return False
+            if block.previous_hash != previous.hash:
+                return False
+            if difficulty and not block.hash.startswith('0' * difficulty):
+                return False
+        previous = block
+    return True
+
+
+def _validate_chunk(block_dicts, difficulty):
+    """Worker entry point for parallel candidate-chain validation"""
+    return validate_block_sequence((Block.from_dict(data) for data in block_dicts), difficulty)
+
+
+class LazyChain:
+    """List-like view of the chain that materializes blocks from the block log.
+
+    Only the log's offset index stays in memory; ``Block`` objects are parsed
+    on access and a small LRU cache keeps the most recently used ones, the
+    chain tip in particular. Appends write straight through to the log. The
+    cache is shared by request threads and the miner, so it is only touched
+    under a lock; parsing happens outside it.
+    """
+
+    def __init__(self, chain_log, cache_size=256):
+        self.chain_log = chain_log
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def __len__(self):
+        return self.chain_log.height
+
+    def _remember(self, index, block):
+        with self._cache_lock:
+            self._cache[index] = block
+            self._cache.move_to_end(index)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _materialize(self, index):
+        with self._cache_lock:
+            block = self._cache.get(index)
+            if block is not None:
+                self._cache.move_to_end(index)
+                return block
+        block = Block.from_dict(self.chain_log.read_block(index))
+        self._remember(index, block)
+        return block
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._materialize(i) for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('chain index out of range')
+        return self._materialize(key)
+
+    def __iter__(self):
+        # Full scans parse blocks one by one without filling the cache
+        for data in self.chain_log.iter_blocks():
+            yield Block.from_dict(data)
+
+    def iter_range(self, start, stop):
+        """Stream blocks ``start`` to ``stop - 1`` without filling the cache"""
+        for data in self.chain_log.iter_blocks(start, stop):
+            yield Block.from_dict(data)
+
+    def __reversed__(self):
+        for index in range(len(self) - 1, -1, -1):
+            yield Block.from_dict(self.chain_log.read_block(index))
+
+    def append(self, block):
+        self.chain_log.append(block.to_dict())
+        self._remember(block.index, block)
+
 
 class SmartContract:
     def __init__(self, contract_address, abi):
@@ -40,12 +179,30 @@ class SmartContract:
         self.abi = abi
 
 class AdvancedBlockchain:
-    def __init__(self, difficulty=4, ethereum_node_url=None):
+    def __init__(self, difficulty=4, ethereum_node_url=None, mining_workers=None, chain_log=None,
+                 lazy=None):
+        if lazy is None:
+            lazy = os.getenv('CHAIN_STORAGE', 'lazy').lower() == 'lazy'
+        self.lazy = lazy
         self.chain = []
         self.pending_transactions = []
         self.difficulty = difficulty
+        self.miner = ParallelMiner(mining_workers)
+        # Guards chain and pending list updates; mining itself runs outside it
+        self.lock = threading.RLock()
+        self._mining_lock = threading.Lock()
+        self.chain_log = chain_log or ChainLog()
+        self.tx_index = TransactionIndex()
+        # Blocks [0, verified_height) have been validated; verified_hash pins the last one
+        self.verified_height = 0
+        self.verified_hash = None
+        # Log height recorded in the checkpoint file
+        self._checkpoint_height = 0
+        if self.lazy:
+            self.chain = LazyChain(self.chain_log)
         self.smart_contracts = {}
         self.nodes = set()
+        self.peer_sync = None
         self.ethereum_integration = None
 
         if ethereum_node_url:
@@ -54,54 +211,145 @@ class AdvancedBlockchain:
         # Try to load existing blockchain from file
         if not self.load_blockchain():
             self.create_genesis_block()
+            self.save_blockchain()
 
 
     def connect_to_ethereum(self, node_url):
+        # web3 is slow to import and only needed here
+        from web3 import Web3
+
         self.ethereum_integration = Web3(Web3.HTTPProvider(node_url))
         if not self.ethereum_integration.is_connected():
             raise Exception("Failed to connect to Ethereum node")
 
     def create_genesis_block(self):
         genesis_block = Block(0, time(), [], "0")
-        genesis_block.mine_block(self.difficulty)
+        genesis_block.mine_block(self.difficulty, self.miner)
         self.chain.append(genesis_block)
 
     def get_latest_block(self):
         return self.chain[-1]
 
     def add_transaction(self, transaction):
-        self.pending_transactions.append(transaction)
+        with self.lock:
+            self.chain_log.append_pending(transaction)
+            self.pending_transactions.append(transaction)
+
+    def mine_pending_transactions(self, max_transactions=None):
+        """Mine up to ``max_transactions`` pending transactions into a new block.
+
+        Transactions added while the proof-of-work runs stay pending for the
+        next block. Returns the new block, or False if nothing was pending.
+        """
+        with self._mining_lock:
+            with self.lock:
+                if not self.pending_transactions:
+                    return False
+                batch = self.pending_transactions[:max_transactions]
+                block = Block(
+                    len(self.chain),
+                    time(),
+                    batch,
+                    self.get_latest_block().hash
+                )
 
-    def mine_pending_transactions(self):
-        if not self.pending_transactions:
-            return False
-
-        block = Block(
-            len(self.chain),
-            time(),
-            self.pending_transactions.copy(),
-            self.get_latest_block().hash
-        )
-        block.mine_block(self.difficulty)
-        self.chain.append(block)
-        self.pending_transactions = []
-        
-        # Save blockchain to file after mining
-        self.save_blockchain()
-        return True
+            block.mine_block(self.difficulty, self.miner)
 
+            with self.lock:
+                if self.get_latest_block().hash != block.previous_hash:
+                    # A peer's blocks were adopted while mining; the batch stays pending
+                    return False
+                self.chain.append(block)
+                if self.tx_index.height == block.index:
+                    self.tx_index.add_block(block)
+                self.pending_transactions = self.pending_transactions[len(batch):]
+
+                # Save blockchain to file after mining; the checkpoint follows the fsync batching
+                self.save_blockchain(checkpoint=False)
+            return block
+
+    def _indexed(self):
+        """Return the transaction index, first catching it up with the chain.
+
+        After a load the index is empty and gets rebuilt here on the first
+        lookup; afterwards mining keeps it current block by block.
+        """
+        with self.lock:
+            if self.tx_index.height > len(self.chain):
+                self.tx_index.clear()
+            # Streamed so a rebuild does not churn the LazyChain cache
+            for block in self._iter_blocks(self.tx_index.height, len(self.chain)):
+                self.tx_index.add_block(block)
+            return self.tx_index
+
+    def _transaction_at(self, location):
+        block_index, position = location
+        return self.chain[block_index].transactions[position]
+
+    def find_transaction(self, tx_id):
+        """Return ``(block, transaction)`` for a mined transaction id, or None"""
+        location = self._indexed().by_tx_id.get(tx_id)
+        if location is None:
+            return None
+        block = self.chain[location[0]]
+        return block, block.transactions[location[1]]
+
+
+    def _iter_blocks(self, start, stop):
+        if isinstance(self.chain, LazyChain):
+            return self.chain.iter_range(start, stop)
+        return iter(self.chain[start:stop])
+
+    def is_chain_valid(self, full=False):
+        """Validate the blocks appended since the last verified checkpoint.
+
+        The checkpoint only counts while the block at ``verified_height - 1``
+        still has the recorded hash; otherwise, or with ``full=True``, every
+        block from index 1 is re-checked.
+        """
+        with self.lock:
+            height = len(self.chain)
+            start = 1
+            if (not full and 1 <= self.verified_height <= height and
+                    self.chain[self.verified_height - 1].hash == self.verified_hash):
+                start = self.verified_height
+
+            if start < height and not validate_block_sequence(self._iter_blocks(start - 1, height)):
+                return False
 
-    def is_chain_valid(self):
-        for i in range(1, len(self.chain)):
-            current_block = self.chain[i]
-            previous_block = self.chain[i-1]
+            if height:
+                self.verified_height = height
+                self.verified_hash = self.chain[height - 1].hash
+            return True
 
-            if current_block.hash != current_block.calculate_hash():
-                return False
+    def is_valid_chain(self, chain_data, workers=None, min_parallel_blocks=2000):
+        """Fully validate a candidate chain (block dicts or Blocks), e.g. from a peer.
 
-            if current_block.previous_hash != previous_block.hash:
-                return False
+        Long chains are split into overlapping chunks checked in parallel by a
+        process pool; the first failing chunk cancels the rest.
+        """
+        blocks = [data if isinstance(data, dict) else data.to_dict() for data in chain_data]
+        if not blocks or blocks[0]['index'] != 0:
+            return False
 
+        if workers is None:
+            workers = int(os.getenv('VALIDATION_WORKERS', os.cpu_count() or 1))
+        if workers <= 1 or len(blocks) < min_parallel_blocks:
+            return _validate_chunk(blocks, self.difficulty)
+
+        chunk_size = -(-len(blocks) // workers)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=process_context()) as pool:
+            pending = {
+                # Each chunk starts with the last block of the previous one as its anchor
+                pool.submit(_validate_chunk, blocks[max(start - 1, 0):start + chunk_size], self.difficulty)
+                for start in range(0, len(blocks), chunk_size)
+            }
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                if not all(future.result() for future in done):
+                    for future in pending:
+                        future.cancel()
+                    return False
         return True
 
     def add_node(self, address):
@@ -109,27 +357,47 @@ class AdvancedBlockchain:
 
     def resolve_conflicts(self):
         """Consensus algorithm to resolve chain conflicts"""
-        longest_chain = None
-        max_length = len(self.chain)
-
-        for node in self.nodes:
-            try:
-                response = requests.get(f'http://{node}/chain')
-                if response.status_code == 200:
-                    length = response.json()['length']
-                    chain = response.json()['chain']
-
-                    if length > max_length and self.is_valid_chain(chain):
-                        max_length = length
-                        longest_chain = chain
-            except:
-                pass
-
-        if longest_chain:
-            self.chain = longest_chain
-            return True
+        if self.peer_sync is None:
+            self.peer_sync = PeerSync(self)
+        return self.peer_sync.sync()
+
+    def _adopt(self, blocks):
+        """Drop pending transactions that arrived inside a peer's blocks"""
+        adopted = {tx.get('tx_id') for block in blocks for tx in block.transactions} - {None}
+        if adopted:
+            self.pending_transactions = [tx for tx in self.pending_transactions
+                                         if tx.get('tx_id') not in adopted]
+
+    def extend_chain(self, new_blocks):
+        """Append a peer's blocks (dicts) that continue our tip.
+
+        Only the new blocks are validated, anchored on the current tip.
+        Returns False, leaving the chain untouched, if they don't link up or
+        fail validation.
+        """
+        blocks = [Block.from_dict(block_data) for block_data in new_blocks]
+        with self.lock:
+            if not blocks or blocks[0].index != len(self.chain):
+                return False
+            if not validate_block_sequence([self.get_latest_block()] + blocks, self.difficulty):
+                return False
+            for block in blocks:
+                self.chain.append(block)
+            self._adopt(blocks)
+            self.save_blockchain(checkpoint=False)
+        return True
 
-        return False
+    def replace_chain(self, new_chain):
+        """Adopt a different chain (Blocks or dicts) and rewrite the block log to match"""
+        new_chain = [block if isinstance(block, Block) else Block.from_dict(block) for block in new_chain]
+        with self.lock:
+            self.chain_log.rewrite(block.to_dict() for block in new_chain)
+            self.chain = LazyChain(self.chain_log) if self.lazy else new_chain
+            self.tx_index.clear()
+            self.verified_height = 0
+            self.verified_hash = None
+            self._adopt(new_chain)
+            self.save_blockchain()
 
     def deploy_smart_contract(self, contract_code, contract_name):
         """Deploy a smart contract to the blockchain"""
@@ -165,11 +433,8 @@ class AdvancedBlockchain:
             return f"Executed {function_name} on {contract_name} with args {args}"
 
     def get_message_by_id(self, message_id):
-        for block in self.chain:
-            for transaction in block.transactions:
-                if transaction.get('id') == message_id:
-                    return transaction
-        return None
+        location = self._indexed().by_message_id.get(message_id)
+        return self._transaction_at(location) if location else None
 
     def can_reveal_message(self, message_id):
         transaction = self.get_message_by_id(message_id)
@@ -180,12 +445,11 @@ class AdvancedBlockchain:
         return datetime.now() >= unlock_time
 
     def get_all_messages_for_user(self, user_id):
-        messages = []
-        for block in self.chain:
-            for transaction in block.transactions:
-                if transaction.get('user_id') == user_id:
-                    messages.append(transaction)
-        return messages
+        return [self._transaction_at(location) for location in self._indexed().by_user.get(user_id, [])]
+
+    def get_all_messages_for_wallet(self, wallet):
+        """Return transactions sent from or addressed to ``wallet``"""
+        return [self._transaction_at(location) for location in self._indexed().by_wallet.get(wallet, [])]
 
     def get_blockchain_stats(self):
         """Get advanced blockchain statistics"""
@@ -193,8 +457,7 @@ class AdvancedBlockchain:
         total_transactions = sum(len(block.transactions) for block in self.chain)
         average_block_time = 0
         if total_blocks > 1:
-            timestamps = [block.timestamp for block in self.chain]
-            average_block_time = (timestamps[-1] - timestamps[0]) / (total_blocks - 1)
+            average_block_time = (self.chain[-1].timestamp - self.chain[0].timestamp) / (total_blocks - 1)
 
         return {
             'total_blocks': total_blocks,
@@ -206,79 +469,105 @@ class AdvancedBlockchain:
             'ethereum_connected': self.ethereum_integration is not None and self.ethereum_integration.is_connected()
         }
 
-    def save_blockchain(self):
-        """Save blockchain to JSON file for persistence"""
+    def save_blockchain(self, checkpoint=True):
+        """Append blocks not yet in the block log and checkpoint the rest of the state.
+
+        With ``checkpoint=False`` the checkpoint is only rewritten once the
+        log has grown by ``fsync_every`` blocks since the last one; pending
+        transactions stay safe in the mempool journal meanwhile.
+        """
         try:
-            # Ensure storage directory exists
-            os.makedirs(os.path.dirname(BLOCKCHAIN_FILE), exist_ok=True)
-            
-            # Convert chain to serializable format
-            chain_data = []
-            for block in self.chain:
-                chain_data.append({
-                    'index': block.index,
-                    'timestamp': block.timestamp,
-                    'transactions': block.transactions,
-                    'previous_hash': block.previous_hash,
-                    'nonce': block.nonce,
-                    'hash': block.hash
+            with self.lock:
+                for block in self.chain[self.chain_log.height:]:
+                    self.chain_log.append(block.to_dict())
+
+                if not checkpoint and self.chain_log.height - self._checkpoint_height < self.chain_log.fsync_every:
+                    return True
+                self._checkpoint_height = self.chain_log.height
+                self.chain_log.write_checkpoint({
+                    'verified_height': self.verified_height,
+                    'verified_hash': self.verified_hash,
+                    'pending_transactions': self.pending_transactions,
+                    'difficulty': self.difficulty,
+                    'smart_contracts': {k: {'address': v.contract_address, 'abi': v.abi}
+                                        for k, v in self.smart_contracts.items()},
+                    'nodes': list(self.nodes)
                 })
-            
-            data = {
-                'chain': chain_data,
-                'pending_transactions': self.pending_transactions,
-                'difficulty': self.difficulty,
-                'smart_contracts': {k: {'address': v.contract_address, 'abi': v.abi} 
-                                   for k, v in self.smart_contracts.items()},
-                'nodes': list(self.nodes)
-            }
-            
-            with open(BLOCKCHAIN_FILE, 'w') as f:
-                json.dump(data, f, indent=2)
             return True
         except Exception as e:
             print(f"Error saving blockchain: {e}")
             return False
 
+    def _restore_state(self, data):
+        """Restore pending transactions, contracts and nodes from saved state"""
+        self.pending_transactions = data.get('pending_transactions', [])
+        self.difficulty = data.get('difficulty', self.difficulty)
+        self.verified_height = data.get('verified_height', 0)
+        self.verified_hash = data.get('verified_hash')
+        self.nodes = set(data.get('nodes', []))
+
+        for name, contract_data in data.get('smart_contracts', {}).items():
+            self.smart_contracts[name] = SmartContract(
+                contract_data['address'],
+                contract_data['abi']
+            )
+
+    def _recover_pending(self, checkpoint_height):
+        """Re-queue transactions journaled after the checkpoint, dropping any already sealed.
+
+        Only blocks appended after the checkpoint can hold transactions the
+        checkpoint still lists as pending, so just those are scanned.
+        """
+        sealed = {tx.get('tx_id') for block_data in self.chain_log.iter_blocks(checkpoint_height)
+                  for tx in block_data['transactions']} - {None}
+        seen = set()
+        pending = []
+        for transaction in self.pending_transactions + self.chain_log.read_pending():
+            tx_id = transaction.get('tx_id')
+            if tx_id is not None:
+                if tx_id in sealed or tx_id in seen:
+                    continue
+                seen.add(tx_id)
+            pending.append(transaction)
+        self.pending_transactions = pending
+
     def load_blockchain(self):
-        """Load blockchain from JSON file"""
+        """Stream the chain back from the block log, importing blockchain.json once"""
         try:
-            if not os.path.exists(BLOCKCHAIN_FILE):
-                return False
-            
-            with open(BLOCKCHAIN_FILE, 'r') as f:
-                data = json.load(f)
-            
-            # Restore chain
-            self.chain = []
-            for block_data in data.get('chain', []):
-                block = Block(
-                    block_data['index'],
-                    block_data['timestamp'],
-                    block_data['transactions'],
-                    block_data['previous_hash'],
-                    block_data['nonce']
-                )
-                block.hash = block_data['hash']
-                self.chain.append(block)
-            
-            # Restore other data
-            self.pending_transactions = data.get('pending_transactions', [])
-            self.difficulty = data.get('difficulty', 4)
-            self.nodes = set(data.get('nodes', []))
-            
-            # Restore smart contracts
-            for name, contract_data in data.get('smart_contracts', {}).items():
-                self.smart_contracts[name] = SmartContract(
-                    contract_data['address'],
-                    contract_data['abi']
-                )
-            
-            print(f"Blockchain loaded from file: {len(self.chain)} blocks")
+            if self.chain_log.height == 0:
+                return self._import_legacy_file()
+
+            if self.lazy:
+                # Blocks are parsed on demand from the mmapped log
+                self.chain = LazyChain(self.chain_log)
+            else:
+                self.chain = [Block.from_dict(block_data) for block_data in self.chain_log.iter_blocks()]
+            checkpoint = self.chain_log.read_checkpoint()
+            self._restore_state(checkpoint)
+            self._checkpoint_height = checkpoint.get('height', 0)
+            self._recover_pending(self._checkpoint_height)
+
+            print(f"Blockchain loaded from block log: {len(self.chain)} blocks")
             return True
         except Exception as e:
             print(f"Error loading blockchain: {e}")
             return False
 
-# Global blockchain instance
-blockchain = AdvancedBlockchain()
+    def _import_legacy_file(self):
+        """Load the old single-file blockchain.json and move it into the block log"""
+        if not os.path.exists(BLOCKCHAIN_FILE):
+            return False
+
+        with open(BLOCKCHAIN_FILE, 'r') as f:
+            data = json.load(f)
+
+        self.chain = [Block.from_dict(block_data) for block_data in data.get('chain', [])]
+        if not self.chain:
+            return False
+        self._restore_state(data)
+        self.save_blockchain()
+        if self.lazy:
+            self.chain = LazyChain(self.chain_log)
+
+        print(f"Blockchain imported from {BLOCKCHAIN_FILE}: {len(self.chain)} blocks")
+        return True
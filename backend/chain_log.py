@@ -0,0 +1,344 @@
+import bisect
+import json
+import mmap
+import os
+import re
+import threading
+from array import array
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; the single-process rule is then unenforced
+    fcntl = None
+
+# Directory holding the block log segments and the state checkpoint
+CHAIN_DIR = os.path.join(os.path.dirname(__file__), '..', 'storage', 'chain')
+
+_SEGMENT_PATTERN = re.compile(r'^segment-(\d{9})\.jsonl$')
+
+
+class ChainLogLocked(Exception):
+    """The block log directory is already open in another process"""
+
+
+class _Segment:
+    """One segment file plus the byte offset of every record in it"""
+
+    def __init__(self, first_index, path):
+        self.first_index = first_index
+        self.path = path
+        self.index_path = path[:-len('.jsonl')] + '.idx'
+        self.offsets = array('Q')
+        self.size = 0
+        self.mapped = None
+
+    def end_of(self, position):
+        return self.offsets[position + 1] if position + 1 < len(self.offsets) else self.size
+
+
+class ChainLog:
+    """Append-only block log split into rotating JSONL segment files.
+
+    Each block is one JSON line. A segment is named after the index of its
+    first block and is closed once it grows past ``segment_size`` bytes. A
+    sidecar ``.idx`` file per segment holds the 8-byte offset of each record,
+    so opening the log only loads those offsets, and a single block can be
+    read back through an mmap without parsing its neighbours.
+
+    Appends are flushed immediately but only fsynced every ``fsync_every``
+    blocks and before each checkpoint. Mutable chain state (pending
+    transactions, contracts, nodes) lives in a separate checkpoint file that
+    is replaced atomically. Transactions submitted since the last checkpoint
+    are journaled to ``mempool.jsonl`` and fsynced as they arrive, so a crash
+    before the next checkpoint does not lose them.
+
+    Heights and file offsets are tracked in memory, so only one process may
+    write a log: opening takes an exclusive lock on the directory and raises
+    ChainLogLocked if another process holds it.
+    """
+
+    def __init__(self, directory=CHAIN_DIR, segment_size=None, fsync_every=None):
+        self.directory = directory
+        self.segment_size = int(segment_size or os.getenv('CHAIN_SEGMENT_SIZE', 8 * 1024 * 1024))
+        self.fsync_every = int(fsync_every or os.getenv('CHAIN_FSYNC_EVERY', 16))
+        self.checkpoint_path = os.path.join(self.directory, 'checkpoint.json')
+        self.mempool_path = os.path.join(self.directory, 'mempool.jsonl')
+        self.lock = threading.RLock()
+        self._file = None
+        self._index_file = None
+        self._unsynced = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = self._lock_directory()
+        self._segments = self._load_segments()
+        self._first_indexes = [segment.first_index for segment in self._segments]
+        self.height = self._segments[-1].first_index + len(self._segments[-1].offsets) if self._segments else 0
+
+    def _lock_directory(self):
+        lock_file = open(os.path.join(self.directory, '.lock'), 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise ChainLogLocked(f"Block log {self.directory} is in use by another process; "
+                                     f"run a single server process")
+        return lock_file
+
+    def _load_segments(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            match = _SEGMENT_PATTERN.match(name)
+            if match:
+                segments.append(_Segment(int(match.group(1)), os.path.join(self.directory, name)))
+        segments.sort(key=lambda segment: segment.first_index)
+        for position, segment in enumerate(segments):
+            self._recover(segment, is_last=position == len(segments) - 1)
+        return segments
+
+    def _recover(self, segment, is_last):
+        """Load a segment's offsets, indexing any records the .idx file lacks.
+
+        A torn record at the end of the last segment is truncated away.
+        """
+        segment.size = os.path.getsize(segment.path)
+        if os.path.exists(segment.index_path):
+            with open(segment.index_path, 'rb') as f:
+                segment.offsets.frombytes(f.read())
+            while segment.offsets and segment.offsets[-1] >= segment.size:
+                segment.offsets.pop()
+
+        indexed = len(segment.offsets)
+        scan_from = segment.offsets.pop() if segment.offsets else 0
+        valid_size = scan_from
+        with open(segment.path, 'rb') as f:
+            f.seek(scan_from)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    json.loads(line)
+                except ValueError:
+                    break
+                segment.offsets.append(valid_size)
+                valid_size += len(line)
+
+        if valid_size != segment.size:
+            if not is_last:
+                raise ValueError(f"Corrupt block record in {segment.path}")
+            print(f"Truncating incomplete block record in {segment.path}")
+            with open(segment.path, 'r+b') as f:
+                f.truncate(valid_size)
+            segment.size = valid_size
+
+        if len(segment.offsets) != indexed:
+            with open(segment.index_path, 'wb') as f:
+                segment.offsets.tofile(f)
+
+    def _open_segment(self):
+        if self._file is not None and self._segments[-1].size < self.segment_size:
+            return self._segments[-1]
+        self._close_files()
+
+        if not self._segments or self._segments[-1].size >= self.segment_size:
+            path = os.path.join(self.directory, f'segment-{self.height:09d}.jsonl')
+            self._segments.append(_Segment(self.height, path))
+            self._first_indexes.append(self.height)
+        segment = self._segments[-1]
+        self._file = open(segment.path, 'ab')
+        self._index_file = open(segment.index_path, 'ab')
+        return segment
+
+    def _sync_files(self):
+        if self._file is not None and self._unsynced:
+            for f in (self._file, self._index_file):
+                f.flush()
+                os.fsync(f.fileno())
+            self._unsynced = 0
+
+    def _close_files(self):
+        if self._file is not None:
+            self._sync_files()
+            self._file.close()
+            self._index_file.close()
+            self._file = self._index_file = None
+
+    def append(self, block_data):
+        """Append one block record; O(1) regardless of chain length"""
+        if block_data['index'] != self.height:
+            raise ValueError(f"Expected block {self.height}, got {block_data['index']}")
+        line = json.dumps(block_data, sort_keys=True, separators=(',', ':')).encode() + b'\n'
+        with self.lock:
+            segment = self._open_segment()
+            self._file.write(line)
+            self._file.flush()
+            offset = array('Q', [segment.size])
+            self._index_file.write(offset.tobytes())
+            self._index_file.flush()
+            segment.offsets.append(segment.size)
+            segment.size += len(line)
+            self.height += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                self._sync_files()
+
+    def sync(self):
+        """Force buffered appends to disk"""
+        with self.lock:
+            self._sync_files()
+
+    def _locate(self, index):
+        if not 0 <= index < self.height:
+            raise IndexError(f"Block {index} out of range")
+        segment = self._segments[bisect.bisect_right(self._first_indexes, index) - 1]
+        return segment, index - segment.first_index
+
+    def read_raw(self, index):
+        """Return the serialized record of one block, read through an mmap"""
+        with self.lock:
+            segment, position = self._locate(index)
+            start, end = segment.offsets[position], segment.end_of(position)
+            if segment.mapped is None or len(segment.mapped) < end:
+                # The active segment grows, so remap it when reads pass the old end
+                if segment.mapped is not None:
+                    segment.mapped.close()
+                with open(segment.path, 'rb') as f:
+                    segment.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return segment.mapped[start:end]
+
+    def read_block(self, index):
+        """Parse and return the record of one block"""
+        return json.loads(self.read_raw(index))
+
+    def iter_raw(self, start=0, stop=None):
+        """Stream serialized block records from ``start`` up to ``stop``"""
+        stop = self.height if stop is None else min(stop, self.height)
+        for index in range(max(start, 0), stop):
+            yield self.read_raw(index)
+
+    def iter_blocks(self, start=0, stop=None):
+        """Stream parsed block records from ``start`` up to ``stop``"""
+        for raw in self.iter_raw(start, stop):
+            yield json.loads(raw)
+
+    def truncate(self, height):
+        """Drop every block from ``height`` on.
+
+        Segments are removed from the newest backwards and the one holding
+        ``height`` is cut last, so a crash part way leaves a shorter but
+        intact log. ``height`` only moves down once the files behind it are
+        gone, so an error part way leaves it matching what is on disk.
+        """
+        with self.lock:
+            if height >= self.height:
+                return
+            self._close_files()
+            while self._segments and self._segments[-1].first_index >= height:
+                segment = self._segments[-1]
+                if segment.mapped is not None:
+                    segment.mapped.close()
+                    segment.mapped = None
+                # The record file goes last; an .idx without its segment is ignored on load
+                for path in (segment.index_path, segment.path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._segments.pop()
+                self._first_indexes.pop()
+                self.height = segment.first_index
+            if self._segments:
+                segment = self._segments[-1]
+                position = height - segment.first_index
+                # position == len(offsets) when height falls on a segment boundary: keep it whole
+                if position < len(segment.offsets):
+                    if segment.mapped is not None:
+                        segment.mapped.close()
+                        segment.mapped = None
+                    size = segment.offsets[position]
+                    with open(segment.index_path, 'r+b') as f:
+                        f.truncate(position * segment.offsets.itemsize)
+                        os.fsync(f.fileno())
+                    with open(segment.path, 'r+b') as f:
+                        f.truncate(size)
+                        os.fsync(f.fileno())
+                    segment.size = size
+                    del segment.offsets[position:]
+            self.height = height
+            self._unsynced = 0
+
+    def rewrite(self, blocks):
+        """Make the log hold exactly ``blocks``, e.g. after adopting a peer's chain.
+
+        Blocks matching the current log are kept; only the log from the first
+        differing block on is truncated and appended again, so a crash never
+        loses the shared prefix.
+        """
+        with self.lock:
+            blocks = iter(blocks)
+            fork = 0
+            replacement = []
+            for block_data in blocks:
+                line = json.dumps(block_data, sort_keys=True, separators=(',', ':')).encode() + b'\n'
+                if fork < self.height and self.read_raw(fork) == line:
+                    fork += 1
+                    continue
+                replacement.append(block_data)
+                break
+            self.truncate(fork)
+            for block_data in replacement:
+                self.append(block_data)
+            for block_data in blocks:
+                self.append(block_data)
+            self._sync_files()
+
+    def write_checkpoint(self, state):
+        """Atomically replace the checkpoint after making the log durable"""
+        self.sync()
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(state, height=self.height), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        # The checkpoint now holds every pending transaction
+        with self.lock:
+            if os.path.exists(self.mempool_path):
+                os.remove(self.mempool_path)
+
+    def read_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path, 'r') as f:
+            return json.load(f)
+
+    def append_pending(self, transaction):
+        """Durably journal a transaction submitted since the last checkpoint"""
+        line = json.dumps(transaction, sort_keys=True, separators=(',', ':')).encode() + b'\n'
+        with self.lock:
+            with open(self.mempool_path, 'ab') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read_pending(self):
+        """Transactions journaled since the last checkpoint, skipping a torn last line"""
+        if not os.path.exists(self.mempool_path):
+            return []
+        transactions = []
+        with open(self.mempool_path, 'rb') as f:
+            for line in f:
+                try:
+                    transactions.append(json.loads(line))
+                except ValueError:
+                    break
+        return transactions
+
+    def close(self):
+        with self.lock:
+            self._close_files()
+            for segment in self._segments:
+                if segment.mapped is not None:
+                    segment.mapped.close()
+                    segment.mapped = None
+            if self._lock_file is not None:
+                # Releases the directory lock
+                self._lock_file.close()
+                self._lock_file = None
@@ -0,0 +1,80 @@
+import json
+import queue
+import threading
+
+
+class Subscription:
+    """One listener's bounded event queue and the channels it follows"""
+
+    def __init__(self, channels, max_queue):
+        self.channels = frozenset(channels)
+        self.queue = queue.Queue(maxsize=max_queue)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A stalled client loses its oldest event rather than blocking publishers
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(event)
+
+    def get(self, timeout=None):
+        """Return the next event, or None after ``timeout`` seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """In-process publish/subscribe hub keyed by channel (user id or wallet).
+
+    Publishing only touches the subscriptions registered on the target
+    channels, so the cost is independent of how many other clients are
+    connected.
+    """
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels):
+        subscription = Subscription({channel for channel in channels if channel}, self.max_queue)
+        with self._lock:
+            for channel in subscription.channels:
+                self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                listeners = self._channels.get(channel)
+                if listeners is not None:
+                    listeners.discard(subscription)
+                    if not listeners:
+                        del self._channels[channel]
+
+    def publish(self, channels, event_type, data):
+        """Deliver one event to every subscription on any of ``channels``, once each"""
+        event = (event_type, data)
+        with self._lock:
+            targets = set()
+            for channel in channels:
+                if channel:
+                    targets.update(self._channels.get(channel, ()))
+        for subscription in targets:
+            subscription.put(event)
+        return len(targets)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({subscription for listeners in self._channels.values() for subscription in listeners})
+
+
+def format_sse(event_type, data):
+    """Serialize one Server-Sent Events frame"""
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
@@ -1,27 +1,83 @@
 import os
 import io
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 import pickle
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+SCOPES = ['https://www.googleapis.com/auth/drive.file']
+TOKEN_FILE = 'token.pickle'
+
+# Bytes sent or fetched per request; Drive needs upload chunks in multiples of 256 KiB
+CHUNK_ALIGNMENT = 256 * 1024
+
 
 class GoogleDriveStorage:
-    def __init__(self, folder_id=None):
+    """Google Drive file storage, connected on first use.
+
+    Nothing touches the Google APIs until a Drive method is called, so
+    deployments that never use Drive start without loading the client
+    libraries or credentials. Signing in through the browser only happens
+    on the main thread; without a saved token, first use from a request or
+    background thread fails fast and the failure is remembered instead of
+    retried on every call. Run ``python google_drive.py`` once to sign in
+    and save the token. Pass ``service`` to use a prebuilt Drive API
+    client, for example one pointed at a local fake, with the
+    ``credentials`` it should authorize requests with, if any. Once
+    authenticated, a background thread refreshes the access token shortly
+    before it expires so requests do not stall on a token refresh.
+
+    Transfers stream through file objects in ``chunk_size`` pieces over a
+    per-thread HTTP connection. Failed chunks are retried with exponential
+    backoff, resuming the upload session or download offset rather than
+    starting over, and ``upload_many``/``download_many`` run several
+    transfers at once on a bounded worker pool.
+    """
+
+    def __init__(self, folder_id=None, service=None, credentials=None, refresh_margin=300,
+                 chunk_size=None, retries=None, max_workers=None, timeout=None):
         self.folder_id = folder_id or '1Xj0wc8Hhtbu96pgp-65GmgW6jZ1Zo_7v'
-        self.creds = None
-        self.service = None
-        self.authenticate()
+        self.creds = credentials
+        self.refresh_margin = refresh_margin
+        chunk_size = int(chunk_size or os.getenv('DRIVE_CHUNK_SIZE', 8 * 1024 * 1024))
+        self.chunk_size = max(-(-chunk_size // CHUNK_ALIGNMENT), 1) * CHUNK_ALIGNMENT
+        self.retries = int(retries if retries is not None else os.getenv('DRIVE_RETRIES', 5))
+        self.max_workers = int(max_workers or os.getenv('DRIVE_TRANSFER_WORKERS', 4))
+        self.timeout = float(timeout or os.getenv('DRIVE_TIMEOUT', 60))
+        self._service = service
+        self._auth_failed = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._executor = None
+        self._stop_event = threading.Event()
+        self._refresher = None
+
+    @property
+    def service(self):
+        """The Drive API client, authenticating on first access; None if that failed"""
+        if self._service is None and not self._auth_failed:
+            with self._lock:
+                if self._service is None and not self._auth_failed:
+                    try:
+                        self._auth_failed = not self.authenticate()
+                    except Exception as e:
+                        print(f"Google Drive authentication failed: {e}")
+                        self._auth_failed = True
+        return self._service
 
     def authenticate(self):
         """Authenticate with Google Drive API"""
-        SCOPES = ['https://www.googleapis.com/auth/drive.file']
+        from googleapiclient.discovery import build
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request
 
         creds = None
         # The file token.pickle stores the user's access and refresh tokens
-        if os.path.exists('token.pickle'):
-            with open('token.pickle', 'rb') as token:
+        if os.path.exists(TOKEN_FILE):
+            with open(TOKEN_FILE, 'rb') as token:
                 creds = pickle.load(token)
 
         # If there are no (valid) credentials available, let the user log in.
@@ -39,39 +95,155 @@ class GoogleDriveStorage:
                 if not creds_file:
                     print("Google Drive credentials file not found. Please ensure client_secret_*.json is in the root directory.")
                     return False
+                if threading.current_thread() is not threading.main_thread():
+                    # The browser sign-in would block this thread indefinitely on a headless server
+                    print("Google Drive has no saved token; run `python google_drive.py` once to sign in.")
+                    return False
 
                 flow = InstalledAppFlow.from_client_secrets_file(creds_file, SCOPES)
                 creds = flow.run_local_server(port=0)
 
             # Save the credentials for the next run
-            with open('token.pickle', 'wb') as token:
-                pickle.dump(creds, token)
+            self._save_token(creds)
 
         try:
-            self.service = build('drive', 'v3', credentials=creds)
-            return True
+            self._service = build('drive', 'v3', credentials=creds, cache_discovery=False)
         except Exception as e:
             print(f"Google Drive authentication failed: {e}")
             return False
 
+        self.creds = creds
+        self._auth_failed = False
+        if creds.refresh_token:
+            self._start_refresher()
+        return True
+
+    def _save_token(self, creds):
+        try:
+            with open(TOKEN_FILE, 'wb') as token:
+                pickle.dump(creds, token)
+        except OSError as e:
+            print(f"Warning: Could not save Google Drive token: {e}")
+
+    def _start_refresher(self):
+        if self._refresher is not None:
+            return
+        self._refresher = threading.Thread(target=self._refresh_loop, name='drive-token-refresh', daemon=True)
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        from google.auth.transport.requests import Request
+
+        while True:
+            # google-auth keeps expiry as a naive UTC datetime
+            expiry = self.creds.expiry
+            delay = (expiry - datetime.utcnow()).total_seconds() - self.refresh_margin if expiry else self.refresh_margin
+            if self._stop_event.wait(max(delay, 30)):
+                return
+            try:
+                self.creds.refresh(Request())
+                self._save_token(self.creds)
+            except Exception as e:
+                # Requests still refresh on demand if this keeps failing
+                print(f"Google Drive token refresh failed: {e}")
+
+    def close(self):
+        """Stop the background token refresher and the transfer pool"""
+        self._stop_event.set()
+        if self._refresher:
+            self._refresher.join()
+            self._refresher = None
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _http(self):
+        """This thread's HTTP connection; httplib2 connections are not thread-safe"""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            from googleapiclient.http import build_http
+            # Unlike a bare httplib2.Http, this does not treat the 308 of a resumable upload as a redirect
+            http = build_http()
+            http.timeout = self.timeout
+            if self.creds is not None:
+                from google_auth_httplib2 import AuthorizedHttp
+                http = AuthorizedHttp(self.creds, http=http)
+            self._local.http = http
+        return http
+
+    def _run_chunks(self, next_chunk):
+        """Call ``next_chunk()`` until it returns ``(True, result)``.
+
+        Dropped connections, timeouts and HTTP 429 or 5xx replies are
+        retried with backoff, resuming from the last chunk the server
+        acknowledged.
+        """
+        import httplib2
+        from googleapiclient.errors import HttpError
+
+        failures = 0
+        while True:
+            try:
+                done, result = next_chunk()
+            except (OSError, httplib2.HttpLib2Error, HttpError) as e:
+                if isinstance(e, HttpError) and e.resp.status != 429 and e.resp.status < 500:
+                    raise
+                failures += 1
+                if failures > self.retries:
+                    raise
+                delay = random.random() * min(2 ** failures, 32)
+                print(f"Google Drive transfer interrupted ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            failures = 0
+            if done:
+                return result
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='drive')
+            return self._executor
+
     def upload_file(self, file_data, filename, mimetype='application/octet-stream'):
-        """Upload a file to Google Drive"""
+        """Upload a file to Google Drive from bytes or a binary file object"""
         if not self.service:
             raise Exception("Google Drive not authenticated")
 
+        from googleapiclient.http import MediaIoBaseUpload
+
         try:
             file_metadata = {
                 'name': filename,
                 'parents': [self.folder_id]
             }
 
-            media = MediaIoBaseUpload(io.BytesIO(file_data), mimetype=mimetype, resumable=True)
+            if not hasattr(file_data, 'read'):
+                stream = io.BytesIO(file_data)
+            elif file_data.seekable():
+                stream = file_data
+            else:
+                # The upload needs the total size up front, so spool pipes and sockets first
+                stream = tempfile.SpooledTemporaryFile(max_size=self.chunk_size)
+                for chunk in iter(lambda: file_data.read(self.chunk_size), b''):
+                    stream.write(chunk)
+                stream.seek(0)
+            media = MediaIoBaseUpload(stream, mimetype=mimetype, chunksize=self.chunk_size, resumable=True)
 
-            file = self.service.files().create(
+            request = self.service.files().create(
                 body=file_metadata,
                 media_body=media,
                 fields='id,webViewLink,webContentLink'
-            ).execute()
+            )
+            http = self._http()
+
+            def next_chunk():
+                # The client library's own retries would resend an already consumed chunk
+                # stream, so failed chunks are retried from a fresh slice by _run_chunks
+                _, response = request.next_chunk(http=http)
+                return response is not None, response
+
+            file = self._run_chunks(next_chunk)
 
             return {
                 'file_id': file.get('id'),
@@ -81,24 +253,60 @@ class GoogleDriveStorage:
         except Exception as e:
             raise Exception(f"Failed to upload file to Google Drive: {str(e)}")
 
-    def download_file(self, file_id):
-        """Download a file from Google Drive"""
+    def download_file(self, file_id, destination=None):
+        """Download a file from Google Drive.
+
+        With a binary file object as ``destination`` the content is written
+        there chunk by chunk and the object is returned; otherwise the
+        content is returned as bytes.
+        """
         if not self.service:
             raise Exception("Google Drive not authenticated")
 
+        from googleapiclient.http import MediaIoBaseDownload
+
         try:
             request = self.service.files().get_media(fileId=file_id)
-            file_data = io.BytesIO()
-            downloader = MediaIoBaseDownload(file_data, request)
+            request.http = self._http()
+            file_data = destination if destination is not None else io.BytesIO()
+            downloader = MediaIoBaseDownload(file_data, request, chunksize=self.chunk_size)
+
+            def next_chunk():
+                # No client-side retries: _run_chunks is the one retry layer
+                _, done = downloader.next_chunk()
+                return done, None
 
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
+            self._run_chunks(next_chunk)
 
-            return file_data.getvalue()
+            return file_data if destination is not None else file_data.getvalue()
         except Exception as e:
             raise Exception(f"Failed to download file from Google Drive: {str(e)}")
 
+    def open_file(self, file_id, spool_size=1024 * 1024):
+        """Download a file into a temporary file object positioned at its start.
+
+        Content stays in memory up to ``spool_size`` bytes and moves to disk
+        beyond that.
+        """
+        destination = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        try:
+            self.download_file(file_id, destination)
+        except BaseException:
+            destination.close()
+            raise
+        destination.seek(0)
+        return destination
+
+    def upload_many(self, files):
+        """Upload ``(file_data, filename[, mimetype])`` tuples concurrently; results keep input order"""
+        return list(self._pool().map(lambda args: self.upload_file(*args), files))
+
+    def download_many(self, file_ids, destinations=None):
+        """Download several files concurrently, as bytes or into matching ``destinations``"""
+        file_ids = list(file_ids)
+        destinations = list(destinations) if destinations is not None else [None] * len(file_ids)
+        return list(self._pool().map(self.download_file, file_ids, destinations))
+
     def delete_file(self, file_id):
         """Delete a file from Google Drive"""
         if not self.service:
@@ -121,5 +329,22 @@ class GoogleDriveStorage:
         except Exception as e:
             raise Exception(f"Failed to get file info from Google Drive: {str(e)}")
 
-# Global instance
-google_drive = GoogleDriveStorage()
+
+_instance = None
+_instance_lock = threading.Lock()
+
+
+def get_google_drive():
+    """Return the shared GoogleDriveStorage; cheap, as it connects on first use"""
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = GoogleDriveStorage()
+    return _instance
+
+
+if __name__ == '__main__':
+    # Sign in interactively and save the token for the server to use
+    if GoogleDriveStorage().authenticate():
+        print(f"Google Drive token saved to {TOKEN_FILE}")
@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import threading
+
+SEQUENCES_DB = os.path.join(os.path.dirname(__file__), '..', 'storage', 'sequences.db')
+
+
+class IdAllocator:
+    """Monotonic id sequence persisted in a SQLite ``sequences`` table.
+
+    Each allocation bumps the stored high-water mark inside a ``BEGIN
+    IMMEDIATE`` transaction, so ids stay unique across threads and worker
+    processes sharing the database file, and an id is never handed out
+    again, even after the row that used it is deleted.
+    """
+
+    def __init__(self, name, path=SEQUENCES_DB):
+        self.name = name
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL)'
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode, so BEGIN IMMEDIATE below controls the transaction
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _bump(self, update):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value FROM sequences WHERE name = ?', (self.name,)).fetchone()
+            value = update(row[0] if row else 0)
+            conn.execute(
+                'INSERT INTO sequences (name, value) VALUES (?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET value = excluded.value',
+                (self.name, value)
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return value
+
+    def seed(self, value):
+        """Raise the high-water mark to at least ``value``, e.g. the largest id on file"""
+        return self._bump(lambda current: max(current, int(value or 0)))
+
+    def allocate(self):
+        """Return the next id"""
+        return self._bump(lambda current: current + 1)
+
+    def peek(self):
+        """Return the last id handed out, without allocating"""
+        row = self._connection().execute('SELECT value FROM sequences WHERE name = ?', (self.name,)).fetchone()
+        return row[0] if row else 0
@@ -0,0 +1,51 @@
+from functools import lru_cache
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+
+
+class KeyRing:
+    """Ordered Fernet keys: the first (primary) encrypts, any of them decrypts.
+
+    Cipher objects are built once per ring instead of on every call. To
+    rotate, put the new key first and keep the old ones until the
+    re-encryption job has moved every stored payload onto the primary key.
+    """
+
+    def __init__(self, keys):
+        keys = [key.decode() if isinstance(key, bytes) else key for key in keys if key]
+        if not keys:
+            raise ValueError("At least one encryption key is required")
+        self.keys = keys
+        self.primary_key = keys[0]
+        self.primary = Fernet(keys[0].encode())
+        self.cipher = MultiFernet([Fernet(key.encode()) for key in keys]) if len(keys) > 1 else self.primary
+
+    @property
+    def rotating(self):
+        """True while older keys are still configured for decryption"""
+        return len(self.keys) > 1
+
+    def encrypt(self, data):
+        return self.primary.encrypt(data)
+
+    def decrypt(self, token):
+        return self.cipher.decrypt(token)
+
+    def is_primary(self, token):
+        """True if ``token`` was encrypted under the primary key"""
+        try:
+            self.primary.decrypt(token)
+            return True
+        except InvalidToken:
+            return False
+
+
+@lru_cache(maxsize=16)
+def key_ring_for(encryption_key):
+    """Cached single-key ring for callers that pass an explicit key"""
+    return KeyRing([encryption_key])
+
+
+def parse_keys(value):
+    """Split a comma-separated ENCRYPTION_KEYS value, newest key first"""
+    return [key.strip() for key in (value or '').split(',') if key.strip()]
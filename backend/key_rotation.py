@@ -0,0 +1,165 @@
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from utils import KEY_RING, decrypt_stream, encrypt_stream, is_primary_payload
+
+
+class ReencryptionJob:
+    """Background job moving stored payloads onto the primary encryption key.
+
+    Blobs are visited in batches of ``batch_size`` with a ``pause`` between
+    batches to keep the load low. A blob still encrypted under an older key
+    is decrypted and re-encrypted as a stream, then swapped in atomically
+    under the same key; blobs already on the primary key cost one frame
+    decryption to check.
+
+    With ``tiered_storage``, payloads of messages in remote storage are
+    downloaded and checked too; stale ones are re-encrypted, uploaded
+    again, their messages repointed at the new copy and the old copy
+    deleted. With ``blob_cache``, cached copies on an older key are dropped
+    so they are fetched again. Payloads that could not be rotated are
+    counted in ``failed``; older keys must stay configured until a pass
+    finishes with none.
+    """
+
+    def __init__(self, blob_store, key_ring=None, batch_size=None, pause=None, tiered_storage=None,
+                 blob_cache=None):
+        self.blob_store = blob_store
+        self.key_ring = key_ring or KEY_RING
+        self.batch_size = int(batch_size or os.getenv('REENCRYPT_BATCH_SIZE', 50))
+        self.pause = float(pause if pause is not None else os.getenv('REENCRYPT_PAUSE', 1.0))
+        self.tiered_storage = tiered_storage
+        self.blob_cache = blob_cache
+        self.examined = 0
+        self.rotated = 0
+        self.failed = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def rotate(self, key):
+        """Re-encrypt one blob if needed; return True if it was rewritten"""
+        with self.blob_store.open(key) as source:
+            if is_primary_payload(source, self.key_ring):
+                return False
+        with self.blob_store.open(key) as source:
+            self.blob_store.replace_stream(
+                key, encrypt_stream(decrypt_stream(source, self.key_ring), self.key_ring)
+            )
+        return True
+
+    def rotate_remote(self, rows):
+        """Re-encrypt the remote payload shared by ``rows`` if needed; return True if it was replaced"""
+        storage = self.tiered_storage
+        backend = storage.backend_for(rows[0])
+        ref = storage.ref_for(rows[0])
+        with tempfile.TemporaryFile() as download:
+            backend.fetch(ref, download)
+            download.seek(0)
+            if is_primary_payload(download, self.key_ring):
+                return False
+            download.seek(0)
+            with tempfile.TemporaryFile() as rotated:
+                for frame in encrypt_stream(decrypt_stream(download, self.key_ring), self.key_ring):
+                    rotated.write(frame)
+                rotated.seek(0)
+                new_ref = backend.put(rotated, rows[0]['blob_ref'] or ref)
+
+        for row in rows:
+            storage.message_store.update(row['id'], ipfs_hash=new_ref)
+            if self.blob_cache is not None:
+                self.blob_cache.discard(ref, storage.content_hash_for(row))
+        try:
+            backend.delete(ref)
+        except Exception as e:
+            # Only leaves an unreferenced copy behind
+            print(f"Could not delete replaced payload {ref}: {e}")
+        return True
+
+    def run_batch(self, keys):
+        """Rotate one batch of blob keys"""
+        for key in keys:
+            self.examined += 1
+            try:
+                if self.rotate(key):
+                    self.rotated += 1
+            except FileNotFoundError:
+                # Deleted since the scan started
+                pass
+            except Exception as e:
+                self.failed += 1
+                print(f"Re-encryption of blob {key} failed: {e}")
+
+    def run_remote(self):
+        """Rotate the payloads of messages in remote storage"""
+        shared = defaultdict(list)
+        for row in self.tiered_storage.message_store.list_remote_rows():
+            shared[(self.tiered_storage.storage_of(row), row['ipfs_hash'])].append(row)
+        for index, rows in enumerate(shared.values()):
+            if self._stop_event.is_set():
+                return
+            self.examined += 1
+            try:
+                if self.rotate_remote(rows):
+                    self.rotated += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Re-encryption of remote payload {rows[0]['ipfs_hash']} failed: {e}")
+            if (index + 1) % self.batch_size == 0:
+                self._stop_event.wait(self.pause)
+
+    def purge_cache(self):
+        """Drop cached copies still encrypted under an older key"""
+        for key in self.blob_cache.keys():
+            try:
+                with self.blob_cache.store.open(key) as source:
+                    stale = not is_primary_payload(source, self.key_ring)
+            except FileNotFoundError:
+                continue
+            except Exception:
+                stale = True
+            if stale:
+                self.blob_cache.remove(key)
+
+    def run(self):
+        """Walk every payload once; return the number rewritten"""
+        batch = []
+        for key in self.blob_store.keys():
+            if self._stop_event.is_set():
+                break
+            batch.append(key)
+            if len(batch) >= self.batch_size:
+                self.run_batch(batch)
+                batch = []
+                self._stop_event.wait(self.pause)
+        if batch and not self._stop_event.is_set():
+            self.run_batch(batch)
+        if self.tiered_storage is not None and not self._stop_event.is_set():
+            self.run_remote()
+        if self.blob_cache is not None and not self._stop_event.is_set():
+            self.purge_cache()
+        return self.rotated
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='reencryption', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        started = time.monotonic()
+        rotated = self.run()
+        print(f"Re-encryption pass finished: {rotated} of {self.examined} payloads rewritten "
+              f"({self.failed} failed) in {time.monotonic() - started:.1f}s")
+        if self.failed or self._stop_event.is_set():
+            print("Some payloads may still need an older encryption key; keep every key in ENCRYPTION_KEYS")
+        else:
+            print("Every stored payload is on the primary encryption key; older keys can be removed")
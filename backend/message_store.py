@@ -0,0 +1,500 @@
+import csv
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+
+from id_allocator import IdAllocator
+
+# Column order of the legacy messages.csv file, plus later additions
+MESSAGE_FIELDS = ['id', 'user_id', 'receiver_wallet', 'ipfs_hash', 'message_type', 'unlock_time', 'created_time', 'status', 'encrypted_message', 'tx_hash', 'blob_ref', 'tx_id', 'content_size', 'storage']
+
+# Columns needed for listings; excludes any legacy inline ciphertext
+METADATA_FIELDS = [field for field in MESSAGE_FIELDS if field != 'encrypted_message']
+
+# Storage file paths
+MESSAGES_CSV = os.path.join(os.path.dirname(__file__), '..', 'storage', 'messages.csv')
+MESSAGES_DB = os.path.join(os.path.dirname(__file__), '..', 'storage', 'messages.db')
+
+
+def _normalize(message):
+    """Return a message dict with every known field present and ``id`` as int"""
+    row = {field: (message.get(field) or '') for field in MESSAGE_FIELDS}
+    row['id'] = int(message['id'])
+    return row
+
+
+class MessageStore:
+    """Interface for message persistence backends"""
+
+    def get(self, message_id):
+        """Return the message with the given id, or None"""
+        raise NotImplementedError
+
+    def insert(self, message):
+        """Insert a new message row"""
+        raise NotImplementedError
+
+    def update(self, message_id, **fields):
+        """Update fields of a single message; return True if it existed"""
+        raise NotImplementedError
+
+    def delete(self, message_id):
+        """Delete a single message; return True if it existed"""
+        raise NotImplementedError
+
+    def list_for_user(self, user_id=None, wallet=None):
+        """Return metadata of messages sent by ``user_id`` or addressed to ``wallet``"""
+        raise NotImplementedError
+
+    def list_by_status(self, status):
+        """Return ``(id, unlock_time)`` for every message with the given status"""
+        raise NotImplementedError
+
+    def list_rows_by_status(self, status):
+        """Return metadata of every message with the given status"""
+        raise NotImplementedError
+
+    def list_remote_rows(self):
+        """Return metadata of every message whose payload is in remote storage"""
+        raise NotImplementedError
+
+    def list_unsealed_rows(self):
+        """Return metadata of messages submitted to the chain that have no block hash yet"""
+        raise NotImplementedError
+
+    def transition_status(self, message_ids, from_status, to_status):
+        """Move the given messages from ``from_status`` to ``to_status`` in one batch.
+
+        Messages in any other status are left alone; returns the metadata
+        rows that actually changed.
+        """
+        raise NotImplementedError
+
+    def count_blob_refs(self, blob_ref):
+        """Return how many messages read their payload from the given local blob.
+
+        Messages offloaded to remote storage keep ``blob_ref`` as their
+        content hash but are not counted.
+        """
+        raise NotImplementedError
+
+    def move_payloads_to_blobs(self, blob_store):
+        """Move legacy inline ``encrypted_message`` payloads into ``blob_store``"""
+        raise NotImplementedError
+
+    def next_id(self):
+        """Allocate the id for a new message; ids are never handed out twice"""
+        raise NotImplementedError
+
+    def count(self):
+        """Return the number of stored messages"""
+        raise NotImplementedError
+
+
+class CSVMessageStore(MessageStore):
+    """Legacy backend that keeps every message in a single CSV file.
+
+    Every mutation rewrites the whole file; prefer :class:`SQLiteMessageStore`.
+    """
+
+    def __init__(self, path=MESSAGES_CSV):
+        self.path = path
+        self.lock = threading.Lock()
+        csv.field_size_limit(sys.maxsize)
+        self.ids = IdAllocator('messages', os.path.join(os.path.dirname(self.path), 'sequences.db'))
+        with self.lock:
+            self.ids.seed(max((row['id'] for row in self._read_all()), default=0))
+
+    def _read_all(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r', newline='', encoding='utf-8') as f:
+            return [_normalize(row) for row in csv.DictReader(f)]
+
+    def _write_all(self, rows):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=MESSAGE_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(tmp_path, self.path)
+
+    def get(self, message_id):
+        with self.lock:
+            for row in self._read_all():
+                if row['id'] == int(message_id):
+                    return row
+        return None
+
+    def insert(self, message):
+        row = _normalize(message)
+        with self.lock:
+            exists = os.path.exists(self.path)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=MESSAGE_FIELDS)
+                if not exists:
+                    writer.writeheader()
+                writer.writerow(row)
+        return row
+
+    def update(self, message_id, **fields):
+        with self.lock:
+            rows = self._read_all()
+            found = False
+            for row in rows:
+                if row['id'] == int(message_id):
+                    row.update(fields)
+                    found = True
+            if found:
+                self._write_all(rows)
+            return found
+
+    def delete(self, message_id):
+        with self.lock:
+            rows = self._read_all()
+            remaining = [row for row in rows if row['id'] != int(message_id)]
+            if len(remaining) == len(rows):
+                return False
+            self._write_all(remaining)
+            return True
+
+    def list_for_user(self, user_id=None, wallet=None):
+        with self.lock:
+            return [{field: row[field] for field in METADATA_FIELDS}
+                    for row in self._read_all()
+                    if (user_id and row['user_id'] == str(user_id)) or
+                       (wallet and row['receiver_wallet'] == wallet)]
+
+    def list_by_status(self, status):
+        with self.lock:
+            return [(row['id'], row['unlock_time']) for row in self._read_all() if row['status'] == status]
+
+    def list_rows_by_status(self, status):
+        with self.lock:
+            return [{field: row[field] for field in METADATA_FIELDS}
+                    for row in self._read_all() if row['status'] == status]
+
+    def list_remote_rows(self):
+        with self.lock:
+            return [{field: row[field] for field in METADATA_FIELDS}
+                    for row in self._read_all() if row['ipfs_hash']]
+
+    def list_unsealed_rows(self):
+        with self.lock:
+            return [{field: row[field] for field in METADATA_FIELDS}
+                    for row in self._read_all() if row['tx_id'] and not row['tx_hash']]
+
+    def transition_status(self, message_ids, from_status, to_status):
+        message_ids = {int(message_id) for message_id in message_ids}
+        with self.lock:
+            rows = self._read_all()
+            changed = [row for row in rows if row['id'] in message_ids and row['status'] == from_status]
+            for row in changed:
+                row['status'] = to_status
+            if changed:
+                self._write_all(rows)
+            return [{field: row[field] for field in METADATA_FIELDS} for row in changed]
+
+    def count_blob_refs(self, blob_ref):
+        with self.lock:
+            return sum(1 for row in self._read_all() if row['blob_ref'] == blob_ref and not row['ipfs_hash'])
+
+    def move_payloads_to_blobs(self, blob_store):
+        with self.lock:
+            rows = self._read_all()
+            moved = 0
+            for row in rows:
+                if row['encrypted_message'] and not row['blob_ref']:
+                    payload = row['encrypted_message'].encode()
+                    row['blob_ref'] = blob_store.put(hashlib.sha256(payload).hexdigest(), payload)
+                    row['encrypted_message'] = ''
+                    moved += 1
+            if moved:
+                self._write_all(rows)
+            return moved
+
+    def next_id(self):
+        return self.ids.allocate()
+
+    def count(self):
+        with self.lock:
+            return len(self._read_all())
+
+
+class SQLiteMessageStore(MessageStore):
+    """Indexed, transactional message store backed by SQLite in WAL mode.
+
+    Each thread gets its own connection; WAL lets readers proceed while a
+    single writer updates rows in place.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL DEFAULT '',
+            receiver_wallet TEXT NOT NULL DEFAULT '',
+            ipfs_hash TEXT NOT NULL DEFAULT '',
+            message_type TEXT NOT NULL DEFAULT 'text',
+            unlock_time TEXT NOT NULL DEFAULT '',
+            created_time TEXT NOT NULL DEFAULT '',
+            status TEXT NOT NULL DEFAULT 'locked',
+            encrypted_message TEXT NOT NULL DEFAULT '',
+            tx_hash TEXT NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    # Columns added after the initial schema, applied with ALTER TABLE
+    ADDED_COLUMNS = {
+        'blob_ref': "TEXT NOT NULL DEFAULT ''",
+        'tx_id': "TEXT NOT NULL DEFAULT ''",
+        'content_size': "TEXT NOT NULL DEFAULT ''",
+        'storage': "TEXT NOT NULL DEFAULT ''",
+    }
+
+    INDEXES = """
+        CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id);
+        CREATE INDEX IF NOT EXISTS idx_messages_receiver_wallet ON messages (receiver_wallet);
+        CREATE INDEX IF NOT EXISTS idx_messages_unlock_time ON messages (unlock_time);
+        CREATE INDEX IF NOT EXISTS idx_messages_blob_ref ON messages (blob_ref);
+        CREATE INDEX IF NOT EXISTS idx_messages_status ON messages (status);
+    """
+
+    def __init__(self, path=MESSAGES_DB):
+        self.path = path
+        self._local = threading.local()
+        # UPDATE ... RETURNING needs SQLite 3.35
+        self._has_returning = sqlite3.sqlite_version_info >= (3, 35, 0)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(self.SCHEMA)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(messages)')}
+            for column, definition in self.ADDED_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE messages ADD COLUMN {column} {definition}')
+            conn.executescript(self.INDEXES)
+        # The sequence lives in the same database file as the rows it numbers
+        self.ids = IdAllocator('messages', self.path)
+        self._seed_ids()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, message_id):
+        row = self._connection().execute(
+            'SELECT * FROM messages WHERE id = ?', (int(message_id),)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def insert(self, message):
+        row = _normalize(message)
+        with self._connection() as conn:
+            conn.execute(
+                f"INSERT INTO messages ({', '.join(MESSAGE_FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(MESSAGE_FIELDS))})",
+                [row[field] for field in MESSAGE_FIELDS]
+            )
+        return row
+
+    def update(self, message_id, **fields):
+        unknown = set(fields) - set(MESSAGE_FIELDS) - {'id'}
+        if unknown:
+            raise ValueError(f"Unknown message fields: {', '.join(sorted(unknown))}")
+        if not fields:
+            return self.get(message_id) is not None
+
+        assignments = ', '.join(f'{field} = ?' for field in fields)
+        with self._connection() as conn:
+            cursor = conn.execute(
+                f'UPDATE messages SET {assignments} WHERE id = ?',
+                [*fields.values(), int(message_id)]
+            )
+        return cursor.rowcount > 0
+
+    def delete(self, message_id):
+        with self._connection() as conn:
+            cursor = conn.execute('DELETE FROM messages WHERE id = ?', (int(message_id),))
+        return cursor.rowcount > 0
+
+    def list_for_user(self, user_id=None, wallet=None):
+        rows = self._connection().execute(
+            f"SELECT {', '.join(METADATA_FIELDS)} FROM messages "
+            f"WHERE user_id = ? OR receiver_wallet = ? ORDER BY id",
+            (str(user_id) if user_id else None, wallet or None)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def list_by_status(self, status):
+        rows = self._connection().execute(
+            'SELECT id, unlock_time FROM messages WHERE status = ?', (status,)
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def list_rows_by_status(self, status):
+        rows = self._connection().execute(
+            f"SELECT {', '.join(METADATA_FIELDS)} FROM messages WHERE status = ? ORDER BY id", (status,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def list_remote_rows(self):
+        rows = self._connection().execute(
+            f"SELECT {', '.join(METADATA_FIELDS)} FROM messages WHERE ipfs_hash != '' ORDER BY id"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def list_unsealed_rows(self):
+        rows = self._connection().execute(
+            f"SELECT {', '.join(METADATA_FIELDS)} FROM messages WHERE tx_id != '' AND tx_hash = '' ORDER BY id"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def transition_status(self, message_ids, from_status, to_status):
+        message_ids = [int(message_id) for message_id in message_ids]
+        changed = []
+        with self._connection() as conn:
+            if not self._has_returning:
+                # Take the write lock before reading so no one changes the rows in between
+                conn.execute('BEGIN IMMEDIATE')
+            # SQLite caps bound parameters per statement, so go in chunks
+            for start in range(0, len(message_ids), 500):
+                chunk = message_ids[start:start + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                if self._has_returning:
+                    rows = conn.execute(
+                        f"UPDATE messages SET status = ? WHERE status = ? AND id IN ({placeholders}) "
+                        f"RETURNING {', '.join(METADATA_FIELDS)}",
+                        [to_status, from_status, *chunk]
+                    ).fetchall()
+                    changed.extend(dict(row) for row in rows)
+                    continue
+                rows = [dict(row) for row in conn.execute(
+                    f"SELECT {', '.join(METADATA_FIELDS)} FROM messages WHERE status = ? AND id IN ({placeholders})",
+                    [from_status, *chunk]
+                )]
+                conn.execute(
+                    f"UPDATE messages SET status = ? WHERE status = ? AND id IN ({placeholders})",
+                    [to_status, from_status, *chunk]
+                )
+                for row in rows:
+                    row['status'] = to_status
+                changed.extend(rows)
+        return changed
+
+    def count_blob_refs(self, blob_ref):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM messages WHERE blob_ref = ? AND ipfs_hash = ''", (blob_ref,)
+        ).fetchone()[0]
+
+    def move_payloads_to_blobs(self, blob_store):
+        conn = self._connection()
+        pending = conn.execute(
+            "SELECT id FROM messages WHERE encrypted_message != '' AND blob_ref = ''"
+        ).fetchall()
+        for (message_id,) in pending:
+            # One row at a time so only a single payload is held in memory
+            payload = conn.execute(
+                'SELECT encrypted_message FROM messages WHERE id = ?', (message_id,)
+            ).fetchone()[0].encode()
+            blob_ref = blob_store.put(hashlib.sha256(payload).hexdigest(), payload)
+            with conn:
+                conn.execute(
+                    "UPDATE messages SET blob_ref = ?, encrypted_message = '' WHERE id = ?",
+                    (blob_ref, message_id)
+                )
+        if pending:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.execute('VACUUM')
+        return len(pending)
+
+    def _seed_ids(self):
+        row = self._connection().execute('SELECT MAX(id) FROM messages').fetchone()
+        self.ids.seed(row[0] or 0)
+
+    def next_id(self):
+        return self.ids.allocate()
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def get_meta(self, key, default=None):
+        row = self._connection().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT INTO meta (key, value) VALUES (?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+                (key, str(value))
+            )
+
+    def migrate_from_csv(self, csv_path=MESSAGES_CSV):
+        """One-shot import of the legacy messages.csv into this store.
+
+        Rows whose id already exists are skipped, and the migration is
+        recorded in the ``meta`` table so later calls are no-ops.
+        """
+        if self.get_meta('csv_migrated'):
+            return 0
+        if not os.path.exists(csv_path):
+            self.set_meta('csv_migrated', '1')
+            return 0
+
+        csv.field_size_limit(sys.maxsize)
+        imported = 0
+        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            with self._connection() as conn:
+                for message in reader:
+                    try:
+                        row = _normalize(message)
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    cursor = conn.execute(
+                        f"INSERT OR IGNORE INTO messages ({', '.join(MESSAGE_FIELDS)}) "
+                        f"VALUES ({', '.join('?' * len(MESSAGE_FIELDS))})",
+                        [row[field] for field in MESSAGE_FIELDS]
+                    )
+                    imported += cursor.rowcount
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('csv_migrated', '1')"
+                )
+        self._seed_ids()
+        print(f"Migrated {imported} messages from {csv_path}")
+        return imported
+
+
+def create_message_store(backend=None, blob_store=None):
+    """Build the message store selected by ``MESSAGE_STORE`` (sqlite or csv).
+
+    When ``blob_store`` is given, any inline ciphertext left over from older
+    versions is moved into it.
+    """
+    backend = (backend or os.getenv('MESSAGE_STORE', 'sqlite')).lower()
+    if backend == 'csv':
+        store = CSVMessageStore()
+    elif backend == 'sqlite':
+        store = SQLiteMessageStore()
+        store.migrate_from_csv()
+    else:
+        raise ValueError(f"Unknown message store backend: {backend}")
+
+    if blob_store is not None:
+        moved = store.move_payloads_to_blobs(blob_store)
+        if moved:
+            print(f"Moved {moved} inline message payloads to the blob store")
+    return store
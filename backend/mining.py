@@ -0,0 +1,132 @@
+import hashlib
+import json
+import multiprocessing
+import os
+
+# How many nonces a worker tries between checks of the stop flag
+CHECK_INTERVAL = 2000
+
+# Block format version. Version 1 hashes the full JSON of the block,
+# transactions included; version 2 hashes a fixed-size header carrying the
+# Merkle root of the transactions, with the nonce appended last.
+BLOCK_VERSION = 2
+
+
+def process_context():
+    """Multiprocessing context for CPU-bound workers; fork where the OS allows it"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+
+
+def block_hash(block_data, nonce):
+    """Hash a version 1 block: the JSON of every field, nonce included"""
+    block_string = json.dumps(dict(block_data, nonce=nonce), sort_keys=True).encode()
+    return hashlib.sha256(block_string).hexdigest()
+
+
+def merkle_root(transactions):
+    """Return the hex Merkle root of a list of JSON-serializable transactions"""
+    level = [hashlib.sha256(json.dumps(tx, sort_keys=True).encode()).digest() for tx in transactions]
+    if not level:
+        return hashlib.sha256(b'').hexdigest()
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
+def header_prefix(index, timestamp, transactions_root, previous_hash, version=BLOCK_VERSION):
+    """Serialize the nonce-independent part of a version 2 block header"""
+    return json.dumps({
+        "index": index,
+        "timestamp": timestamp,
+        "merkle_root": transactions_root,
+        "previous_hash": previous_hash,
+        "version": version
+    }, sort_keys=True).encode() + b':'
+
+
+def prefix_hash(prefix, nonce):
+    """Hash a version 2 block from its header prefix and nonce"""
+    return hashlib.sha256(prefix + str(nonce).encode()).hexdigest()
+
+
+def mine_serial(prefix, difficulty, start_nonce=0, step=1, stop_event=None):
+    """Search nonces from ``start_nonce`` in the current process.
+
+    The header prefix is absorbed into a SHA-256 state once; each attempt
+    only copies that state and feeds in the nonce digits. Returns
+    ``(nonce, hash)``, or None if ``stop_event`` was set first.
+    """
+    target = '0' * difficulty
+    base = hashlib.sha256(prefix)
+    nonce = start_nonce
+    while stop_event is None or not stop_event.is_set():
+        for _ in range(CHECK_INTERVAL):
+            attempt = base.copy()
+            attempt.update(str(nonce).encode())
+            digest = attempt.hexdigest()
+            if digest.startswith(target):
+                return nonce, digest
+            nonce += step
+    return None
+
+
+def _search_worker(prefix, difficulty, start_nonce, step, stop_event, found):
+    """Try ``start_nonce``, ``start_nonce + step``, ... until a hit or a stop"""
+    result = mine_serial(prefix, difficulty, start_nonce, step, stop_event)
+    if result is not None:
+        with found.get_lock():
+            if found.value < 0:
+                found.value = result[0]
+        stop_event.set()
+
+
+class ParallelMiner:
+    """Proof-of-work search split across a pool of worker processes.
+
+    Worker ``i`` of ``n`` tries nonces ``start + i``, ``start + i + n``, ...;
+    the first worker to find a hash with the required number of leading
+    zeros publishes it and signals the others to stop.
+    """
+
+    def __init__(self, workers=None, min_parallel_difficulty=4):
+        if workers is None:
+            workers = int(os.getenv('MINING_WORKERS', os.cpu_count() or 1))
+        self.workers = max(1, workers)
+        # Starting the pool costs ~10ms per block; a serial search averages
+        # ~90ms at difficulty 4 (the default) but ~6ms at 3, so below 4 it stays serial
+        self.min_parallel_difficulty = min_parallel_difficulty
+        self._context = process_context()
+
+    def mine(self, prefix, difficulty, start_nonce=0):
+        """Return ``(nonce, hash)`` for the first nonce found meeting ``difficulty``"""
+        if self.workers == 1 or difficulty < self.min_parallel_difficulty:
+            return mine_serial(prefix, difficulty, start_nonce)
+
+        stop_event = self._context.Event()
+        found = self._context.Value('q', -1)
+        processes = [
+            self._context.Process(
+                target=_search_worker,
+                args=(prefix, difficulty, start_nonce + i, self.workers, stop_event, found),
+                daemon=True
+            )
+            for i in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            while not stop_event.wait(0.1):
+                if not any(process.is_alive() for process in processes):
+                    raise RuntimeError("All mining workers exited without a result")
+        finally:
+            stop_event.set()
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+        nonce = found.value
+        return nonce, prefix_hash(prefix, nonce)
@@ -0,0 +1,116 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PeerSync:
+    """Longest-chain sync against the blockchain's peer nodes.
+
+    All peers are asked for their ``/chain/tip`` concurrently over one pooled
+    session. Starting with the highest peer, only the blocks past the local
+    tip are downloaded from ``/chain/blocks?from=<height>`` (NDJSON, paged);
+    if they extend the local chain they are validated and appended. A suffix
+    that does not link up means the peer is on a fork, in which case its
+    whole chain is downloaded and validated before it replaces ours.
+
+    Nodes are ``host:port`` strings or full base URLs, so local stand-in
+    servers can be used as peers.
+    """
+
+    def __init__(self, blockchain, timeout=None, max_workers=None, page_size=None, session=None):
+        self.blockchain = blockchain
+        self.timeout = float(timeout or os.getenv('PEER_TIMEOUT', 5))
+        self.max_workers = int(max_workers or os.getenv('PEER_SYNC_WORKERS', 8))
+        self.page_size = int(page_size or os.getenv('PEER_SYNC_PAGE_SIZE', 500))
+        self.session = session or self._create_session()
+
+    def _create_session(self):
+        session = requests.Session()
+        retries = Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                        allowed_methods=frozenset(['GET']))
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers,
+                              max_retries=retries)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @staticmethod
+    def base_url(node):
+        node = node.rstrip('/')
+        return node if node.startswith(('http://', 'https://')) else f'http://{node}'
+
+    def fetch_tip(self, node):
+        """Return ``{'height': ..., 'hash': ...}`` for a peer, or None if unreachable"""
+        try:
+            response = self.session.get(f'{self.base_url(node)}/chain/tip', timeout=self.timeout)
+            response.raise_for_status()
+            tip = response.json()
+            return {'height': int(tip['height']), 'hash': tip['hash']}
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            print(f"Peer {node} tip request failed: {e}")
+            return None
+
+    def poll_tips(self, nodes=None):
+        """Ask every peer for its tip concurrently; return ``[(node, tip), ...]``"""
+        nodes = list(self.blockchain.nodes if nodes is None else nodes)
+        if not nodes:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(nodes))) as pool:
+            tips = list(pool.map(self.fetch_tip, nodes))
+        return [(node, tip) for node, tip in zip(nodes, tips) if tip is not None]
+
+    def fetch_blocks(self, node, start, stop):
+        """Download block records ``start`` to ``stop - 1`` from a peer, page by page"""
+        blocks = []
+        while start + len(blocks) < stop:
+            offset = start + len(blocks)
+            response = self.session.get(
+                f'{self.base_url(node)}/chain/blocks',
+                params={'from': offset, 'limit': min(self.page_size, stop - offset)},
+                timeout=self.timeout,
+                stream=True
+            )
+            with response:
+                response.raise_for_status()
+                page = [json.loads(line) for line in response.iter_lines() if line]
+            if not page:
+                break
+            blocks.extend(page)
+        return blocks
+
+    def sync_from(self, node, tip):
+        """Catch up with one peer; return True if the local chain changed"""
+        height = len(self.blockchain.chain)
+        if tip['height'] <= height:
+            return False
+
+        suffix = self.fetch_blocks(node, height, tip['height'])
+        if suffix and self.blockchain.extend_chain(suffix):
+            return True
+
+        # The peer's blocks don't continue our tip: it forked off earlier
+        candidate = self.fetch_blocks(node, 0, tip['height'])
+        if len(candidate) <= len(self.blockchain.chain) or not self.blockchain.is_valid_chain(candidate):
+            return False
+        self.blockchain.replace_chain(candidate)
+        return True
+
+    def sync(self, nodes=None):
+        """Adopt the longest valid chain among the peers; return True if it changed"""
+        height = len(self.blockchain.chain)
+        candidates = sorted((item for item in self.poll_tips(nodes) if item[1]['height'] > height),
+                            key=lambda item: item[1]['height'], reverse=True)
+        for node, tip in candidates:
+            try:
+                if self.sync_from(node, tip):
+                    return True
+            except (requests.RequestException, ValueError) as e:
+                print(f"Sync from peer {node} failed: {e}")
+        return False
+
+    def close(self):
+        self.session.close()
@@ -2,106 +2,144 @@
 class DashboardApp {
     constructor() {
         this.apiBase = '/api';
-        this.countdownIntervals = {};
+        this.countdowns = {};
+        this.ticker = null;
+        this.events = null;
+        this.statusCheck = null;
         this.init();
     }
 
     init() {
         this.startCountdowns();
+        this.subscribeToUnlocks();
         this.updateStats();
     }
 
-    // Start countdown timers for all messages
+    // Track countdowns for all locked messages; one shared timer redraws them
     startCountdowns() {
         const messageCards = document.querySelectorAll('.message-card');
-        
-        messageCards.forEach(card => {
-            const messageId = card.dataset.messageId;
-            const unlockTime = card.dataset.unlockTime;
-            const status = card.dataset.status;
 
-            if (status !== 'revealed') {
-                this.startCountdown(messageId, unlockTime);
+        messageCards.forEach(card => {
+            if (card.dataset.status === 'locked') {
+                this.countdowns[card.dataset.messageId] = new Date(card.dataset.unlockTime).getTime();
             }
         });
+
+        this.tick();
+        if (Object.keys(this.countdowns).length > 0) {
+            this.ticker = setInterval(() => this.tick(), 1000);
+        }
     }
 
-    // Start individual countdown
-    startCountdown(messageId, unlockTime) {
-        const updateCountdown = () => {
-            const now = new Date().getTime();
-            const unlockDate = new Date(unlockTime).getTime();
-            const remaining = unlockDate - now;
+    // Redraw every running countdown. Reaching zero only changes the label;
+    // the server announces the actual unlock over the event stream, with a
+    // status re-read as fallback
+    tick() {
+        const now = new Date().getTime();
 
+        Object.entries(this.countdowns).forEach(([messageId, unlockDate]) => {
             const timeElement = document.getElementById(`time-${messageId}`);
-            const countdownElement = document.getElementById(`countdown-${messageId}`);
-            const revealBtn = document.getElementById(`reveal-btn-${messageId}`);
+            if (!timeElement) {
+                delete this.countdowns[messageId];
+                return;
+            }
 
+            const remaining = unlockDate - now;
             if (remaining <= 0) {
-                // Time is up - unlock the message
-                timeElement.textContent = 'UNLOCKED';
-                countdownElement.classList.add('unlocked');
-                countdownElement.querySelector('i').className = 'fas fa-unlock';
-                countdownElement.querySelector('.label').textContent = 'Ready to reveal!';
-                
-                // Enable reveal button
-                revealBtn.disabled = false;
-                revealBtn.innerHTML = '<i class="fas fa-eye"></i> Reveal Message';
-                
-                // Update card styling
-                const card = document.querySelector(`[data-message-id="${messageId}"]`);
-                if (card) {
-                    card.classList.add('unlocked');
-                    card.dataset.status = 'unlocked';
-                }
+                timeElement.textContent = 'Unlocking...';
+                this.scheduleStatusCheck();
+                return;
+            }
 
-                // Auto-reveal if needed
-                this.autoRevealMessage(messageId);
+            // Calculate time components
+            const days = Math.floor(remaining / (1000 * 60 * 60 * 24));
+            const hours = Math.floor((remaining % (1000 * 60 * 60 * 24)) / (1000 * 60 * 60));
+            const minutes = Math.floor((remaining % (1000 * 60 * 60)) / (1000 * 60));
+            const seconds = Math.floor((remaining % (1000 * 60)) / 1000);
 
-                // Clear interval
-                if (this.countdownIntervals[messageId]) {
-                    clearInterval(this.countdownIntervals[messageId]);
-                    delete this.countdownIntervals[messageId];
-                }
+            // Update display
+            timeElement.textContent = `${days}d ${hours}h ${minutes}m ${seconds}s`;
+        });
+    }
 
-                // Update status on server
-                this.updateMessageStatus(messageId, 'unlocked');
-            } else {
-                // Calculate time components
-                const days = Math.floor(remaining / (1000 * 60 * 60 * 24));
-                const hours = Math.floor((remaining % (1000 * 60 * 60 * 24)) / (1000 * 60 * 60));
-                const minutes = Math.floor((remaining % (1000 * 60 * 60)) / (1000 * 60));
-                const seconds = Math.floor((remaining % (1000 * 60)) / 1000);
-
-                // Update display
-                timeElement.textContent = `${days}d ${hours}h ${minutes}m ${seconds}s`;
-            }
-        };
+    // Listen for unlock notifications pushed by the server
+    subscribeToUnlocks() {
+        if (!window.EventSource || Object.keys(this.countdowns).length === 0) {
+            return;
+        }
 
-        // Update immediately and then every second
-        updateCountdown();
-        this.countdownIntervals[messageId] = setInterval(updateCountdown, 1000);
+        this.events = new EventSource(`${this.apiBase}/events`);
+
+        // Messages that unlocked before the stream opened
+        this.events.addEventListener('snapshot', event => {
+            JSON.parse(event.data).unlocked.forEach(messageId => this.markUnlocked(String(messageId)));
+        });
+
+        this.events.addEventListener('unlocked', event => {
+            this.markUnlocked(String(JSON.parse(event.data).id));
+        });
     }
 
-    // Update message status on server
-    async updateMessageStatus(messageId, status) {
-        try {
-            const response = await fetch(`${this.apiBase}/messages/${messageId}/status`, {
-                method: 'PUT',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ status })
-            });
+    // The unlock event can be missed, e.g. when another server process ran the
+    // unlock, so overdue countdowns re-read the status every few seconds
+    scheduleStatusCheck() {
+        if (this.statusCheck) {
+            return;
+        }
+        this.statusCheck = setTimeout(() => this.checkStatus(), 5000);
+    }
 
-            if (!response.ok) {
-                console.error('Failed to update message status');
+    async checkStatus() {
+        try {
+            const response = await fetch(`${this.apiBase}/messages`);
+            if (response.ok) {
+                const data = await response.json();
+                data.messages
+                    .filter(message => message.can_reveal || message.is_revealed)
+                    .forEach(message => this.markUnlocked(String(message.id)));
             }
         } catch (error) {
-            console.error('Error updating message status:', error);
+            console.error('Status check error:', error);
         }
+        this.statusCheck = null;
     }
 
+    // Show a message as unlocked once the server has unlocked it
+    markUnlocked(messageId) {
+        if (!(messageId in this.countdowns)) {
+            return;
+        }
+        delete this.countdowns[messageId];
+
+        const timeElement = document.getElementById(`time-${messageId}`);
+        const countdownElement = document.getElementById(`countdown-${messageId}`);
+        const revealBtn = document.getElementById(`reveal-btn-${messageId}`);
+
+        timeElement.textContent = 'UNLOCKED';
+        countdownElement.classList.add('unlocked');
+        countdownElement.querySelector('i').className = 'fas fa-unlock';
+        countdownElement.querySelector('.label').textContent = 'Ready to reveal!';
+
+        // Enable reveal button
+        revealBtn.disabled = false;
+        revealBtn.innerHTML = '<i class="fas fa-eye"></i> Reveal Message';
+
+        // Update card styling
+        const card = document.querySelector(`[data-message-id="${messageId}"]`);
+        if (card) {
+            card.classList.add('unlocked');
+            card.dataset.status = 'unlocked';
+        }
+
+        // Auto-reveal if needed
+        this.autoRevealMessage(messageId);
+        this.updateStats();
+
+        // Nothing left to wait for
+        if (Object.keys(this.countdowns).length === 0) {
+            this.cleanup();
+        }
+    }
 
     // Auto-reveal message when unlocked
     async autoRevealMessage(messageId) {
@@ -111,7 +149,8 @@ class DashboardApp {
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({})
+                // Files are loaded from content_url rather than inlined as base64
+                body: JSON.stringify({ include_content: false })
             });
 
 
@@ -121,7 +160,7 @@ class DashboardApp {
                 
                 // Update UI to show revealed content - FIX: use correct ID
                 const contentElement = document.getElementById(`revealed-content-${messageId}`);
-                if (contentElement && data.content) {
+                if (contentElement && (data.content || data.content_url)) {
                     // Show the container
                     contentElement.style.display = 'block';
                     
@@ -130,14 +169,14 @@ class DashboardApp {
                         // Text message - display as formatted text
                         contentElement.innerHTML = `<h4><i class="fas fa-envelope-open"></i> Your Message:</h4><div class="revealed-text">${this.escapeHtml(data.content)}</div>`;
                     } else if (data.message_type === 'image') {
-                        // Image - display as base64 image
-                        contentElement.innerHTML = `<h4><i class="fas fa-image"></i> Your Image:</h4><img src="data:image/png;base64,${data.content}" alt="Revealed Image" class="revealed-image">`;
+                        // Image - streamed from the download endpoint
+                        contentElement.innerHTML = `<h4><i class="fas fa-image"></i> Your Image:</h4><img src="${data.content_url}" alt="Revealed Image" class="revealed-image">`;
                     } else if (data.message_type === 'document') {
                         contentElement.innerHTML = `<h4><i class="fas fa-file-alt"></i> Your Document:</h4><div class="revealed-text">Your document is ready. Download started automatically.</div>`;
                         this.triggerDownload(messageId);
                     } else {
-                        // Default - just display content
-                        contentElement.innerHTML = `<h4><i class="fas fa-file-alt"></i> Content:</h4><div class="revealed-text">${this.escapeHtml(data.content)}</div>`;
+                        // Other files - link to the download endpoint
+                        contentElement.innerHTML = `<h4><i class="fas fa-file-alt"></i> Your File:</h4><div class="revealed-text"><a href="/api/download/${messageId}">Download file</a></div>`;
                     }
                     contentElement.classList.add('revealed');
                 }
@@ -165,7 +204,8 @@ class DashboardApp {
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({})
+                // Files are loaded from content_url rather than inlined as base64
+                body: JSON.stringify({ include_content: false })
             });
 
 
@@ -176,7 +216,7 @@ class DashboardApp {
                 const contentElement = document.getElementById(`revealed-content-${messageId}`);
                 const card = document.querySelector(`[data-message-id="${messageId}"]`);
                 
-                if (contentElement && data.content) {
+                if (contentElement && (data.content || data.content_url)) {
                     // Show the container
                     contentElement.style.display = 'block';
                     
@@ -185,14 +225,14 @@ class DashboardApp {
                         // Text message - display as formatted text
                         contentElement.innerHTML = `<h4><i class="fas fa-envelope-open"></i> Your Message:</h4><div class="revealed-text">${this.escapeHtml(data.content)}</div>`;
                     } else if (data.message_type === 'image') {
-                        // Image - display as base64 image
-                        contentElement.innerHTML = `<h4><i class="fas fa-image"></i> Your Image:</h4><img src="data:image/png;base64,${data.content}" alt="Revealed Image" class="revealed-image">`;
+                        // Image - streamed from the download endpoint
+                        contentElement.innerHTML = `<h4><i class="fas fa-image"></i> Your Image:</h4><img src="${data.content_url}" alt="Revealed Image" class="revealed-image">`;
                     } else if (data.message_type === 'document') {
                         contentElement.innerHTML = `<h4><i class="fas fa-file-alt"></i> Your Document:</h4><div class="revealed-text">Your document is ready. Download started automatically.</div>`;
                         this.triggerDownload(messageId);
                     } else {
-                        // Default - just display content
-                        contentElement.innerHTML = `<h4><i class="fas fa-file-alt"></i> Content:</h4><div class="revealed-text">${this.escapeHtml(data.content)}</div>`;
+                        // Other files - link to the download endpoint
+                        contentElement.innerHTML = `<h4><i class="fas fa-file-alt"></i> Your File:</h4><div class="revealed-text"><a href="/api/download/${messageId}">Download file</a></div>`;
                     }
                     contentElement.classList.add('revealed');
                 }
@@ -344,10 +384,18 @@ class DashboardApp {
 
     // Cleanup on page unload
     cleanup() {
-        Object.values(this.countdownIntervals).forEach(interval => {
-            clearInterval(interval);
-        });
-        this.countdownIntervals = {};
+        if (this.ticker) {
+            clearInterval(this.ticker);
+            this.ticker = null;
+        }
+        if (this.events) {
+            this.events.close();
+            this.events = null;
+        }
+        if (this.statusCheck) {
+            clearTimeout(this.statusCheck);
+            this.statusCheck = null;
+        }
     }
 }
 
@@ -0,0 +1,259 @@
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from unlock_scheduler import unlock_timestamp
+from utils import KEY_RING, decrypt_stream, encrypt_stream, is_primary_payload, iter_chunks
+
+
+class StorageBackend:
+    """Where encrypted message payloads are kept.
+
+    ``put`` stores a payload read from a binary file object and returns the
+    reference to record on the message; ``open`` returns a binary file
+    object for that reference.
+    """
+
+    name = None
+    remote = False
+
+    def put(self, source, name):
+        raise NotImplementedError
+
+    def open(self, ref, content_hash=None):
+        raise NotImplementedError
+
+    def delete(self, ref):
+        raise NotImplementedError
+
+    def prefetch(self, ref, content_hash=None):
+        """Bring a payload close ahead of a read; a no-op for local storage"""
+
+
+class LocalBackend(StorageBackend):
+    """Payloads in the local content-addressed BlobStore, referenced by content hash"""
+
+    name = 'local'
+
+    def __init__(self, blob_store):
+        self.blob_store = blob_store
+
+    def put(self, source, name):
+        return self.blob_store.put_stream(iter_chunks(source), lambda: name)
+
+    def open(self, ref, content_hash=None):
+        return self.blob_store.open(ref)
+
+    def delete(self, ref):
+        return self.blob_store.delete(ref)
+
+    def delete_unreferenced(self, ref, count_refs):
+        return self.blob_store.delete_unreferenced(ref, count_refs)
+
+
+class RemoteBackend(StorageBackend):
+    """Base for remote stores; reads go through an optional local BlobCache"""
+
+    remote = True
+
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def fetch(self, ref, destination):
+        """Download a payload into a writable binary file object"""
+        raise NotImplementedError
+
+    def open(self, ref, content_hash=None):
+        if self.cache is not None:
+            return self.cache.open(ref, lambda destination: self.fetch(ref, destination), content_hash)
+        destination = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        try:
+            self.fetch(ref, destination)
+        except BaseException:
+            destination.close()
+            raise
+        destination.seek(0)
+        return destination
+
+    def prefetch(self, ref, content_hash=None):
+        if self.cache is not None:
+            self.open(ref, content_hash).close()
+
+
+class DriveBackend(RemoteBackend):
+    """Payloads in Google Drive, referenced by file id"""
+
+    name = 'drive'
+
+    def __init__(self, google_drive, cache=None):
+        super().__init__(cache)
+        self.google_drive = google_drive
+
+    def put(self, source, name):
+        return self.google_drive.upload_file(source, name)['file_id']
+
+    def fetch(self, ref, destination):
+        self.google_drive.download_file(ref, destination)
+
+    def delete(self, ref):
+        return self.google_drive.delete_file(ref)
+
+
+class IPFSBackend(RemoteBackend):
+    """Payloads pinned on an IPFS node, referenced by CID"""
+
+    name = 'ipfs'
+
+    def __init__(self, ipfs_client, cache=None):
+        super().__init__(cache)
+        self.ipfs_client = ipfs_client
+
+    def put(self, source, name):
+        return self.ipfs_client.add(source, name)
+
+    def fetch(self, ref, destination):
+        self.ipfs_client.cat(ref, destination)
+
+    def delete(self, ref):
+        self.ipfs_client.unpin(ref)
+        return True
+
+
+class TieringPolicy:
+    """Decides which payloads stay on local storage.
+
+    Payloads up to ``max_local_size`` bytes that unlock within
+    ``hot_window`` seconds stay local; larger or later ones are offloaded.
+    Offloaded payloads unlocking within the window are prefetched into the
+    local cache, so reveals read them from disk.
+    """
+
+    def __init__(self, max_local_size=None, hot_window=None):
+        self.max_local_size = int(max_local_size or os.getenv('TIER_LOCAL_MAX_BYTES', 1024 * 1024))
+        self.hot_window = float(hot_window or os.getenv('TIER_HOT_WINDOW', 24 * 3600))
+
+    def is_hot(self, unlock_time, now=None):
+        now = time.time() if now is None else now
+        return unlock_timestamp(unlock_time) - now <= self.hot_window
+
+    def should_offload(self, size, unlock_time, now=None):
+        return size > self.max_local_size or not self.is_hot(unlock_time, now)
+
+
+class TieredStorage:
+    """Routes message payloads to their backend and moves them between tiers.
+
+    A message's backend is its ``storage`` column; rows from before that
+    column are in Drive if they have a remote id (``ipfs_hash``) and local
+    otherwise. New payloads are written locally. With an ``offload``
+    backend, a background pass every ``interval`` seconds uploads locked
+    payloads the policy marks cold, points their rows at the remote copy
+    and removes the local blob once no local message uses it. The same
+    pass prefetches remote payloads whose unlock time is near.
+
+    ``content_hash_for(row)`` gives the plaintext hash remote reads are
+    verified against; by default the row's ``blob_ref``. Payloads still on
+    an older key of ``key_ring`` are re-encrypted onto the primary key on
+    their way out, so offloading never moves a payload beyond what a key
+    rotation pass has already covered.
+    """
+
+    def __init__(self, backends, message_store, offload=None, policy=None, interval=None, content_hash_for=None,
+                 key_ring=None):
+        self.backends = {backend.name: backend for backend in backends}
+        self.local = self.backends['local']
+        self.message_store = message_store
+        self.offload_backend = self.backends[offload] if offload else None
+        self.policy = policy or TieringPolicy()
+        self.interval = float(interval or os.getenv('TIER_INTERVAL', 300))
+        self.content_hash_for = content_hash_for or (lambda row: row.get('blob_ref') or None)
+        self.key_ring = key_ring or KEY_RING
+        self.offloaded = 0
+        self.prefetched = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def storage_of(row):
+        return row.get('storage') or ('drive' if row.get('ipfs_hash') else 'local')
+
+    def backend_for(self, row):
+        return self.backends[self.storage_of(row)]
+
+    def ref_for(self, row):
+        return row['blob_ref'] if self.storage_of(row) == 'local' else row['ipfs_hash']
+
+    def open(self, row):
+        """Open a message's encrypted payload as a binary file object"""
+        return self.backend_for(row).open(self.ref_for(row), self.content_hash_for(row))
+
+    def offload(self, blob_ref, rows):
+        """Upload one local blob and move every row in ``rows`` that uses it to the remote tier"""
+        with self.local.open(blob_ref) as source:
+            if is_primary_payload(source, self.key_ring):
+                source.seek(0)
+                ref = self.offload_backend.put(source, blob_ref)
+            else:
+                source.seek(0)
+                with tempfile.TemporaryFile() as rotated:
+                    for frame in encrypt_stream(decrypt_stream(source, self.key_ring), self.key_ring):
+                        rotated.write(frame)
+                    rotated.seek(0)
+                    ref = self.offload_backend.put(rotated, blob_ref)
+        for row in rows:
+            self.message_store.update(row['id'], ipfs_hash=ref, storage=self.offload_backend.name)
+        # Kept while a message still reads it locally or one with the same content is being stored
+        self.local.delete_unreferenced(blob_ref, self.message_store.count_blob_refs)
+        self.offloaded += 1
+        return ref
+
+    def run_once(self, now=None):
+        """Run one offload and prefetch pass over locked messages"""
+        now = time.time() if now is None else now
+        cold = defaultdict(list)
+        for row in self.message_store.list_rows_by_status('locked'):
+            try:
+                hot = self.policy.is_hot(row['unlock_time'], now)
+            except (AttributeError, ValueError):
+                continue
+            backend = self.backend_for(row)
+            if backend.remote:
+                if hot:
+                    try:
+                        backend.prefetch(self.ref_for(row), self.content_hash_for(row))
+                        self.prefetched += 1
+                    except Exception as e:
+                        print(f"Prefetch of message {row['id']} failed: {e}")
+            elif (self.offload_backend is not None and row['blob_ref'] and row['content_size']
+                    and self.policy.should_offload(int(row['content_size']), row['unlock_time'], now)):
+                # Only blobs keyed by their plaintext hash (content_size set) are moved,
+                # so the remote copy can be verified against blob_ref when read back
+                cold[row['blob_ref']].append(row)
+
+        for blob_ref, rows in cold.items():
+            try:
+                self.offload(blob_ref, rows)
+            except Exception as e:
+                print(f"Offload of blob {blob_ref} failed: {e}")
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='storage-tiering', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Storage tiering pass failed: {e}")
+            self._stop_event.wait(self.interval)
@@ -0,0 +1,40 @@
+from collections import defaultdict
+
+
+class TransactionIndex:
+    """In-memory lookup tables over mined transactions.
+
+    Every entry points at a ``(block index, position)`` pair inside the
+    chain. Blocks are indexed in order and ``height`` records how many have
+    been covered, so the index can be caught up incrementally as blocks are
+    appended.
+    """
+
+    def __init__(self):
+        self.by_message_id = {}
+        self.by_tx_id = {}
+        self.by_user = defaultdict(list)
+        self.by_wallet = defaultdict(list)
+        self.height = 0
+
+    def clear(self):
+        self.__init__()
+
+    def add_block(self, block):
+        if block.index != self.height:
+            raise ValueError(f"Expected block {self.height}, got {block.index}")
+
+        for position, transaction in enumerate(block.transactions):
+            location = (block.index, position)
+            if transaction.get('id') is not None:
+                # Keep the earliest occurrence, like a front-to-back scan would
+                self.by_message_id.setdefault(transaction['id'], location)
+            if transaction.get('tx_id'):
+                self.by_tx_id[transaction['tx_id']] = location
+            if transaction.get('user_id') is not None:
+                self.by_user[transaction['user_id']].append(location)
+
+            wallets = {transaction.get('wallet_address'), transaction.get('receiver_wallet')}
+            for wallet in wallets - {None, ''}:
+                self.by_wallet[wallet].append(location)
+        self.height += 1
@@ -0,0 +1,111 @@
+import heapq
+import threading
+import time
+from datetime import datetime
+
+
+def unlock_timestamp(unlock_time):
+    """Parse a stored ISO unlock time into a POSIX timestamp.
+
+    Naive values are local time, as written by the create form; API clients
+    may send UTC with a trailing ``Z``.
+    """
+    return datetime.fromisoformat(unlock_time.replace('Z', '+00:00')).timestamp()
+
+
+class UnlockScheduler:
+    """Moves locked messages to ``revealed`` as their unlock time passes.
+
+    Pending unlocks sit in a min-heap of ``(timestamp, message_id)``. A
+    worker thread sleeps until the earliest one is due, pops everything due
+    by then and applies the status change to the whole batch in one store
+    call. On start the heap is rebuilt from the locked messages in the
+    store, so unlocks missed while the server was down are applied at once.
+    """
+
+    def __init__(self, message_store, from_status='locked', to_status='revealed', on_unlocked=None):
+        self.message_store = message_store
+        self.from_status = from_status
+        self.to_status = to_status
+        # Called as on_unlocked(rows) with the metadata rows of each applied batch
+        self.on_unlocked = on_unlocked
+        self._heap = []
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._heap = []
+        for message_id, unlock_time in self.message_store.list_by_status(self.from_status):
+            self.schedule(message_id, unlock_time)
+        self._thread = threading.Thread(target=self._run, name='unlock-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def schedule(self, message_id, unlock_time):
+        """Queue a message to unlock at ``unlock_time`` (ISO string or timestamp)"""
+        try:
+            due = unlock_time if isinstance(unlock_time, (int, float)) else unlock_timestamp(unlock_time)
+        except (AttributeError, ValueError) as e:
+            print(f"Cannot schedule unlock of message {message_id}: {e}")
+            return
+        with self._condition:
+            heapq.heappush(self._heap, (due, int(message_id)))
+            if self._heap[0][1] == int(message_id):
+                # New earliest deadline; wake the worker to shorten its sleep
+                self._condition.notify_all()
+
+    def pending(self):
+        with self._condition:
+            return len(self._heap)
+
+    def run_due(self, now=None):
+        """Apply every unlock due by ``now``; return the rows that changed"""
+        now = time.time() if now is None else now
+        with self._condition:
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[1])
+        if not due:
+            return []
+
+        try:
+            changed = self.message_store.transition_status(due, self.from_status, self.to_status)
+        except Exception:
+            # Put the batch back so the next wake-up retries it
+            with self._condition:
+                for message_id in due:
+                    heapq.heappush(self._heap, (now, message_id))
+            raise
+
+        if changed and self.on_unlocked:
+            try:
+                self.on_unlocked(changed)
+            except Exception as e:
+                print(f"Unlock callback failed: {e}")
+        return changed
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and (not self._heap or self._heap[0][0] > time.time()):
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._condition.wait(timeout)
+                if not self._running:
+                    return
+            try:
+                self.run_due()
+            except Exception as e:
+                print(f"Unlock scheduler failed to apply a batch: {e}")
+                time.sleep(1)
@@ -0,0 +1,108 @@
+import csv
+import os
+import threading
+
+from werkzeug.security import check_password_hash
+
+from id_allocator import IdAllocator
+
+USERS_CSV = os.path.join(os.path.dirname(__file__), '..', 'storage', 'users.csv')
+USER_FIELDS = ['id', 'name', 'email', 'password_hash', 'wallet_address']
+
+
+class UserDirectory:
+    """Registered users held in memory, keyed by email.
+
+    users.csv is read once at startup and afterwards treated as an append
+    log: registrations are appended to it, and before every lookup only the
+    bytes appended since the last read are parsed, so rows written by other
+    processes are picked up without rescanning the file. Ids come from a
+    persisted sequence seeded with the highest id on file.
+    """
+
+    def __init__(self, path=USERS_CSV):
+        self.path = path
+        self.lock = threading.Lock()
+        self._by_email = {}
+        self._fields = USER_FIELDS
+        self._offset = 0
+        self._next_id = 1
+        self.ids = IdAllocator('users', os.path.join(os.path.dirname(self.path), 'sequences.db'))
+        with self.lock:
+            if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, 'w', newline='', encoding='utf-8') as f:
+                    csv.writer(f).writerow(USER_FIELDS)
+            self._read_new_rows()
+
+    def _read_new_rows(self):
+        """Parse complete rows appended to the file since the last call"""
+        size = os.path.getsize(self.path)
+        if size <= self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        # Leave a row that is still being written for the next call
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return
+
+        lines = data[:end].decode('utf-8').splitlines(keepends=True)
+        if self._offset == 0 and lines:
+            first = next(csv.reader(lines[:1]), [])
+            # Older files may lack a header when the first user registered on an empty store
+            if first and first[0] == 'id':
+                self._fields = first
+                lines = lines[1:]
+        for values in csv.reader(lines):
+            if values:
+                self._add_row(dict(zip(self._fields, values)))
+        self._offset += end
+
+    def _add_row(self, row):
+        email = row.get('email', '').strip()
+        # Keep the first registration of an email, as a front-to-back scan would
+        self._by_email.setdefault(email, row)
+        try:
+            self._next_id = max(self._next_id, int(row['id']) + 1)
+        except (KeyError, ValueError):
+            pass
+
+    def get_by_email(self, email):
+        with self.lock:
+            self._read_new_rows()
+            row = self._by_email.get(email.strip())
+            return dict(row) if row else None
+
+    def authenticate(self, email, password):
+        """Return the user row if ``password`` matches, else None"""
+        row = self.get_by_email(email)
+        if row and row.get('password_hash') and check_password_hash(row['password_hash'], password):
+            return row
+        return None
+
+    def add(self, name, email, password_hash, wallet_address=''):
+        """Append a new user and return its row, or None if the email is taken"""
+        email = email.strip()
+        with self.lock:
+            self._read_new_rows()
+            if email in self._by_email:
+                return None
+            self.ids.seed(self._next_id - 1)
+            user_id = self.ids.allocate()
+            with open(self.path, 'a', newline='', encoding='utf-8') as f:
+                csv.DictWriter(f, fieldnames=self._fields, extrasaction='ignore').writerow({
+                    'id': user_id,
+                    'name': name,
+                    'email': email,
+                    'password_hash': password_hash,
+                    'wallet_address': wallet_address
+                })
+            self._read_new_rows()
+            return dict(self._by_email[email])
+
+    def count(self):
+        with self.lock:
+            self._read_new_rows()
+            return len(self._by_email)
@@ -1,6 +1,15 @@
+import base64
+import collections
+import json
 import os
-import tempfile
-from cryptography.fernet import Fernet
+import struct
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import Fernet, InvalidToken
+
+from key_ring import KeyRing, key_ring_for, parse_keys
 
 # CSV file paths
 USERS_CSV = os.path.join(os.path.dirname(__file__), '..', 'storage', 'users.csv')
@@ -41,8 +50,15 @@ def load_or_generate_encryption_key():
     
     return new_key
 
-# Global encryption key for consistency - load from file or generate once
-ENCRYPTION_KEY = load_or_generate_encryption_key()
+def load_key_ring():
+    """Build the key ring from ENCRYPTION_KEYS (newest first), else the single stored key"""
+    keys = parse_keys(os.getenv('ENCRYPTION_KEYS'))
+    return KeyRing(keys or [load_or_generate_encryption_key()])
+
+
+# Global key ring for consistency - load from env/file or generate once
+KEY_RING = load_key_ring()
+ENCRYPTION_KEY = KEY_RING.primary_key
 
 
 def allowed_file(filename):
@@ -59,70 +75,423 @@ def get_file_type(filename):
     else:
         return 'file'
 
+def _cipher(encryption_key=None):
+    """Return a cached cipher: the global key ring, a given ring, or one for a single key"""
+    if encryption_key is None:
+        return KEY_RING
+    if isinstance(encryption_key, KeyRing):
+        return encryption_key
+    return key_ring_for(encryption_key.decode() if isinstance(encryption_key, bytes) else encryption_key)
+
 def encrypt_data(data, encryption_key=None):
     """Encrypt data using Fernet"""
-    if encryption_key is None:
-        encryption_key = ENCRYPTION_KEY
-    cipher = Fernet(encryption_key.encode() if isinstance(encryption_key, str) else encryption_key)
-    return cipher.encrypt(data)
+    return _cipher(encryption_key).encrypt(data)
 
 def decrypt_data(encrypted_data, encryption_key=None):
     """Decrypt data using Fernet"""
-    if encryption_key is None:
-        encryption_key = ENCRYPTION_KEY
-    cipher = Fernet(encryption_key.encode() if isinstance(encryption_key, str) else encryption_key)
-    return cipher.decrypt(encrypted_data)
+    return _cipher(encryption_key).decrypt(encrypted_data)
 
-def upload_to_ipfs(data, filename, ipfs_client=None):
-    """Upload data to IPFS"""
-    try:
-        if not ipfs_client:
-            # Import here to avoid circular imports
+# Chunked stream format: a header of magic, version and plaintext chunk
+# size, then one frame per chunk of [4-byte length][raw Fernet token]. Each
+# token's plaintext is [1-byte flags][8-byte chunk index][data]; the index
+# stops frames being reordered and the final flag stops truncation.
+STREAM_MAGIC = b'FMSC'
+STREAM_VERSION = 1
+STREAM_CHUNK_SIZE = 64 * 1024
+_STREAM_HEADER = struct.Struct('>4sBI')
+_FRAME_LENGTH = struct.Struct('>I')
+_CHUNK_PREFIX = struct.Struct('>BQ')
+_FINAL_FLAG = 1
+
+
+class FileTooLarge(Exception):
+    """An upload stream went past its size limit"""
+
+
+def iter_chunks(fileobj, chunk_size=STREAM_CHUNK_SIZE, max_size=None):
+    """Read a binary file object in chunks, raising FileTooLarge past ``max_size`` bytes"""
+    total = 0
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            return
+        total += len(chunk)
+        if max_size is not None and total > max_size:
+            raise FileTooLarge(f"Upload exceeds {max_size} bytes")
+        yield chunk
+
+
+def _encrypt_frame(cipher, index, data, final):
+    token = cipher.encrypt(_CHUNK_PREFIX.pack(_FINAL_FLAG if final else 0, index) + data)
+    # Store the token's raw bytes rather than its base64 text
+    raw = base64.urlsafe_b64decode(token)
+    return _FRAME_LENGTH.pack(len(raw)) + raw
+
+
+def encrypt_stream(chunks, encryption_key=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Encrypt an iterable of byte chunks into the chunked stream format.
+
+    Input is re-cut into ``chunk_size`` pieces, so only about one chunk is
+    held in memory at a time whatever the total size.
+    """
+    cipher = _cipher(encryption_key)
+    yield _STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, chunk_size)
+
+    index = 0
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        # Keep the tail buffered so the last frame can carry the final flag
+        while len(buffer) > chunk_size:
+            yield _encrypt_frame(cipher, index, bytes(buffer[:chunk_size]), final=False)
+            del buffer[:chunk_size]
+            index += 1
+    yield _encrypt_frame(cipher, index, bytes(buffer), final=True)
+
+
+def is_stream_payload(prefix):
+    """True if a payload starting with ``prefix`` uses the chunked stream format"""
+    return prefix[:len(STREAM_MAGIC)] == STREAM_MAGIC
+
+
+def _read_exact(source, size):
+    data = source.read(size)
+    if len(data) != size:
+        raise InvalidToken
+    return data
+
+
+def is_primary_payload(source, key_ring=None):
+    """True if a payload's first token decrypts under the ring's primary key.
+
+    Only the header and first frame are read, so this is cheap enough to
+    scan every stored payload during a key rotation.
+    """
+    key_ring = key_ring or KEY_RING
+    chunk_size, header = _read_header(source)
+    if chunk_size is None:
+        return key_ring.is_primary(header + source.read())
+    length = _read_exact(source, _FRAME_LENGTH.size)
+    raw = _read_exact(source, _FRAME_LENGTH.unpack(length)[0])
+    return key_ring.is_primary(base64.urlsafe_b64encode(raw))
+
+
+def _frame_size(chunk_size):
+    """Bytes taken by the frame of one full chunk"""
+    padded = (_CHUNK_PREFIX.size + chunk_size) // 16 * 16 + 16
+    # Fernet adds a version byte, timestamp, IV and HMAC around the AES blocks
+    return _FRAME_LENGTH.size + 1 + 8 + 16 + padded + 32
+
+
+def _read_header(source):
+    """Return the chunk size of a chunked payload, or None for a legacy token.
+
+    A legacy payload's first bytes are returned as the second element so the
+    caller can decrypt it whole.
+    """
+    header = source.read(_STREAM_HEADER.size)
+    if not is_stream_payload(header):
+        return None, header
+    if len(header) != _STREAM_HEADER.size:
+        raise InvalidToken
+    _, version, chunk_size = _STREAM_HEADER.unpack(header)
+    if version != STREAM_VERSION:
+        raise InvalidToken
+    return chunk_size, header
+
+
+def _decrypt_frames(source, cipher, index=0):
+    while True:
+        # Running out of frames before the one marked final fails here
+        length = _read_exact(source, _FRAME_LENGTH.size)
+        raw = _read_exact(source, _FRAME_LENGTH.unpack(length)[0])
+        plaintext = cipher.decrypt(base64.urlsafe_b64encode(raw))
+        flags, frame_index = _CHUNK_PREFIX.unpack_from(plaintext)
+        if frame_index != index:
+            raise InvalidToken
+        yield plaintext[_CHUNK_PREFIX.size:]
+        if flags & _FINAL_FLAG:
+            if source.read(1):
+                raise InvalidToken
+            return
+        index += 1
+
+
+def decrypt_stream(source, encryption_key=None):
+    """Yield the plaintext chunks of an encrypted payload read from ``source``.
+
+    ``source`` is a binary file object. Payloads in the older single-token
+    format are decrypted in one piece.
+    """
+    cipher = _cipher(encryption_key)
+    chunk_size, header = _read_header(source)
+    if chunk_size is None:
+        yield cipher.decrypt(header + source.read())
+        return
+    yield from _decrypt_frames(source, cipher)
+
+
+def decrypt_range(source, start, stop, encryption_key=None):
+    """Yield plaintext bytes ``start`` to ``stop - 1`` of an encrypted payload.
+
+    For chunked payloads in a seekable ``source`` this seeks straight to the
+    frame holding ``start``, since every frame but the last has the same
+    size, and decrypts only the frames the range touches.
+    """
+    cipher = _cipher(encryption_key)
+    chunk_size, header = _read_header(source)
+    if chunk_size is None:
+        yield cipher.decrypt(header + source.read())[start:stop]
+        return
+
+    first = start // chunk_size
+    source.seek(_STREAM_HEADER.size + first * _frame_size(chunk_size))
+    offset = first * chunk_size
+    for chunk in _decrypt_frames(source, cipher, first):
+        piece = chunk[max(start - offset, 0):stop - offset]
+        if piece:
+            yield piece
+        offset += len(chunk)
+        if offset >= stop:
+            return
+
+
+class BatchCryptoService:
+    """Fans encryption and decryption of many payloads out over a thread pool.
+
+    Fernet's AES and HMAC run inside OpenSSL with the GIL released, so a
+    batch spreads across cores instead of running one payload at a time in
+    the request thread. At most ``max_pending`` jobs are queued or running
+    at once; ``submit`` blocks past that, so a large batch cannot pile up
+    in memory. Jobs must not submit further jobs to the same service.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, encryption_key=None):
+        self.max_workers = int(max_workers or os.getenv('CRYPTO_WORKERS', os.cpu_count() or 1))
+        self.max_pending = int(max_pending or os.getenv('CRYPTO_MAX_PENDING', self.max_workers * 4))
+        self.encryption_key = encryption_key
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='crypto')
+
+    def submit(self, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` on the pool, waiting for a free slot first"""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def encrypt(self, data):
+        return self.submit(encrypt_data, data, self.encryption_key)
+
+    def decrypt(self, token):
+        return self.submit(decrypt_data, token, self.encryption_key)
+
+    def map(self, fn, items, return_exceptions=False):
+        """Yield ``fn(item)`` for each item, in input order.
+
+        Items are submitted as slots free up, so ``items`` may be a lazy
+        iterable. With ``return_exceptions`` a failing item yields its
+        exception instead of aborting the rest of the batch.
+        """
+        pending = collections.deque()
+
+        def result(future):
             try:
-                import ipfshttpclient  # type: ignore
-                ipfs_client = ipfshttpclient.connect('/ip4/localhost/tcp/5001/http')
-            except ImportError:
-                print("Warning: ipfshttpclient not installed. IPFS upload skipped.")
-                return None
+                return future.result()
             except Exception as e:
-                print(f"Warning: Could not connect to IPFS: {e}")
-                return None
-
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            temp_file.write(data if isinstance(data, bytes) else data.encode())
-            temp_file_path = temp_file.name
+                if not return_exceptions:
+                    raise
+                return e
 
         try:
-            # Add file to IPFS
-            res = ipfs_client.add(temp_file_path, filename=filename)
-            return res['Hash']
+            for item in items:
+                if len(pending) >= self.max_pending:
+                    yield result(pending.popleft())
+                pending.append(self.submit(fn, item))
+            while pending:
+                yield result(pending.popleft())
         finally:
-            # Clean up temporary file
-            os.unlink(temp_file_path)
+            for future in pending:
+                future.cancel()
+
+    def encrypt_many(self, items, return_exceptions=False):
+        return self.map(lambda data: encrypt_data(data, self.encryption_key), items, return_exceptions)
+
+    def decrypt_many(self, tokens, return_exceptions=False):
+        return self.map(lambda token: decrypt_data(token, self.encryption_key), tokens, return_exceptions)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class IPFSClient:
+    """Long-lived client for the HTTP RPC API of an IPFS (Kubo) node.
+
+    Every call goes through one pooled ``requests`` session, so connections
+    are reused instead of reconnecting per upload or download. ``add``
+    streams bytes, a file object or an iterable of chunks as the multipart
+    body without staging it in a temporary file, and ``cat`` streams the
+    object back in chunks. The node's health is checked with
+    ``/api/v0/version`` and remembered for ``health_interval`` seconds;
+    while it is down, calls fail fast instead of waiting out a timeout.
+    """
+
+    def __init__(self, api_url=None, timeout=None, pool_size=None, health_interval=None, session=None):
+        self.api_url = (api_url or os.getenv('IPFS_API_URL', 'http://127.0.0.1:5001')).rstrip('/')
+        self.timeout = float(timeout or os.getenv('IPFS_TIMEOUT', 30))
+        self.pool_size = int(pool_size or os.getenv('IPFS_POOL_SIZE', 8))
+        self.health_interval = float(health_interval if health_interval is not None
+                                     else os.getenv('IPFS_HEALTH_INTERVAL', 30))
+        self.session = session or self._create_session()
+        self._healthy = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _create_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = requests.Session()
+        # Only connection failures are retried; a streamed request body cannot be replayed
+        retries = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2)
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retries)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _post(self, command, **kwargs):
+        response = self.session.post(f'{self.api_url}/api/v0/{command}', timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def check_health(self, force=False):
+        """True if the node answered ``/api/v0/version`` within the last ``health_interval`` seconds"""
+        with self._lock:
+            if not force and self._healthy is not None and time.monotonic() - self._checked_at < self.health_interval:
+                return self._healthy
+        try:
+            self._post('version').json()
+            healthy = True
+        except Exception as e:
+            print(f"IPFS node at {self.api_url} is unavailable: {e}")
+            healthy = False
+        with self._lock:
+            self._healthy = healthy
+            self._checked_at = time.monotonic()
+        return healthy
+
+    def _mark_unhealthy(self):
+        with self._lock:
+            self._healthy = False
+            self._checked_at = time.monotonic()
+
+    def _require_health(self):
+        if not self.check_health():
+            raise ConnectionError(f"IPFS node at {self.api_url} is unavailable")
+
+    def add(self, data, filename='file', chunk_size=STREAM_CHUNK_SIZE):
+        """Add bytes, a binary file object or an iterable of byte chunks; return the CID"""
+        import requests
+
+        self._require_health()
+        if isinstance(data, str):
+            data = data.encode()
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            chunks = [data]
+        elif hasattr(data, 'read'):
+            chunks = iter_chunks(data, chunk_size)
+        else:
+            chunks = data
+
+        boundary = uuid.uuid4().hex
+        safe_name = filename.replace('"', '')
+
+        def body():
+            yield (f'--{boundary}\r\n'
+                   f'Content-Disposition: form-data; name="file"; filename="{safe_name}"\r\n'
+                   f'Content-Type: application/octet-stream\r\n\r\n').encode()
+            yield from chunks
+            yield f'\r\n--{boundary}--\r\n'.encode()
+
+        try:
+            response = self._post('add', params={'pin': 'true', 'progress': 'false'}, data=body(),
+                                  headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        except requests.ConnectionError:
+            self._mark_unhealthy()
+            raise
+        # One JSON object per added entry; the file is the last one
+        lines = [line for line in response.text.splitlines() if line.strip()]
+        return json.loads(lines[-1])['Hash']
+
+    def iter_cat(self, ipfs_hash, chunk_size=STREAM_CHUNK_SIZE):
+        """Yield the content of ``ipfs_hash`` in chunks as it arrives"""
+        import requests
+
+        self._require_health()
+        try:
+            response = self._post('cat', params={'arg': ipfs_hash}, stream=True)
+        except requests.ConnectionError:
+            self._mark_unhealthy()
+            raise
+        with response:
+            yield from response.iter_content(chunk_size)
+
+    def cat(self, ipfs_hash, sink=None, chunk_size=STREAM_CHUNK_SIZE):
+        """Write the content of ``ipfs_hash`` to ``sink`` and return the byte count.
+
+        ``sink`` is a binary file object or a callable taking each chunk.
+        Without one, the whole content is returned as bytes.
+        """
+        if sink is None:
+            return b''.join(self.iter_cat(ipfs_hash, chunk_size))
+        write = sink.write if hasattr(sink, 'write') else sink
+        size = 0
+        for chunk in self.iter_cat(ipfs_hash, chunk_size):
+            write(chunk)
+            size += len(chunk)
+        return size
+
+    def unpin(self, ipfs_hash):
+        """Unpin ``ipfs_hash`` so the node may garbage-collect it"""
+        self._require_health()
+        self._post('pin/rm', params={'arg': ipfs_hash})
+
+    def close(self):
+        self.session.close()
+
+
+_ipfs_client = None
+_ipfs_client_lock = threading.Lock()
+
+
+def get_ipfs_client():
+    """Return the shared IPFSClient"""
+    global _ipfs_client
+    if _ipfs_client is None:
+        with _ipfs_client_lock:
+            if _ipfs_client is None:
+                _ipfs_client = IPFSClient()
+    return _ipfs_client
+
+
+def upload_to_ipfs(data, filename, ipfs_client=None):
+    """Upload data to IPFS"""
+    try:
+        return (ipfs_client or get_ipfs_client()).add(data, filename)
     except Exception as e:
         print(f"Error uploading to IPFS: {e}")
         return None
 
 
-def download_from_ipfs(ipfs_hash, ipfs_client=None):
-    """Download data from IPFS"""
+def download_from_ipfs(ipfs_hash, ipfs_client=None, sink=None):
+    """Download data from IPFS, as bytes or streamed into ``sink``"""
     try:
-        if not ipfs_client:
-            # Import here to avoid circular imports
-            try:
-                import ipfshttpclient  # type: ignore
-                ipfs_client = ipfshttpclient.connect('/ip4/localhost/tcp/5001/http')
-            except ImportError:
-                print("Warning: ipfshttpclient not installed. IPFS download skipped.")
-                return None
-            except Exception as e:
-                print(f"Warning: Could not connect to IPFS: {e}")
-                return None
-
-        # Get data from IPFS
-        data = ipfs_client.cat(ipfs_hash)
-        return data
+        return (ipfs_client or get_ipfs_client()).cat(ipfs_hash, sink)
     except Exception as e:
         print(f"Error downloading from IPFS: {e}")
         return None